@@ -12,11 +12,16 @@ import os
 import sys
 import textwrap
 import argparse
-import shutil
 import typing as T
 import re
+import traceback
+import pickle
+import concurrent.futures
 from pathlib import Path
 import src.heuristics
+import src.disccache
+import src.profiling as profiling
+from src.fs_index import build_fs_index, DEFAULT_PRUNE, BACKENDS
 from src.meson_codegen import (
     remove_prefix,
     remove_suffix,
@@ -26,9 +31,11 @@ from src.meson_codegen import (
 )
 from src.scan_wmake import (
     parse_files_file,
+    parse_options_file,
     all_parse_options_file,
     EncountedComplexConfig,
     find_all_wmake_dirs,
+    record_options_file_dependencies,
     calc_includes_and_flags,
     calc_libs,
     SimpleSourcefile,
@@ -40,6 +47,7 @@ from src.scan_wmake import (
     TargetType,
     mangle_name,
     optional_deps,
+    options_evaluations,
 )
 
 GROUP_FULL_DIRS = False
@@ -56,9 +64,9 @@ def from_this_directory():
 target_blacklist = ["lib_boost_system", "lib_fftw3", "lib_mpi", "lib_z"]
 
 
-def are_all_files_included(files_srcs, dirname):
+def are_all_files_included(files_srcs, dirname, index):
     reclist = set()
-    for f in dirname.rglob("*.C"):
+    for f in index.rglob_files(dirname, ".C"):
         if "lnInclude" in f.parts:
             continue
         if f not in files_srcs:
@@ -67,20 +75,20 @@ def are_all_files_included(files_srcs, dirname):
     return True, reclist
 
 
-def possible_groupings(files_srcs, fp):
+def possible_groupings(files_srcs, fp, index):
     ret = []
     cur = fp
     ret.append((fp, [fp]))
     while True:
         cur = cur.parent
-        flag, reclist = are_all_files_included(files_srcs, cur)
+        flag, reclist = are_all_files_included(files_srcs, cur, index)
         if not flag:
             break
         ret.append((cur, reclist))
     return ret
 
 
-def group_full_dirs(files_srcs):
+def group_full_dirs(files_srcs, index):
     ret_files = []
     ret_dirs = []
     in_ret = {el: False for el in files_srcs}
@@ -88,9 +96,9 @@ def group_full_dirs(files_srcs):
         if fp.suffix == ".C":
             if in_ret[fp]:
                 continue
-            possible_groups = possible_groupings(files_srcs, fp)
+            possible_groups = possible_groupings(files_srcs, fp, index)
             chosen = max(possible_groups, key=lambda x: len(x[1]))
-            if chosen[0].is_file():
+            if index.is_file(chosen[0]):
                 ret_files.append(chosen[0])
             else:
                 ret_dirs.append(chosen[0])
@@ -150,43 +158,57 @@ class WhitespaceFixer:
         return ret
 
 
+# Everything render_node needs to know about a wmake directory
+class Recipe:
+    def __init__(self, wmake_dir, inter, optionsdict, order_depends, dependencies):
+        self.wmake_dir = wmake_dir
+        self.inter = inter
+        self.optionsdict = optionsdict
+        self.order_depends = order_depends
+        self.dependencies = dependencies
+
+
+# The graph pass: Returns a Node with everything that set_outpaths needs to know. The template is rendered later by
+# render_node, and only for the nodes that survive remove_what_depends_on.
 def wmake_to_meson(project_root, api_version, wmake_dir, parsed_options):
+    with profiling.span("wmake_to_meson", wmake_dir=str(wmake_dir)):
+        return wmake_dir_to_node(project_root, api_version, wmake_dir, parsed_options)
+
+
+def wmake_dir_to_node(project_root, api_version, wmake_dir, parsed_options):
     dirpath = wmake_dir / "Make"
-    optionsdict = parsed_options
-    inter, specials = parse_files_file(project_root, api_version, wmake_dir)
-    includes, cpp_args = calc_includes_and_flags(project_root, wmake_dir, optionsdict)
-    order_depends, dependencies = calc_libs(optionsdict, inter.typ)
-
-    template_part_1 = ""
-    for el in specials:
-        if el == "precision":
-            template_part_1 = """
-            dp_add = files('primitives/Vector/doubleVector/doubleVector.C', 'primitives/Tensor/doubleTensor/doubleTensor.C')
-            sp_add = files('primitives/Vector/floatVector/floatVector.C', 'primitives/Tensor/floatTensor/floatTensor.C')
-            if get_option('WM_PRECISION_OPTION') != 'DP'
-                srcfiles += dp_add
-            elif get_option('WM_PRECISION_OPTION') != 'SP' and get_option('WM_PRECISION_OPTION') != 'SPDP'
-                srcfiles += sp_add
-            endif
-            """
-        elif el == "sunstack1":
-            template_part_1 = """
-            if host_machine.system() == 'sunos'
-                srcfiles += files('dummyPrintStack.C')
-            else
-                srcfiles += files('printStack.C')
-            endif
-            """
-        elif el == "sunstack2":
-            template_part_1 = """
-            if host_machine.system() == 'sunos'
-                srcfiles += files('printStack/dummyPrintStack.C')
-            else
-                srcfiles += files('printStack/printStack.C')
-            endif
-            """
-        else:
-            raise ValueError(f"Unknown special: {el}")
+    with profiling.span("parse_files_file", wmake_dir=str(wmake_dir)):
+        inter = parse_files_file(project_root, api_version, wmake_dir)
+    order_depends, dependencies = calc_libs(parsed_options, inter.typ)
+    ddeps = list(order_depends)
+    if wmake_dir == Path("applications/utilities/surface/surfaceBooleanFeatures"):
+        # Only linked if cgal_dep is found, see render_node
+        ddeps.append("lib_PolyhedronReader")
+    assert inter.varname not in target_blacklist
+    return Node(
+        provides=inter.varname,
+        ddeps=ddeps,
+        template=None,
+        ideal_path=wmake_dir.parts,
+        debuginfo="This recipe originated from " + str(dirpath),
+        recipe=Recipe(wmake_dir, inter, parsed_options, order_depends, dependencies),
+    )
+
+
+# The render pass: Sets node.template. Returns the directories that are scanned when meson configures.
+# index is a fs_index.FsIndex of project_root.
+def render_node(project_root, node, index):
+    recipe = node.recipe
+    wmake_dir = recipe.wmake_dir
+    inter = recipe.inter
+    order_depends = recipe.order_depends
+    dependencies = recipe.dependencies
+    with profiling.span("calc_includes_and_flags", wmake_dir=str(wmake_dir)):
+        includes, cpp_args = calc_includes_and_flags(
+            project_root, wmake_dir, recipe.optionsdict
+        )
+
+    template_part_1 = inter.conditional_blocks()
 
     template = WhitespaceFixer()
 
@@ -224,7 +246,7 @@ def wmake_to_meson(project_root, api_version, wmake_dir, parsed_options):
 
     rec_dirs_srcs = []
     if GROUP_FULL_DIRS:
-        files_srcs, rec_dirs_srcs = group_full_dirs(files_srcs)
+        files_srcs, rec_dirs_srcs = group_full_dirs(files_srcs, index)
     rec_dirs_srcs_quoted = [f"'<PATH>{x}</PATH>'" for x in rec_dirs_srcs]
     srcs_quoted = (
         ["lnInclude_hack"] + other_srcs + [f"'<PATH>{x}</PATH>'" for x in files_srcs]
@@ -262,7 +284,6 @@ def wmake_to_meson(project_root, api_version, wmake_dir, parsed_options):
     """
 
     if wmake_dir == Path("applications/utilities/surface/surfaceBooleanFeatures"):
-        order_depends.append("lib_PolyhedronReader")
         template += textwrap.dedent(
             """
         if cgal_dep.found()
@@ -351,21 +372,71 @@ def wmake_to_meson(project_root, api_version, wmake_dir, parsed_options):
         """
 
     template = Template(str(template))
-    template.make_absolute(project_root / wmake_dir)
+    template.make_absolute(project_root / wmake_dir, index.exists)
 
     template.assert_absolute()
     template.cleanup()
-    assert inter.varname not in target_blacklist
-    return (
-        Node(
-            provides=inter.varname,
-            ddeps=order_depends,
-            template=template,
-            ideal_path=wmake_dir.parts,
-            debuginfo="This recipe originated from " + str(dirpath),
-        ),
-        rec_dirs_srcs,
-    )
+    node.template = template
+    node.recipe = None
+    return rec_dirs_srcs
+
+
+# Calls render_node for every node and returns the union of the results.
+# If jobs > 1, the nodes are split into chunks that are rendered by a pool of worker processes, like in
+# wmake_dirs_to_nodes. Every node is rendered on its own, so the output does not depend on jobs.
+def render_nodes(project_root, nodes, index, jobs=1):
+    nodes = list(nodes)
+    if jobs <= 1 or len(nodes) == 0:
+        ret = set()
+        for node in nodes:
+            with profiling.span("render_node", wmake_dir=str(node.recipe.wmake_dir)):
+                ret.update(render_node(project_root, node, index))
+        return ret
+    num_chunks = min(len(nodes), jobs * 4)
+    chunks = [nodes[i::num_chunks] for i in range(num_chunks)]
+    # The workers must not inherit an open database connection
+    src.disccache.close()
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=jobs,
+        initializer=init_render_worker,
+        initargs=(src.disccache.CACHE_PATH, profiling.worker_flags(), index),
+    ) as executor:
+        results = list(
+            executor.map(render_chunk, [project_root] * num_chunks, chunks)
+        )
+    ret = set()
+    for chunk, (templates, dirs, chunk_profile) in zip(chunks, results):
+        for node, template in zip(chunk, templates):
+            node.template = template
+            node.recipe = None
+        ret.update(dirs)
+        profiling.merge(chunk_profile)
+    return ret
+
+
+# The index of the render workers, see init_render_worker
+render_worker_index = None
+
+
+def init_render_worker(cache_path, profiling_flags, index):
+    global render_worker_index
+    init_worker(cache_path, profiling_flags)
+    render_worker_index = index
+
+
+# Renders the nodes of a chunk in a worker process of render_nodes. Returns their templates, the union of the results
+# of render_node and the profiling.Profile of this worker.
+def render_chunk(project_root, nodes):
+    ret = set()
+    for node in nodes:
+        wmake_dir = node.recipe.wmake_dir
+        try:
+            with profiling.span("render_node", wmake_dir=str(wmake_dir)):
+                ret.update(render_node(project_root, node, render_worker_index))
+        except Exception:
+            raise WmakeDirFailed(wmake_dir, traceback.format_exc())
+    src.disccache.close()
+    return [node.template for node in nodes], ret, profiling.take()
 
 
 def is_subdir(parent, child):
@@ -379,6 +450,162 @@ def is_subdir(parent, child):
     return child.startswith(parent)
 
 
+# Raised in a worker process of wmake_dirs_to_nodes, so that the user learns which wmake directory caused the original exception.
+class WmakeDirFailed(Exception):
+    def __init__(self, wmake_dir, worker_traceback):
+        super().__init__(wmake_dir, worker_traceback)
+        self.wmake_dir = wmake_dir
+        self.worker_traceback = worker_traceback
+
+    def __str__(self):
+        return f"Failed to process the wmake directory '{self.wmake_dir}':\n{self.worker_traceback}"
+
+
+# Returns the results of wmake_to_meson, how the Make/options files were evaluated (see options_evaluations) and
+# the profiling.Profile of this worker
+def wmake_chunk_to_nodes(project_root, api_version, wmake_dirs):
+    options_evaluations.clear()
+    try:
+        with profiling.phase("options parsing"):
+            parsed_options = all_parse_options_file(project_root, wmake_dirs)
+    except Exception:
+        # We parse them one by one to find out which directory is to blame.
+        parsed_options = {}
+        with profiling.phase("options parsing"):
+            for wmake_dir in wmake_dirs:
+                try:
+                    parsed_options[wmake_dir] = parse_options_file(
+                        project_root, wmake_dir
+                    )
+                except Exception:
+                    raise WmakeDirFailed(wmake_dir, traceback.format_exc())
+    ret = []
+    with profiling.phase("files parsing"):
+        for wmake_dir in wmake_dirs:
+            try:
+                with profiling.wmake_dir(wmake_dir):
+                    ret.append(
+                        wmake_to_meson(
+                            project_root, api_version, wmake_dir, parsed_options[wmake_dir]
+                        )
+                    )
+            except Exception:
+                raise WmakeDirFailed(wmake_dir, traceback.format_exc())
+    src.disccache.close()
+    return ret, dict(options_evaluations), profiling.take()
+
+
+def init_worker(cache_path, profiling_flags):
+    src.disccache.configure(cache_path)
+    profiling.init_worker(*profiling_flags)
+
+
+# Returns the result of wmake_to_meson for every directory in wmake_dirs, in the same order as wmake_dirs.
+# If jobs > 1, the directories are split into chunks that are processed by a pool of worker processes. Every directory is independent of the others, and the results are merged in the original order, so the output does not depend on jobs.
+def wmake_dirs_to_nodes(project_root, api_version, wmake_dirs, jobs):
+    if jobs <= 1:
+        with profiling.phase("options parsing"):
+            parsed_options = all_parse_options_file(project_root, wmake_dirs)
+        ret = []
+        with profiling.phase("files parsing"):
+            for wmake_dir in wmake_dirs:
+                with profiling.wmake_dir(wmake_dir):
+                    ret.append(
+                        wmake_to_meson(
+                            project_root, api_version, wmake_dir, parsed_options[wmake_dir]
+                        )
+                    )
+        return ret
+    # Several chunks per worker, so that a single slow chunk does not leave the other workers idle.
+    num_chunks = min(len(wmake_dirs), jobs * 4)
+    chunks = [wmake_dirs[i::num_chunks] for i in range(num_chunks)]
+    # The workers must not inherit an open database connection
+    src.disccache.close()
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=jobs,
+        initializer=init_worker,
+        initargs=(src.disccache.CACHE_PATH, profiling.worker_flags()),
+    ) as executor:
+        results = list(
+            executor.map(
+                wmake_chunk_to_nodes,
+                [project_root] * num_chunks,
+                [api_version] * num_chunks,
+                chunks,
+            )
+        )
+    ret = [None] * len(wmake_dirs)
+    for i, (chunk_result, chunk_evaluations, chunk_profile) in enumerate(results):
+        ret[i::num_chunks] = chunk_result
+        options_evaluations.update(chunk_evaluations)
+        profiling.merge(chunk_profile)
+    return ret
+
+
+def incremental_state_path(project_root):
+    return project_root / "etc" / "meson_helpers" / "incremental_state.pickle"
+
+
+# Returns the state that save_incremental_state wrote in the previous run, or None if it cannot be used.
+def load_incremental_state(project_root, api_version):
+    try:
+        state = pickle.loads(incremental_state_path(project_root).read_bytes())
+    except Exception:
+        # E.g. the file does not exist or a previous run was interrupted while writing it
+        return None
+    if state["code_version"] != src.disccache.code_version():
+        return None
+    if state["api_version"] != api_version:
+        return None
+    state["scanned"] = pickle.loads(state["scanned"])
+    return state
+
+
+# We overwrite the file instead of atomically replacing it, because creating a new file would change the mtime of
+# the directory and thereby invalidate the disccache entry of build_fs_index.
+def save_incremental_state(project_root, state):
+    incremental_state_path(project_root).write_bytes(pickle.dumps(state))
+
+
+# Returns the inputs of wmake_to_meson for wmake_dir, other than the code of this generator
+def wmake_dir_dependencies(project_root, wmake_dir):
+    with src.disccache.recording() as deps:
+        src.disccache.depends_on_path(project_root / wmake_dir / "Make" / "files")
+        src.disccache.depends_on_path(project_root / wmake_dir / "Make" / "options")
+        record_options_file_dependencies(project_root, wmake_dir)
+    return deps
+
+
+# Like wmake_dirs_to_nodes, but reuses the result of the previous run for every directory whose inputs did not change.
+# Returns the results and a dict that maps every wmake_dir to (dependencies, result), which should be passed to the next run.
+def wmake_dirs_to_nodes_incremental(
+    project_root, api_version, wmake_dirs, jobs, old_scanned
+):
+    todo = [
+        wmake_dir
+        for wmake_dir in wmake_dirs
+        if wmake_dir not in old_scanned or not old_scanned[wmake_dir][0].still_valid()
+    ]
+    print(
+        f"Reusing {len(wmake_dirs) - len(todo)} of {len(wmake_dirs)} wmake directories from the previous run."
+    )
+    # The dependencies are recorded before the scan, as the functions cached by disccache do. If a file is changed during the
+    # scan, the next run sees that it changed after it was recorded and scans the directory again.
+    dependencies = {
+        wmake_dir: wmake_dir_dependencies(project_root, wmake_dir) for wmake_dir in todo
+    }
+    fresh = dict(
+        zip(todo, wmake_dirs_to_nodes(project_root, api_version, todo, jobs))
+    )
+    scanned = {}
+    for wmake_dir in wmake_dirs:
+        if wmake_dir in fresh:
+            scanned[wmake_dir] = (dependencies[wmake_dir], fresh[wmake_dir])
+        else:
+            scanned[wmake_dir] = old_scanned[wmake_dir]
+    return [scanned[wmake_dir][1] for wmake_dir in wmake_dirs], scanned
+
+
 def get_api_version(project_root):
     for line in (project_root / "META-INFO" / "api-info").read_text().split():
         if line.startswith("api="):
@@ -395,7 +622,7 @@ def inner_generate_meson_build(project_root, args):
         outp = project_root / outp
         assert outp not in files_written
         files_written.add(outp)
-        shutil.copyfile(Path(__file__).parent / "src" / inp, outp)
+        totdesc.manifest.write(outp, (Path(__file__).parent / "src" / inp).read_bytes())
 
     if not (project_root / "bin" / "foamEtcFile").is_file():
         raise ValueError(
@@ -408,25 +635,53 @@ def inner_generate_meson_build(project_root, args):
     api_version = get_api_version(project_root)
 
     broken_dirs = [Path(p) for p in src.heuristics.broken_dirs()]
-    wmake_dirs = find_all_wmake_dirs(project_root)
+    with profiling.phase("discovery"):
+        index = build_fs_index(
+            project_root, tuple(DEFAULT_PRUNE + args.prune), args.list_files
+        )
+        if index.backend != args.list_files:
+            print(
+                f"Warning: {project_root} is not the toplevel directory of a git repository, walking the filesystem instead."
+            )
+        wmake_dirs = find_all_wmake_dirs(project_root, index)
+    profiling.count("wmake_dirs", len(wmake_dirs))
     totdesc = BuildDesc(project_root)
-    parsed_options = all_parse_options_file(project_root, wmake_dirs)
-    all_configure_time_recursively_scanned_dirs = set()
 
     broken_provides = []
-    for wmake_dir in wmake_dirs:
-        node, configure_time_recursively_scanned_dirs = wmake_to_meson(
-            project_root, api_version, wmake_dir, parsed_options[wmake_dir]
+    if args.incremental:
+        if GROUP_FULL_DIRS:
+            raise ValueError("--incremental does not support GROUP_FULL_DIRS")
+        old_state = load_incremental_state(project_root, api_version)
+        if old_state is None:
+            old_state = {"scanned": {}, "placement": None}
+        results, scanned = wmake_dirs_to_nodes_incremental(
+            project_root,
+            api_version,
+            wmake_dirs,
+            args.jobs,
+            old_state["scanned"],
         )
-        if wmake_dir in broken_dirs:
-            broken_provides.append(node.provides)
-            continue
-        all_configure_time_recursively_scanned_dirs.update(
-            configure_time_recursively_scanned_dirs
-        )
-        totdesc.add_node(node)
+        # Pickled right away, because the nodes will be modified below
+        new_state = {
+            "code_version": src.disccache.code_version(),
+            "api_version": api_version,
+            "scanned": pickle.dumps(scanned),
+        }
+    else:
+        results = wmake_dirs_to_nodes(project_root, api_version, wmake_dirs, args.jobs)
+    src.disccache.close()
+    print(
+        f"{options_evaluations['python']} Make/options files were evaluated in Python, {options_evaluations['make']} needed make, {options_evaluations['cache']} were found in the cache."
+    )
+    with profiling.phase("pruning"):
+        for wmake_dir, node in zip(wmake_dirs, results):
+            if wmake_dir in broken_dirs:
+                broken_provides.append(node.provides)
+                continue
+            totdesc.add_node(node)
 
-    totdesc.remove_what_depends_on(broken_provides)
+        totdesc.remove_what_depends_on(broken_provides)
+    profiling.count("targets", len(totdesc.elements))
     if len(totdesc.elements) < 100:
         print(
             "WARNING: An unusually low amount of targets were found. We probably did not find the correct OpenFOAM folder"
@@ -439,11 +694,6 @@ def inner_generate_meson_build(project_root, args):
     recursive_regen_dirs_joined = ", ".join([f"'{el}'" for el in recursive_regen_dirs])
     recursive_regen_dirs = [project_root / el for el in recursive_regen_dirs]
 
-    for dirp in all_configure_time_recursively_scanned_dirs:
-        assert any(
-            is_subdir(el, dirp) for el in recursive_regen_dirs
-        ), "If a file in the directory {dirp} or in one of its (recursive) subdirectories is created, meson will not reconfigure itself, but a reconfiguration would be necessary"
-
     optional_deps_joined = ""
     for name, typ in optional_deps.items():
         if typ in ["dep", "broken"]:
@@ -536,6 +786,8 @@ def inner_generate_meson_build(project_root, args):
     # lnInclude_hack ensures that `ls recursive_include_dirs/some/dir` would show symlinks to all files shown by `find meson.source_root()/some/dir -name "*.[CHh]"` # todo: link to relevant documentation here
     """
     ).strip()
+    # create_all_symlinks.py lists the source files with git ls-files if we did so too
+    ln_include_list_files = "" if index.backend == "filesystem" else " '--git',"
     if LN_INCLUDE_MODEL == "regen_on_reconfigure":
         mainsrc += textwrap.dedent(
             """
@@ -545,7 +797,7 @@ def inner_generate_meson_build(project_root, args):
             command: [
                 meson.source_root() / 'etc' / 'meson_helpers' / 'create_all_symlinks.py',
                 meson.source_root(),
-                recursive_include_dirs,
+                recursive_include_dirs,LN_INCLUDE_LIST_FILES
                 run_command('date', check: true).stdout().split('\\n')[0] # To make sure that this target is rerun if meson is reconfigured. split('\\n')[0] is there because build.ninja would get a bit ugly otherwise.
                 ])
         """
@@ -559,12 +811,13 @@ def inner_generate_meson_build(project_root, args):
             command: [
                 meson.source_root() / 'etc' / 'meson_helpers' / 'create_all_symlinks.py',
                 meson.source_root(),
-                recursive_include_dirs,
+                recursive_include_dirs,LN_INCLUDE_LIST_FILES
                 ], build_always_stale: true)
         """
         )
     else:
         raise ValueError
+    mainsrc = mainsrc.replace("LN_INCLUDE_LIST_FILES", ln_include_list_files)
     if recursive_regen_dirs_joined != "":
         mainsrc += textwrap.dedent(
             f"""
@@ -582,6 +835,7 @@ def inner_generate_meson_build(project_root, args):
         print(
             "WARNING: You enabled EXPLAIN_CODEGEN. Attempting to build will not work due to broken meson.build files."
         )
+        render_nodes(project_root, totdesc.elements.values(), index)
         totdesc.explainatory_helper()
         sys.exit(0)
 
@@ -606,39 +860,83 @@ def inner_generate_meson_build(project_root, args):
             "applications/utilities/mesh"
         ).parts
 
-    totdesc.set_outpaths()
-    totdesc.writeToFileSystem(files_written)
-    Path(project_root / "etc/meson_helpers").mkdir(exist_ok=True)
-    helper_scripts = [
-        "get_version.sh",
-        "set_versions_in_Cver.sh",
-        "m4lemon.sh",
-        "create_all_symlinks.py",
-    ]
-    if GROUP_FULL_DIRS:
-        helper_scripts.append("rec_C.sh")
-    for fn in helper_scripts:
-        outp = Path("etc/meson_helpers") / fn
-        copy_file_to_output(fn, outp)
-        os.chmod(project_root / outp, 0o755)
+    with profiling.phase("placement"):
+        if args.incremental:
+            placement_input = totdesc.placement_input()
+            old_placement = old_state["placement"]
+            if old_placement is not None and old_placement[0] == placement_input:
+                print("The dependency graph did not change, reusing the previous placement.")
+                totdesc.set_outpaths(old_placement[1])
+            else:
+                totdesc.set_outpaths(jobs=args.jobs)
+            new_state["placement"] = (
+                placement_input,
+                {k: el.outpath for k, el in totdesc.elements.items()},
+            )
+        else:
+            totdesc.set_outpaths(jobs=args.jobs)
 
-    copy_file_to_output("meson_options.txt", "meson_options.txt")
-    copy_file_to_output("comptest.C", "src/OSspecific/POSIX/signals/comptest.C")
+    with profiling.phase("render"):
+        all_configure_time_recursively_scanned_dirs = render_nodes(
+            project_root, totdesc.elements.values(), index, args.jobs
+        )
+    for dirp in all_configure_time_recursively_scanned_dirs:
+        assert any(
+            is_subdir(el, dirp) for el in recursive_regen_dirs
+        ), "If a file in the directory {dirp} or in one of its (recursive) subdirectories is created, meson will not reconfigure itself, but a reconfiguration would be necessary"
 
-    old_meson_build = [
-        fp for fp in project_root.rglob("meson.build") if fp not in files_written
-    ]
+    with profiling.phase("writing"):
+        totdesc.writeToFileSystem(files_written)
+    with profiling.phase("helper copying"):
+        Path(project_root / "etc/meson_helpers").mkdir(exist_ok=True)
+        helper_scripts = [
+            "get_version.sh",
+            "set_versions_in_Cver.sh",
+            "m4lemon.sh",
+            "create_all_symlinks.py",
+        ]
+        if GROUP_FULL_DIRS:
+            helper_scripts.append("rec_C.sh")
+        for fn in helper_scripts:
+            outp = Path("etc/meson_helpers") / fn
+            copy_file_to_output(fn, outp)
+            os.chmod(project_root / outp, 0o755)
+
+        copy_file_to_output("meson_options.txt", "meson_options.txt")
+        copy_file_to_output("comptest.C", "src/OSspecific/POSIX/signals/comptest.C")
+    if args.incremental:
+        save_incremental_state(project_root, new_state)
+
+    old_meson_build = totdesc.manifest.stale_files()
+    if old_meson_build is None:
+        # There is no manifest from a previous run
+        # The generated meson.build files are usually not known to git
+        candidates = (
+            index.files_named("meson.build")
+            if index.complete
+            else project_root.rglob("meson.build")
+        )
+        old_meson_build = [fp for fp in candidates if fp not in files_written]
     if args.delete_meson_build:
         for fp in old_meson_build:
-            fp.unlink()
+            if fp.exists():
+                totdesc.manifest.delete(fp)
     else:
+        old_meson_build = [fp for fp in old_meson_build if fp.exists()]
         if len(old_meson_build) > 0:
             print(
-                f"WARNING: The follow {len(old_meson_build)} files exists, but they are not used. They were not created by this script (at least not in this run). You might want to delete them manually, or pass --delete-meson-build to delete them automatically."
+                f"WARNING: The following {len(old_meson_build)} meson.build files exist, but they were not generated in this run. They are left over from a previous run or were not created by this script. You might want to delete them manually, or pass --delete-meson-build to delete them automatically."
             )
             for fp in old_meson_build:
                 print(f"\t{fp}")
             print("")
+    totdesc.manifest.save()
+    profiling.count("files_written", totdesc.manifest.num_written)
+    profiling.count("files_unchanged", totdesc.manifest.num_unchanged)
+    profiling.count("files_deleted", totdesc.manifest.num_deleted)
+    print(
+        f"{totdesc.manifest.num_written} files were written, {totdesc.manifest.num_unchanged} were unchanged and {totdesc.manifest.num_deleted} were deleted."
+    )
 
     return files_written
 
@@ -655,17 +953,97 @@ def main():
         action="store_true",
         help="Delete meson.build files that were not generated by this script in this run.",
     )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of worker processes used to scan the wmake directories, to decide in which meson.build file every target is put and to render the meson.build files.",
+    )
+    parser.add_argument(
+        "--prune",
+        action="append",
+        default=[],
+        metavar="DIR",
+        help=f"Do not look for wmake directories or source files in directories with this name. If DIR starts with '/', it is relative to the OpenFOAM repository. Can be given multiple times, in addition to {DEFAULT_PRUNE}.",
+    )
+    parser.add_argument(
+        "--list-files",
+        choices=BACKENDS,
+        default="filesystem",
+        help="How to find the wmake directories and source files. 'git' uses 'git ls-files', which is faster if there are many untracked files, but ignores untracked source files. 'git-untracked' also lists the untracked files that are not ignored by .gitignore. If the OpenFOAM repository is not a git repository, 'git' and 'git-untracked' fall back to 'filesystem'.",
+    )
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Remember the result of this run and only rescan the wmake directories whose Make/files or Make/options changed since the previous --incremental run.",
+    )
+    parser.add_argument(
+        "--cache-file",
+        type=Path,
+        default=src.disccache.default_cache_path(),
+        help="SQLite database used to cache the results of scanning the wmake directories between runs. Default: %(default)s",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Do not read or write the cache.",
+    )
+    parser.add_argument(
+        "--profile",
+        type=Path,
+        metavar="FILE",
+        help="Write the time spent in every phase and some counters as JSON to FILE.",
+    )
+    parser.add_argument(
+        "--trace-out",
+        type=Path,
+        metavar="FILE",
+        help="Write a trace of this run to FILE, in the Chrome trace event format. Open it with https://ui.perfetto.dev or chrome://tracing.",
+    )
+    parser.add_argument(
+        "--memory-report",
+        type=Path,
+        metavar="FILE",
+        help="Write the peak and retained memory of every phase and the allocation sites that use the most memory as JSON to FILE. Only the main process is measured. This makes the run much slower.",
+    )
     args = parser.parse_args()
+    if not args.no_cache:
+        src.disccache.configure(args.cache_file.resolve())
     project_root = getattr(args, "project-dir")
     if not project_root.exists():
         print(f"ERROR: '{project_root}' does not exist")
         sys.exit(1)
     project_root = project_root.resolve()
-    files_written = inner_generate_meson_build(project_root, args)
+    if args.profile is not None:
+        profiling.enable()
+    if args.trace_out is not None:
+        profiling.enable_tracing()
+    if args.memory_report is not None:
+        profiling.enable_memory_report()
+    with profiling.phase("total"):
+        files_written = inner_generate_meson_build(project_root, args)
+    if args.profile is not None:
+        profiling.write_report(
+            args.profile,
+            {
+                "project_dir": str(project_root),
+                "jobs": args.jobs,
+                "incremental": args.incremental,
+                "cache": not args.no_cache,
+            },
+        )
+    if args.trace_out is not None:
+        profiling.write_trace(args.trace_out)
+    if args.memory_report is not None:
+        profiling.write_memory_report(
+            args.memory_report,
+            {"project_dir": str(project_root), "jobs": args.jobs},
+        )
     print(
         textwrap.dedent(
             f"""
-    Finished creating meson.build files, wrote {len(files_written)} files to disk.
+    Finished creating meson.build files, generated {len(files_written)} files.
     You can now use openfoam like this:
     cd '{project_root}'
     meson setup some_path
@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+#--------------------------------*- python -*----------------------------------
+#
+# Copyright (C) 2023 Volker Weissmann
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+# Description
+#   Times the stages of generate_meson_build.py on synthetic trees created by
+#   synthetic_foam.py and writes the results as JSON. The disccache is not
+#   used, so every stage does its full work.
+#
+#   Usage: benchmark.py [--scales 1 5 20] [--repeat N] [--jobs N] [--output FILE]
+#
+#------------------------------------------------------------------------------
+
+import io
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import contextlib
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import generate_meson_build
+from src.fs_index import build_fs_index, DEFAULT_PRUNE
+from src.meson_codegen import BuildDesc
+from src.grouped_topo_sort import grouped_topo_sort
+from src.scan_wmake import find_all_wmake_dirs, all_parse_options_file
+from src.synthetic_foam import make_synthetic_tree
+
+STAGES = [
+    "build_fs_index",
+    "find_all_wmake_dirs",
+    "all_parse_options_file",
+    "wmake_to_meson",
+    "grouped_topo_sort",
+    "set_outpaths",
+    "render_nodes",
+    "writeToFileSystem",
+]
+
+
+class StageTimer:
+    def __init__(self):
+        self.times = {}
+
+    @contextlib.contextmanager
+    def stage(self, name):
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        # The generator is quite talkative
+        with contextlib.redirect_stdout(io.StringIO()):
+            yield
+        self.times[name] = {
+            "wall": time.perf_counter() - wall,
+            "cpu": time.process_time() - cpu,
+        }
+
+
+# Runs the pipeline of inner_generate_meson_build on the tree at root, without the parts that do not depend on the
+# size of the tree. Returns the times of every stage and some numbers that describe the tree.
+def run_pipeline(root, jobs):
+    timer = StageTimer()
+    api_version = generate_meson_build.get_api_version(root)
+    with timer.stage("build_fs_index"):
+        index = build_fs_index(root, tuple(DEFAULT_PRUNE), "filesystem")
+    with timer.stage("find_all_wmake_dirs"):
+        wmake_dirs = find_all_wmake_dirs(root, index)
+    with timer.stage("all_parse_options_file"):
+        parsed_options = all_parse_options_file(root, wmake_dirs)
+    with timer.stage("wmake_to_meson"):
+        nodes = [
+            generate_meson_build.wmake_to_meson(
+                root, api_version, wmake_dir, parsed_options[wmake_dir]
+            )
+            for wmake_dir in wmake_dirs
+        ]
+    totdesc = BuildDesc(root)
+    for node in nodes:
+        totdesc.add_node(node)
+    with timer.stage("grouped_topo_sort"):
+        grouped_topo_sort(totdesc.elements)
+    # Runs grouped_topo_sort again
+    with timer.stage("set_outpaths"):
+        totdesc.set_outpaths(jobs=jobs)
+    with timer.stage("render_nodes"):
+        generate_meson_build.render_nodes(root, totdesc.elements.values(), index, jobs)
+    files_written = set()
+    with timer.stage("writeToFileSystem"):
+        totdesc.writeToFileSystem(files_written)
+    stats = {
+        "wmake_dirs": len(wmake_dirs),
+        "targets": len(totdesc.elements),
+        "edges": sum(len(el.ddeps) for el in totdesc.elements.values()),
+        "moved_targets": sum(
+            el.outpath != el.ideal_path for el in totdesc.elements.values()
+        ),
+        "files_written": len(files_written),
+    }
+    return timer.times, stats
+
+
+def benchmark(scales, repeat, seed, workdir, jobs):
+    results = []
+    for scale in scales:
+        root = Path(workdir) / f"scale_{scale}"
+        if root.exists():
+            shutil.rmtree(root)
+        start = time.perf_counter()
+        make_synthetic_tree(root, scale, seed)
+        generation_time = time.perf_counter() - start
+        best = None
+        for _ in range(repeat):
+            times, stats = run_pipeline(root.resolve(), jobs)
+            if best is None:
+                best = times
+            else:
+                for name, t in times.items():
+                    best[name] = min(best[name], t, key=lambda x: x["wall"])
+        result = {
+            "scale": scale,
+            "tree_generation_seconds": generation_time,
+            **stats,
+            "stages": best,
+            "total_wall": sum(t["wall"] for t in best.values()),
+        }
+        print(
+            f"scale {scale}: {stats['wmake_dirs']} wmake directories, {result['total_wall']:.2f} seconds",
+            file=sys.stderr,
+        )
+        results.append(result)
+        shutil.rmtree(root)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmarks generate_meson_build.py on synthetic trees."
+    )
+    parser.add_argument(
+        "--scales",
+        type=float,
+        nargs="+",
+        default=[1, 5, 20],
+        help="Sizes of the trees, 1 is about the size of OpenFOAM. Default: %(default)s",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=1,
+        help="Run the pipeline this many times on every tree and keep the fastest time of every stage.",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="Number of worker processes for the set_outpaths and render_nodes stages. Default: %(default)s",
+    )
+    parser.add_argument(
+        "--workdir",
+        type=Path,
+        default=None,
+        help="Where the trees are created. Default: a temporary directory",
+    )
+    parser.add_argument(
+        "--output",
+        type=Path,
+        default=Path("benchmark.json"),
+        help="Default: %(default)s",
+    )
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = args.workdir if args.workdir is not None else tmp
+        results = benchmark(args.scales, args.repeat, args.seed, workdir, args.jobs)
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "seed": args.seed,
+        "repeat": args.repeat,
+        "jobs": args.jobs,
+        "stages": STAGES,
+        "results": results,
+    }
+    args.output.write_text(json.dumps(report, indent=2) + "\n")
+
+
+if __name__ == "__main__":
+    main()
+
+#------------------------------------------------------------------------------
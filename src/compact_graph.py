@@ -0,0 +1,137 @@
+#!/bin/false
+#--------------------------------*- python -*----------------------------------
+#
+# Copyright (C) 2023 Volker Weissmann
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+# Description
+#   A dependency graph with integer ids instead of target names. The edges are
+#   stored in compressed sparse row form: The successors of all nodes are
+#   concatenated into a single array, and a second array stores where the
+#   successors of every node start. Paths of directories are interned the same
+#   way, so that comparing them does not require comparing tuples of strings.
+#
+#------------------------------------------------------------------------------
+
+from array import array
+
+
+# The edges of nodes i are items[start[i]:start[i + 1]]
+def compressed_rows(num_nodes, edges):
+    start = array("l", [0] * (num_nodes + 1))
+    for src, dest in edges:
+        start[src + 1] += 1
+    for i in range(num_nodes):
+        start[i + 1] += start[i]
+    items = array("l", [0] * start[num_nodes])
+    fill = array("l", start[:num_nodes])
+    for src, dest in edges:
+        items[fill[src]] = dest
+        fill[src] += 1
+    return start, items
+
+
+class CompactGraph:
+    # names[i] is the name of the node with the id i
+    names: list
+    # The inverse of names
+    ids: dict
+    # The ids 0, 1, ..., num_keys - 1 are the keys of the mapping the graph was built from, in the same order. The
+    # other ids are dependencies that are not a key.
+    num_keys: int
+    succ_start: array
+    succ: array
+    pred_start: array
+    pred: array
+
+    # deps maps every name to an iterable of the names it depends on
+    def __init__(self, deps):
+        self.names = list(deps)
+        self.ids = {name: i for i, name in enumerate(self.names)}
+        self.num_keys = len(self.names)
+        edges = []
+        for i, name in enumerate(deps):
+            for dep in deps[name]:
+                if dep not in self.ids:
+                    self.ids[dep] = len(self.names)
+                    self.names.append(dep)
+                edges.append((i, self.ids[dep]))
+        self.succ_start, self.succ = compressed_rows(len(self.names), edges)
+        self.pred_start, self.pred = compressed_rows(
+            len(self.names), [(dest, src) for src, dest in edges]
+        )
+
+    def __len__(self):
+        return len(self.names)
+
+    # The dependencies of i, in the order in which they were given
+    def successors(self, i):
+        return self.succ[self.succ_start[i] : self.succ_start[i + 1]]
+
+    # The nodes that depend on i, in the order of their ids
+    def predecessors(self, i):
+        return self.pred[self.pred_start[i] : self.pred_start[i + 1]]
+
+    # Returns a bytearray that is 1 for every node that has a path to a node in ids (including ids themselves)
+    def ancestors(self, ids):
+        ret = bytearray(len(self.names))
+        stack = list(ids)
+        for i in stack:
+            ret[i] = 1
+        while len(stack) != 0:
+            i = stack.pop()
+            for pred in self.predecessors(i):
+                if ret[pred] == 0:
+                    ret[pred] = 1
+                    stack.append(pred)
+        return ret
+
+
+# Interns paths like ('applications', 'solvers', 'DNS') as integers. The id 0 is the empty path.
+class PathTable:
+    # parent[d] is the id of the path without its last component. The parent of 0 is -1.
+    parent: array
+    # depth[d] is the number of components of the path
+    depth: array
+    # last[d] is the last component of the path
+    last: list
+    # Maps (parent id, component) to the id of the path
+    children: dict
+
+    def __init__(self):
+        self.parent = array("l", [-1])
+        self.depth = array("l", [0])
+        self.last = [None]
+        self.children = {}
+
+    def intern(self, path):
+        d = 0
+        for x in path:
+            child = self.children.get((d, x))
+            if child is None:
+                child = len(self.last)
+                self.children[(d, x)] = child
+                self.parent.append(d)
+                self.depth.append(self.depth[d] + 1)
+                self.last.append(x)
+            d = child
+        return d
+
+    def path(self, d):
+        ret = []
+        while d != 0:
+            ret.append(self.last[d])
+            d = self.parent[d]
+        return tuple(reversed(ret))
+
+    # Returns the id of the first depth components of the path d
+    def ancestor(self, d, depth):
+        while self.depth[d] > depth:
+            d = self.parent[d]
+        return d
+
+    # Like meson_codegen.starts_with, but for ids
+    def starts_with(self, a, b):
+        return self.depth[a] <= self.depth[b] and self.ancestor(b, self.depth[a]) == a
+
+#------------------------------------------------------------------------------
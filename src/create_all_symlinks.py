@@ -11,16 +11,62 @@
 
 import sys
 import os
+import subprocess
 from pathlib import Path
 
 source_root = Path(sys.argv[1])
 build_root = Path(sys.argv[2])
+# If --git is passed, the files are listed with git ls-files instead of walking source_root
+use_git = "--git" in sys.argv[3:]
+
+
+def run_git(*args):
+    return subprocess.run(
+        ["git", "-C", source_root, *args],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        check=True,
+    ).stdout.split(b"\0")
+
+
+# Returns the relative paths of all files that exist and are tracked or untracked but not ignored, or None if git fails
+def list_git_files():
+    try:
+        files = run_git("ls-files", "-z", "--cached", "--others", "--exclude-standard")
+        deleted = set(run_git("ls-files", "-z", "--deleted"))
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return [os.fsdecode(fp) for fp in dict.fromkeys(files) if fp != b"" and fp not in deleted]
+
+
+git_files = list_git_files() if use_git else None
+if git_files is not None:
+    # Maps every directory to all source files in it or its subdirectories
+    git_sources = {}
+    git_make_dirs = set()
+    for fp in git_files:
+        parts = fp.split("/")
+        if parts[-1][-2:] in [".C", ".H", ".h"]:
+            for i in range(len(parts)):
+                git_sources.setdefault("/".join(parts[:i]), []).append(fp)
+        for i, part in enumerate(parts[:-1]):
+            if part == "Make":
+                git_make_dirs.add("/".join(parts[:i]))
+
+
+def sources_in_dir(subdir):
+    if git_files is None:
+        return subdir.rglob("*.[CHh]")
+    rel = subdir.relative_to(source_root).as_posix()
+    if rel == ".":
+        rel = ""
+    return [source_root / fp for fp in git_sources.get(rel, [])]
 
 
 def create_symlinks_for_dir(subdir):
     outdir = build_root / subdir.relative_to(source_root)
     outdir.mkdir(parents=True, exist_ok=True)
-    for fp in subdir.rglob("*.[CHh]"):
+    for fp in sources_in_dir(subdir):
         if "lnInclude" in fp.parts:
             continue
         if (
@@ -43,11 +89,15 @@ def create_symlinks_for_dir(subdir):
             outfile.symlink_to(fp)
 
 
-for subdir in source_root.rglob("Make"):
-    if not os.path.isdir(subdir):
-        continue
-    subdir = subdir.parent
-    create_symlinks_for_dir(subdir)
+if git_files is None:
+    for subdir in source_root.rglob("Make"):
+        if not os.path.isdir(subdir):
+            continue
+        subdir = subdir.parent
+        create_symlinks_for_dir(subdir)
+else:
+    for subdir in sorted(git_make_dirs):
+        create_symlinks_for_dir(source_root / subdir)
 
 for (
     el
@@ -0,0 +1,328 @@
+#!/bin/false
+#--------------------------------*- python -*----------------------------------
+#
+# Copyright (C) 2023 Volker Weissmann
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+# Description
+#   A persistent cache for the scanning functions in scan_wmake.py, stored in a
+#   single SQLite database that can be shared by concurrent runs (SQLite does
+#   the file locking).
+#
+#   An entry is keyed on the name and the arguments of the function, the
+#   (mtime, size) of its static inputs (e.g. Make/files) and a hash of the
+#   source code of this directory. While the function runs, it can call
+#   depends_on_path, depends_on_env and depends_on_output to record further
+#   inputs. Those are stored alongside the result and checked again before an
+#   entry is used.
+#
+#   Note that the output of $(shell ...) in Make/options is not tracked.
+#
+#   New entries are kept in memory and written in one short transaction every
+#   COMMIT_INTERVAL entries, so that no transaction stays open while we scan.
+#   If another process holds the lock for longer than BUSY_TIMEOUT, we do not
+#   wait: A lookup is treated as a cache miss and the pending entries are
+#   dropped.
+#
+#------------------------------------------------------------------------------
+
+import os
+import time
+import sqlite3
+import pickle
+import subprocess
+import hashlib
+import functools
+import contextlib
+from pathlib import Path
+from . import profiling
+
+# The database file. None disables the cache.
+CACHE_PATH = None
+# If the database grows larger than this, the least recently used entries are deleted.
+CACHE_MAX_BYTES = 256 * 1024 * 1024
+# New entries are written in one transaction after this many of them
+COMMIT_INTERVAL = 500
+# Seconds we wait for the lock of another process before we give up
+BUSY_TIMEOUT = 1.0
+
+_connection = None
+_connection_pid = None
+# Maps the key of every entry that was not written yet to its blob
+_pending_stores = {}
+_pending_hits = []
+# One Dependencies object for every active recording, innermost last
+_recording_stack = []
+
+
+def default_cache_path():
+    base = os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+    return Path(base) / "foam_meson" / "cache.sqlite"
+
+
+def configure(path):
+    global CACHE_PATH
+    close()
+    CACHE_PATH = path
+
+
+def stamp(path):
+    profiling.count("files_stated")
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+
+# Editing the generator invalidates every entry
+@functools.lru_cache(maxsize=None)
+def code_version():
+    h = hashlib.sha256()
+    for fp in sorted(Path(__file__).parent.glob("*.py")):
+        h.update(fp.read_bytes())
+    return h.hexdigest()
+
+
+# Returns the standard output of command, or None if it fails
+def command_output(command):
+    profiling.count("subprocesses")
+    try:
+        return subprocess.run(
+            command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True
+        ).stdout
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def output_hash(output):
+    if output is None:
+        return None
+    return hashlib.sha256(output).hexdigest()
+
+
+class Dependencies:
+    def __init__(self):
+        self.paths = {}
+        self.env = {}
+        # Maps every command, as a tuple, to the output_hash of its output
+        self.outputs = {}
+
+    # The commands are run last, because they are the most expensive check
+    def still_valid(self):
+        return (
+            all(stamp(path) == st for path, st in self.paths.items())
+            and all(os.environ.get(name) == value for name, value in self.env.items())
+            and all(
+                output_hash(command_output(list(command))) == h
+                for command, h in self.outputs.items()
+            )
+        )
+
+
+def depends_on_path(path):
+    for deps in _recording_stack:
+        deps.paths[str(path)] = stamp(path)
+
+
+def depends_on_env(name):
+    for deps in _recording_stack:
+        deps.env[name] = os.environ.get(name)
+
+
+# Runs command and returns its standard output, or None if it fails. The entry is only used again if the command
+# prints the same output then.
+def depends_on_output(command):
+    output = command_output(command)
+    for deps in _recording_stack:
+        deps.outputs[tuple(command)] = output_hash(output)
+    return output
+
+
+# Collects everything that is passed to depends_on_path, depends_on_env and depends_on_output inside of the with block
+@contextlib.contextmanager
+def recording():
+    deps = Dependencies()
+    _recording_stack.append(deps)
+    try:
+        yield deps
+    finally:
+        _recording_stack.remove(deps)
+
+
+# True if e means that another process holds the lock of the database
+def is_busy(e):
+    message = str(e)
+    return "locked" in message or "busy" in message
+
+
+def connection():
+    global _connection, _connection_pid
+    if CACHE_PATH is None:
+        return None
+    if _connection_pid != os.getpid():
+        # Never reuse a connection that was inherited via fork
+        _connection = None
+        _connection_pid = os.getpid()
+        _pending_stores.clear()
+        _pending_hits.clear()
+        Path(CACHE_PATH).parent.mkdir(parents=True, exist_ok=True)
+        # isolation_level=None: Every statement outside of an explicit BEGIN is committed immediately
+        con = sqlite3.connect(CACHE_PATH, timeout=BUSY_TIMEOUT, isolation_level=None)
+        try:
+            # With WAL, readers do not block the writer and the writer does not block readers
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute("PRAGMA synchronous=NORMAL")
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL, last_used REAL NOT NULL)"
+            )
+        except sqlite3.OperationalError as e:
+            if not is_busy(e):
+                raise
+            # We try again in the next process, this one runs without the cache
+            con.close()
+            return None
+        _connection = con
+    return _connection
+
+
+# Runs func(con) in a single write transaction. Returns False if the database was locked for longer than BUSY_TIMEOUT.
+def write_transaction(func):
+    con = connection()
+    if con is None:
+        return False
+    try:
+        con.execute("BEGIN IMMEDIATE")
+    except sqlite3.OperationalError as e:
+        if not is_busy(e):
+            raise
+        return False
+    try:
+        func(con)
+        con.execute("COMMIT")
+    except sqlite3.OperationalError as e:
+        con.execute("ROLLBACK")
+        if not is_busy(e):
+            raise
+        return False
+    except BaseException:
+        con.execute("ROLLBACK")
+        raise
+    return True
+
+
+def flush():
+    now = time.time()
+
+    def write(con):
+        con.executemany(
+            "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+            [(key, blob, len(blob), now) for key, blob in _pending_stores.items()],
+        )
+        con.executemany(
+            "UPDATE entries SET last_used = ? WHERE key = ?",
+            [(now, key) for key in _pending_hits],
+        )
+
+    if len(_pending_stores) != 0 or len(_pending_hits) != 0:
+        # If the database is locked, the entries are lost. They will be computed again by the next run.
+        write_transaction(write)
+    _pending_stores.clear()
+    _pending_hits.clear()
+
+
+def evict():
+    def delete_oldest(con):
+        total = con.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= CACHE_MAX_BYTES:
+            return
+        target = CACHE_MAX_BYTES * 0.8
+        deleted = []
+        for key, size in con.execute("SELECT key, size FROM entries ORDER BY last_used"):
+            if total <= target:
+                break
+            deleted.append((key,))
+            total -= size
+        con.executemany("DELETE FROM entries WHERE key = ?", deleted)
+
+    write_transaction(delete_oldest)
+
+
+# Writes everything to disk and closes the database. Call this before forking.
+def close():
+    global _connection, _connection_pid
+    if _connection is None or _connection_pid != os.getpid():
+        _connection = None
+        _connection_pid = None
+        _pending_stores.clear()
+        _pending_hits.clear()
+        return
+    flush()
+    evict()
+    _connection.close()
+    _connection = None
+    _connection_pid = None
+
+
+class CachedFunction:
+    def __init__(self, func, static_inputs):
+        self.func = func
+        self.static_inputs = static_inputs
+        functools.update_wrapper(self, func)
+
+    def key(self, args):
+        static = []
+        if self.static_inputs is not None:
+            static = [(str(p), stamp(p)) for p in self.static_inputs(*args)]
+        return hashlib.sha256(
+            repr((code_version(), self.func.__qualname__, args, static)).encode()
+        ).hexdigest()
+
+    # Returns (key, found, value)
+    def lookup(self, *args):
+        con = connection()
+        if con is None:
+            return None, False, None
+        key = self.key(args)
+        blob = _pending_stores.get(key)
+        if blob is None:
+            try:
+                row = con.execute("SELECT value FROM entries WHERE key = ?", (key,)).fetchone()
+            except sqlite3.OperationalError as e:
+                if not is_busy(e):
+                    raise
+                return key, False, None
+            if row is None:
+                return key, False, None
+            blob = row[0]
+        value, deps = pickle.loads(blob)
+        if not deps.still_valid():
+            return key, False, None
+        _pending_hits.append(key)
+        return key, True, value
+
+    def store(self, key, value, deps):
+        if key is None or connection() is None:
+            return
+        _pending_stores[key] = pickle.dumps((value, deps))
+        if len(_pending_stores) >= COMMIT_INTERVAL:
+            flush()
+
+    def __call__(self, *args):
+        key, found, value = self.lookup(*args)
+        if found:
+            return value
+        with recording() as deps:
+            value = self.func(*args)
+        self.store(key, value, deps)
+        return value
+
+
+# static_inputs(*args) returns the files whose (mtime, size) become part of the key
+def cached(static_inputs=None):
+    def decorator(func):
+        return CachedFunction(func, static_inputs)
+
+    return decorator
+
+#------------------------------------------------------------------------------
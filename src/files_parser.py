@@ -0,0 +1,668 @@
+#!/bin/false
+#--------------------------------*- python -*----------------------------------
+#
+# Copyright (C) 2023 Volker Weissmann
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+# Description
+#   wmake runs Make/files through the C preprocessor before make reads it.
+#   This file does the part of that we need: It removes comments, joins
+#   continued lines and evaluates #if, #ifdef, #ifndef, #elif, #else, #endif,
+#   #define and #undef, all in a single pass.
+#   Macros whose value is known while generating (e.g. OPENFOAM) are folded
+#   away. Macros that depend on meson options (e.g. WM_DP) turn the condition
+#   into a meson expression, so that the decision is made when meson
+#   configures. Macros we do not know are undefined, like in cpp.
+#
+#------------------------------------------------------------------------------
+
+import re
+
+
+class UnsupportedPreprocessorConstruct(Exception):
+    pass
+
+
+# A meson expression together with the precedence of its outermost operator, so that we only add the parentheses
+# that are needed.
+OR = 0
+AND = 1
+NOT = 2
+ATOM = 3
+
+
+# The value of a preprocessor expression. If code is None, the value is known now and stored in const. Otherwise,
+# code is a meson expression of type typ ("bool" or "int") that will be evaluated when meson configures.
+class Value:
+    def __init__(self, const=None, code=None, typ=None, prec=ATOM, negated=None, negated_prec=ATOM):
+        self.const = const
+        self.code = code
+        self.typ = typ
+        self.prec = prec
+        # A nicer meson expression for "not code", if there is one, and the precedence of its outermost operator
+        self.negated = negated
+        self.negated_prec = negated_prec
+
+    def is_const(self):
+        return self.code is None
+
+
+TRUE = Value(const=1)
+FALSE = Value(const=0)
+
+
+def meson_bool(code, negated=None, prec=ATOM, negated_prec=ATOM):
+    return Value(code=code, typ="bool", prec=prec, negated=negated, negated_prec=negated_prec)
+
+
+def meson_int(code):
+    return Value(code=code, typ="int")
+
+
+# A macro that is defined if and only if the meson expression code is true
+def defined_if(code, negated):
+    return ("defined_if", meson_bool(code, negated))
+
+
+def platform_macro(system):
+    return defined_if(
+        f"host_machine.system() == '{system}'", f"host_machine.system() != '{system}'"
+    )
+
+
+# Returns the macros that wmake passes to cpp when it preprocesses Make/files. Each value is either
+# ("const", int), ("defined_if", Value) or ("int", Value).
+def known_macros(api_version):
+    macros = {
+        "OPENFOAM": ("const", int(api_version)),
+        "WM_LABEL_SIZE": ("int", meson_int("get_option('WM_LABEL_SIZE').to_int()")),
+        "__sun__": platform_macro("sunos"),
+        "SunOS64": platform_macro("sunos"),
+        "__linux__": platform_macro("linux"),
+        "linux64": platform_macro("linux"),
+        "darwin64": platform_macro("darwin"),
+        "__APPLE__": platform_macro("darwin"),
+    }
+    for precision in ["DP", "SP", "SPDP"]:
+        macros["WM_" + precision] = defined_if(
+            f"get_option('WM_PRECISION_OPTION') == '{precision}'",
+            f"get_option('WM_PRECISION_OPTION') != '{precision}'",
+        )
+    return macros
+
+
+def paren(value, prec):
+    if value.prec < prec:
+        return "(" + value.code + ")"
+    return value.code
+
+
+def truth(value):
+    if value.is_const():
+        return TRUE if value.const != 0 else FALSE
+    if value.typ == "int":
+        return meson_bool(f"{value.code} != 0", f"{value.code} == 0")
+    return value
+
+
+def logical_not(value):
+    value = truth(value)
+    if value.is_const():
+        return FALSE if value.const else TRUE
+    if value.negated is not None:
+        return meson_bool(value.negated, value.code, value.negated_prec, value.prec)
+    return meson_bool(f"not {paren(value, NOT)}", value.code, NOT, value.prec)
+
+
+def logical_and(a, b):
+    a = truth(a)
+    b = truth(b)
+    if a.is_const():
+        return b if a.const else FALSE
+    if b.is_const():
+        return a if b.const else FALSE
+    return meson_bool(f"{paren(a, AND)} and {paren(b, AND)}", prec=AND)
+
+
+def logical_or(a, b):
+    a = truth(a)
+    b = truth(b)
+    if a.is_const():
+        return TRUE if a.const else b
+    if b.is_const():
+        return TRUE if b.const else a
+    return meson_bool(f"{a.code} or {b.code}", prec=OR)
+
+
+COMPARISONS = {
+    "==": (lambda x, y: x == y, "!="),
+    "!=": (lambda x, y: x != y, "=="),
+    "<": (lambda x, y: x < y, ">="),
+    ">": (lambda x, y: x > y, "<="),
+    "<=": (lambda x, y: x <= y, ">"),
+    ">=": (lambda x, y: x >= y, "<"),
+}
+
+ARITHMETIC = {
+    "+": lambda x, y: x + y,
+    "-": lambda x, y: x - y,
+    "*": lambda x, y: x * y,
+    "/": lambda x, y: int(x / y),
+    "%": lambda x, y: x - y * int(x / y),
+}
+
+
+def as_int_code(value):
+    if value.is_const():
+        return str(value.const)
+    if value.typ != "int":
+        raise UnsupportedPreprocessorConstruct(
+            "using the result of a configure time condition as a number"
+        )
+    return value.code
+
+
+def binary_operation(op, a, b):
+    if op == "&&":
+        return logical_and(a, b)
+    if op == "||":
+        return logical_or(a, b)
+    if op in COMPARISONS:
+        func, negated_op = COMPARISONS[op]
+        if a.is_const() and b.is_const():
+            return TRUE if func(a.const, b.const) else FALSE
+        x = as_int_code(a)
+        y = as_int_code(b)
+        return meson_bool(f"{x} {op} {y}", f"{x} {negated_op} {y}")
+    if not (a.is_const() and b.is_const()):
+        raise UnsupportedPreprocessorConstruct(
+            f"'{op}' with an operand that is only known when meson configures"
+        )
+    if op in "/%" and b.const == 0:
+        raise UnsupportedPreprocessorConstruct("division by zero")
+    return Value(const=ARITHMETIC[op](a.const, b.const))
+
+
+# Operators from lowest to highest precedence
+BINARY_PRECEDENCE = [
+    ["||"],
+    ["&&"],
+    ["==", "!="],
+    ["<", ">", "<=", ">="],
+    ["+", "-"],
+    ["*", "/", "%"],
+]
+BINARY_OPERATORS = {
+    op: prec for prec, ops in enumerate(BINARY_PRECEDENCE) for op in ops
+}
+
+expression_token_regex = re.compile(
+    r"\s*(?:(?P<number>\d+)[uUlL]*|(?P<name>[A-Za-z_]\w*)|(?P<op>&&|\|\||==|!=|<=|>=|[-+*/%<>!()]))"
+)
+
+
+def tokenize_expression(text):
+    tokens = []
+    pos = 0
+    text = text.rstrip()
+    while pos != len(text):
+        match = expression_token_regex.match(text, pos)
+        if match is None:
+            raise UnsupportedPreprocessorConstruct(f"'{text[pos:].strip()}'")
+        pos = match.end()
+        if match.group("number") is not None:
+            tokens.append(("number", int(match.group("number"))))
+        elif match.group("name") is not None:
+            tokens.append(("name", match.group("name")))
+        else:
+            tokens.append(("op", match.group("op")))
+    return tokens
+
+
+# A recursive descent parser for the expression of #if and #elif
+class ExpressionParser:
+    def __init__(self, text, macros):
+        self.text = text
+        self.tokens = tokenize_expression(text)
+        self.pos = 0
+        self.macros = macros
+
+    def peek(self):
+        if self.pos == len(self.tokens):
+            return (None, None)
+        return self.tokens[self.pos]
+
+    def take(self, kind=None, value=None):
+        token = self.peek()
+        if (kind is not None and token[0] != kind) or (
+            value is not None and token[1] != value
+        ):
+            raise UnsupportedPreprocessorConstruct(f"unable to parse '#if {self.text}'")
+        self.pos += 1
+        return token
+
+    def parse(self):
+        ret = self.binary(0)
+        if self.pos != len(self.tokens):
+            raise UnsupportedPreprocessorConstruct(f"unable to parse '#if {self.text}'")
+        return ret
+
+    def binary(self, min_prec):
+        lhs = self.unary()
+        while True:
+            kind, op = self.peek()
+            if kind != "op" or BINARY_OPERATORS.get(op, -1) < min_prec:
+                return lhs
+            self.pos += 1
+            rhs = self.binary(BINARY_OPERATORS[op] + 1)
+            lhs = binary_operation(op, lhs, rhs)
+
+    def unary(self):
+        kind, value = self.take()
+        if kind == "number":
+            return Value(const=value)
+        if kind == "op" and value == "!":
+            return logical_not(self.unary())
+        if kind == "op" and value in "+-":
+            operand = self.unary()
+            return binary_operation(value, Value(const=0), operand)
+        if kind == "op" and value == "(":
+            ret = self.binary(0)
+            self.take("op", ")")
+            return ret
+        if kind == "name" and value == "defined":
+            if self.peek() == ("op", "("):
+                self.pos += 1
+                name = self.take("name")[1]
+                self.take("op", ")")
+            else:
+                name = self.take("name")[1]
+            return self.defined(name)
+        if kind == "name":
+            return self.macro_value(value)
+        raise UnsupportedPreprocessorConstruct(f"unable to parse '#if {self.text}'")
+
+    def defined(self, name):
+        if name not in self.macros:
+            return FALSE
+        kind, value = self.macros[name]
+        if kind == "defined_if":
+            return value
+        return TRUE
+
+    def macro_value(self, name):
+        if name not in self.macros:
+            # Like cpp, identifiers that are not macros are 0
+            return FALSE
+        kind, value = self.macros[name]
+        if kind == "const":
+            return Value(const=value)
+        if kind == "int":
+            return value
+        raise UnsupportedPreprocessorConstruct(
+            f"the value of '{name}', which is only known when meson configures"
+        )
+
+
+# Removes comments and joins continued lines in a single pass. Like cpp, a comment is replaced by a single space.
+# Quoted strings are left untouched, so that '//' inside of them does not start a comment.
+def logical_lines(source):
+    out = []
+    pos = 0
+    length = len(source)
+    # Quote characters that do not occur anymore in the rest of the file. Remembered, so that unterminated quotes do
+    # not make us scan the rest of the file again and again.
+    no_closing = set()
+    while pos < length:
+        char = source[pos]
+        if char == "/" and source.startswith("//", pos):
+            end = source.find("\n", pos)
+            pos = length if end == -1 else end
+            out.append(" ")
+        elif char == "/" and source.startswith("/*", pos):
+            end = source.find("*/", pos + 2)
+            if end == -1:
+                raise UnsupportedPreprocessorConstruct("unterminated comment")
+            pos = end + 2
+            out.append(" ")
+        elif char == "\\" and source.startswith("\\\n", pos):
+            pos += 2
+        elif char in "'\"" and char not in no_closing:
+            end = pos + 1
+            while end < length and source[end] != char:
+                end += 2 if source[end] == "\\" else 1
+            if end >= length:
+                no_closing.add(char)
+                out.append(char)
+                pos += 1
+            else:
+                out.append(source[pos : end + 1])
+                pos = end + 1
+        else:
+            end = pos + 1
+            while end < length and source[end] not in "/\\'\"":
+                end += 1
+            out.append(source[pos:end])
+            pos = end
+    return "".join(out).split("\n")
+
+
+directive_regex = re.compile(r"#\s*(\w*)\s*(.*)")
+define_regex = re.compile(r"([A-Za-z_]\w*)(?:\s+(.*))?")
+
+
+# Evaluates the preprocessor directives in source. Returns a list of (condition, line) for every non-empty line that
+# survives, where condition is None if the line is always used and otherwise a meson expression that tells whether
+# the line is used.
+def preprocess(source, macros):
+    macros = dict(macros)
+    ret = []
+    # One [condition of the current branch, condition that one of the previous branches was taken] for every open #if
+    frames = []
+    # The conjunction of the conditions of all frames
+    active = TRUE
+
+    def recalculate_active():
+        nonlocal active
+        active = TRUE
+        for cond, taken in frames:
+            active = logical_and(active, cond)
+
+    for line in logical_lines(source):
+        line = line.strip()
+        if line == "":
+            continue
+        if not line.startswith("#"):
+            if active.is_const():
+                if active.const:
+                    ret.append((None, line))
+            else:
+                ret.append((active.code, line))
+            continue
+        directive, rest = directive_regex.fullmatch(line).groups()
+        if directive in ["if", "ifdef", "ifndef"]:
+            if directive == "if":
+                cond = ExpressionParser(rest, macros).parse()
+            else:
+                parser = ExpressionParser(rest, macros)
+                cond = parser.defined(parser.take("name")[1])
+                if parser.pos != len(parser.tokens):
+                    raise UnsupportedPreprocessorConstruct(f"'{line}'")
+                if directive == "ifndef":
+                    cond = logical_not(cond)
+            cond = truth(cond)
+            frames.append([cond, cond])
+        elif directive == "elif":
+            if len(frames) == 0:
+                raise UnsupportedPreprocessorConstruct("#elif without #if")
+            cond = truth(ExpressionParser(rest, macros).parse())
+            taken = frames[-1][1]
+            frames[-1] = [logical_and(logical_not(taken), cond), logical_or(taken, cond)]
+        elif directive == "else":
+            if len(frames) == 0:
+                raise UnsupportedPreprocessorConstruct("#else without #if")
+            frames[-1] = [logical_not(frames[-1][1]), TRUE]
+        elif directive == "endif":
+            if len(frames) == 0:
+                raise UnsupportedPreprocessorConstruct("#endif without #if")
+            frames.pop()
+        elif directive in ["define", "undef"]:
+            if not active.is_const():
+                raise UnsupportedPreprocessorConstruct(
+                    f"'{line}' inside of a block that depends on a meson option"
+                )
+            if not active.const:
+                continue
+            match = define_regex.fullmatch(rest)
+            if match is None:
+                raise UnsupportedPreprocessorConstruct(f"'{line}'")
+            name, value = match.groups()
+            if directive == "undef":
+                macros.pop(name, None)
+            elif value is None or value.strip() == "":
+                macros[name] = ("const", 1)
+            elif re.fullmatch(r"\d+", value.strip()):
+                macros[name] = ("const", int(value.strip()))
+            else:
+                raise UnsupportedPreprocessorConstruct(f"'{line}'")
+            continue
+        elif directive == "" and rest == "":
+            # The null directive
+            continue
+        else:
+            raise UnsupportedPreprocessorConstruct(f"'{line}'")
+        recalculate_active()
+    if len(frames) != 0:
+        raise UnsupportedPreprocessorConstruct("#if without #endif")
+    return ret
+
+
+variable_reference_regex = re.compile(r"\$(?:\(([^()]*)\)|\{([^{}]*)\})")
+
+
+# Make variables defined in Make/files, expanded like make expands recursive variables. Every value is expanded
+# once and cached. A definition only drops the cached values that referenced the redefined name, directly or
+# indirectly, so the total work is linear in the size of the definitions and references.
+class Variables:
+    def __init__(self):
+        self.raw = {}
+        self.expanded = {}
+        # Maps every name to the names whose cached value referenced it
+        self.dependents = {}
+
+    def define(self, name, value):
+        self.raw[name] = value
+        self.invalidate(name)
+
+    def invalidate(self, name):
+        stack = [name]
+        while len(stack) != 0:
+            name = stack.pop()
+            self.expanded.pop(name, None)
+            stack.extend(self.dependents.pop(name, ()))
+
+    # References to variables that are not defined here are left as they are. The names of all references are added
+    # to used.
+    def expand(self, text, active=frozenset(), used=None):
+        if "$" not in text:
+            return text
+
+        def replacer(match):
+            name = match.group(1) if match.group(1) is not None else match.group(2)
+            if used is not None:
+                used.add(name)
+            if name not in self.raw:
+                return match.group(0)
+            if name not in self.expanded:
+                if name in active:
+                    raise UnsupportedPreprocessorConstruct(
+                        f"the variable '{name}' references itself"
+                    )
+                references = set()
+                self.expanded[name] = self.expand(
+                    self.raw[name], active | {name}, references
+                )
+                for ref in references:
+                    self.dependents.setdefault(ref, set()).add(name)
+            return self.expanded[name]
+
+        return variable_reference_regex.sub(replacer, text)
+
+
+def testhelper(source, expected, api_version=2006):
+    result = preprocess(source, known_macros(api_version))
+    assert result == expected, result
+
+
+def testhelper_unsupported(source):
+    try:
+        preprocess(source, known_macros(2006))
+    except UnsupportedPreprocessorConstruct:
+        return
+    raise AssertionError(f"No UnsupportedPreprocessorConstruct for {source!r}")
+
+
+DP = "get_option('WM_PRECISION_OPTION') == 'DP'"
+NOT_DP = "get_option('WM_PRECISION_OPTION') != 'DP'"
+LABEL64 = "get_option('WM_LABEL_SIZE').to_int() == 64"
+
+
+def unittests_files_parser():
+    # The blocks that were hardcoded before this file existed
+    testhelper(
+        """
+#if !defined(WM_DP)
+primitives/Vector/doubleVector/doubleVector.C
+primitives/Tensor/doubleTensor/doubleTensor.C
+#endif
+#if !defined(WM_SP) && !defined(WM_SPDP)
+primitives/Vector/floatVector/floatVector.C
+primitives/Tensor/floatTensor/floatTensor.C
+#endif
+""",
+        [
+            (NOT_DP, "primitives/Vector/doubleVector/doubleVector.C"),
+            (NOT_DP, "primitives/Tensor/doubleTensor/doubleTensor.C"),
+            (
+                "get_option('WM_PRECISION_OPTION') != 'SP' and get_option('WM_PRECISION_OPTION') != 'SPDP'",
+                "primitives/Vector/floatVector/floatVector.C",
+            ),
+            (
+                "get_option('WM_PRECISION_OPTION') != 'SP' and get_option('WM_PRECISION_OPTION') != 'SPDP'",
+                "primitives/Tensor/floatTensor/floatTensor.C",
+            ),
+        ],
+    )
+    testhelper(
+        "#ifdef SunOS64\ndummyPrintStack.C\n#else\nprintStack.C\n#endif\n",
+        [
+            ("host_machine.system() == 'sunos'", "dummyPrintStack.C"),
+            ("host_machine.system() != 'sunos'", "printStack.C"),
+        ],
+    )
+    testhelper(
+        "#ifdef __sun__\nprintStack/dummyPrintStack.C\n#else\nprintStack/printStack.C\n#endif\n",
+        [
+            ("host_machine.system() == 'sunos'", "printStack/dummyPrintStack.C"),
+            ("host_machine.system() != 'sunos'", "printStack/printStack.C"),
+        ],
+    )
+    oldnewstub = "#if OPENFOAM > 1812\nnewStub.C\n#else\noldStub.C\n#endif\n"
+    testhelper(oldnewstub, [(None, "newStub.C")], 2006)
+    testhelper(oldnewstub, [(None, "oldStub.C")], 1812)
+
+    # Nested #if, #elif and #else
+    nested = """
+#if OPENFOAM >= 2000
+#  if defined(WM_DP)
+a.C
+#  elif WM_LABEL_SIZE == 64
+b.C
+#  else
+c.C
+#  endif
+#elif defined(__linux__)
+d.C
+#else
+e.C
+#endif
+"""
+    testhelper(
+        nested,
+        [
+            (DP, "a.C"),
+            (f"{NOT_DP} and {LABEL64}", "b.C"),
+            (f"not ({DP} or {LABEL64})", "c.C"),
+        ],
+        2006,
+    )
+    testhelper(
+        nested,
+        [
+            ("host_machine.system() == 'linux'", "d.C"),
+            ("host_machine.system() != 'linux'", "e.C"),
+        ],
+        1906,
+    )
+
+    # defined() with &&, || and !. Unknown macros are undefined.
+    testhelper(
+        """
+#if defined(WM_SP) || defined(WM_SPDP) && !defined(__APPLE__)
+f.C
+#endif
+#if defined(UNKNOWN) || !defined(OPENFOAM)
+g.C
+#endif
+#if defined(OPENFOAM) && !defined(UNKNOWN) && 1
+h.C
+#endif
+#if (defined(WM_DP) || defined UNKNOWN) && OPENFOAM < 1000
+i.C
+#endif
+""",
+        [
+            (
+                "get_option('WM_PRECISION_OPTION') == 'SP' or get_option('WM_PRECISION_OPTION') == 'SPDP' and host_machine.system() != 'darwin'",
+                "f.C",
+            ),
+            (None, "h.C"),
+        ],
+    )
+
+    # A double negation restores an "or", which still needs parentheses inside an "and"
+    testhelper(
+        """
+#ifdef __linux__
+#  if !(defined(WM_SP) || defined(WM_DP))
+a.C
+#  else
+b.C
+#  endif
+#endif
+""",
+        [
+            (
+                "host_machine.system() == 'linux' and not (get_option('WM_PRECISION_OPTION') == 'SP' or get_option('WM_PRECISION_OPTION') == 'DP')",
+                "a.C",
+            ),
+            (
+                "host_machine.system() == 'linux' and (get_option('WM_PRECISION_OPTION') == 'SP' or get_option('WM_PRECISION_OPTION') == 'DP')",
+                "b.C",
+            ),
+        ],
+    )
+
+    # #define, #undef, comments and continued lines
+    testhelper(
+        "#define FOO\n#ifdef FOO\ni.C // comment\n#endif\n#undef FOO\n#ifndef FOO\nj.C /* multi\nline */\n#endif\nk\\\n.C\n",
+        [(None, "i.C"), (None, "j.C"), (None, "k.C")],
+    )
+
+    testhelper_unsupported("#if defined(WM_DP)\na.C\n")
+    testhelper_unsupported("#endif\n")
+    testhelper_unsupported("#if WM_DP + 1\n#endif\n")
+    testhelper_unsupported("#ifdef WM_DP\n#define FOO\n#endif\n")
+    testhelper_unsupported("#include <foo>\n")
+
+    variables = Variables()
+    variables.define("a", "x")
+    variables.define("b", "$(a)/y")
+    assert variables.expand("$(b)/z ${a}") == "x/y/z x"
+    # Redefining a variable changes the variables that reference it
+    variables.define("a", "q")
+    assert variables.expand("$(b) $(c)") == "q/y $(c)"
+    variables.define("c", "$(b)")
+    assert variables.expand("$(c)") == "q/y"
+    variables.define("a", "r")
+    assert variables.expand("$(c)") == "r/y"
+    variables.define("self", "$(other)")
+    variables.define("other", "$(self)/x")
+    try:
+        variables.expand("$(self)")
+    except UnsupportedPreprocessorConstruct:
+        pass
+    else:
+        raise AssertionError("No UnsupportedPreprocessorConstruct for a variable that references itself")
+
+#------------------------------------------------------------------------------
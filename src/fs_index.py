@@ -0,0 +1,248 @@
+#!/bin/false
+#--------------------------------*- python -*----------------------------------
+#
+# Copyright (C) 2023 Volker Weissmann
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+# Description
+#   Lists the OpenFOAM tree once, so that the rest of the generator can look up
+#   Make directories, source files, existing meson.build files and whether a
+#   path exists without touching the filesystem again. On NFS, every stat call
+#   is expensive. The listing comes either from walking the tree or from
+#   git ls-files.
+#
+#------------------------------------------------------------------------------
+
+import os
+import subprocess
+from pathlib import Path
+from . import disccache
+from . import profiling
+
+# Directories that are not descended into. A leading '/' means that the pattern is relative to the root of the
+# tree, otherwise it matches directories with this name anywhere.
+DEFAULT_PRUNE = [".git", "lnInclude", "/build", "/platforms"]
+
+# "filesystem" walks the tree, "git" uses the files known to git ls-files and "git-untracked" adds the untracked
+# files that are not ignored.
+BACKENDS = ["filesystem", "git", "git-untracked"]
+
+
+class FsIndex:
+    root: Path
+    # Maps the path of every directory we know, relative to root, to (subdirectories, other entries).
+    # The order is a pre-order traversal, like os.walk.
+    dirs: dict
+    # One of BACKENDS
+    backend: str
+    # False if untracked files are missing
+    complete: bool
+
+    def __init__(self, root, dirs, backend):
+        self.root = root
+        self.dirs = dirs
+        self.backend = backend
+        self.complete = backend != "git"
+
+    def relative(self, path):
+        path = str(path)
+        root = str(self.root)
+        if path == root:
+            return ""
+        if not path.startswith(root + os.sep):
+            return None
+        return os.path.normpath(path[len(root) + 1 :])
+
+    # Returns True, False or None if the answer is not in the index
+    def lookup(self, path, want_dir):
+        rel = self.relative(path)
+        if rel is None:
+            return None
+        if rel in self.dirs:
+            return want_dir
+        parent, name = os.path.split(rel)
+        if parent not in self.dirs:
+            return None
+        subdirs, files = self.dirs[parent]
+        if name in subdirs:
+            return want_dir
+        if name in files:
+            # Might be a broken symlink
+            return None if want_dir else True
+        return False if self.complete else None
+
+    def exists(self, path):
+        ret = self.lookup(path, True)
+        if ret is None:
+            ret = self.lookup(path, False)
+        if ret is None:
+            profiling.count("files_stated")
+            return os.path.exists(path)
+        return ret
+
+    def is_file(self, path):
+        ret = self.lookup(path, False)
+        if ret is None:
+            profiling.count("files_stated")
+            return os.path.isfile(path)
+        return ret
+
+    # Yields the absolute path of every directory that has a subdirectory with this name
+    def dirs_with_subdir(self, name):
+        for rel, (subdirs, files) in self.dirs.items():
+            if name in subdirs:
+                yield self.root / rel
+
+    # Yields the absolute path of every file with this name
+    def files_named(self, name):
+        for rel, (subdirs, files) in self.dirs.items():
+            if name in files:
+                yield self.root / rel / name
+
+    # Like directory.rglob("*" + suffix), but only files and not descending into pruned directories
+    def rglob_files(self, directory, suffix):
+        rel = self.relative(directory)
+        if rel not in self.dirs:
+            yield from (fp for fp in Path(directory).rglob("*" + suffix) if fp.is_file())
+            return
+        stack = [rel]
+        while len(stack) != 0:
+            cur = stack.pop()
+            if cur not in self.dirs:
+                continue
+            subdirs, files = self.dirs[cur]
+            for name in files:
+                if name.endswith(suffix):
+                    yield self.root / cur / name
+            stack.extend(os.path.join(cur, d) for d in subdirs)
+
+
+def is_pruned(rel, prune):
+    name = os.path.basename(rel)
+    return any(name == p or rel == p[1:] for p in prune)
+
+
+# The order of self.dirs is the same as the order of os.walk and Path.rglob
+def walk_filesystem(root, prune):
+    dirs = {}
+    stack = [""]
+    while len(stack) != 0:
+        rel = stack.pop()
+        disccache.depends_on_path(os.path.join(root, rel))
+        subdirs = []
+        files = []
+        descend = []
+        profiling.count("directories_listed")
+        try:
+            with os.scandir(os.path.join(root, rel)) as it:
+                for entry in it:
+                    try:
+                        is_dir = entry.is_dir()
+                    except OSError:
+                        is_dir = False
+                    if not is_dir:
+                        files.append(entry.name)
+                        continue
+                    subdirs.append(entry.name)
+                    child = os.path.join(rel, entry.name)
+                    if entry.is_symlink() or is_pruned(child, prune):
+                        continue
+                    descend.append(child)
+        except OSError:
+            continue
+        # Build directories of meson
+        if "meson-private" in subdirs and rel != "":
+            continue
+        dirs[rel] = (subdirs, files)
+        stack.extend(reversed(descend))
+    return dirs
+
+
+def run_git(root, *args):
+    profiling.count("subprocesses")
+    return subprocess.run(
+        ["git", "-C", root, *args],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL,
+        check=True,
+    ).stdout
+
+
+# Returns None if root is not the toplevel directory of a git repository
+def list_git_files(root, include_untracked):
+    if not os.path.exists(os.path.join(root, ".git")):
+        return None
+    try:
+        if run_git(root, "rev-parse", "--show-prefix").strip() != b"":
+            return None
+        index_path = run_git(root, "rev-parse", "--git-path", "index").strip()
+        disccache.depends_on_path(os.path.join(root, os.fsdecode(index_path)))
+        files = set(run_git(root, "ls-files", "-z", "--cached").split(b"\0"))
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    # Creating an untracked file or deleting a tracked one does not touch the git index. Instead of stating every
+    # directory, we let git tell us about them, so that its untracked cache and fsmonitor can avoid touching the
+    # filesystem as well.
+    if include_untracked:
+        untracked = disccache.depends_on_output(
+            ["git", "-C", root, "ls-files", "-z", "--others", "--exclude-standard"]
+        )
+        if untracked is None:
+            return None
+        files |= set(untracked.split(b"\0"))
+    # Files that were deleted, but are still in the index
+    deleted = disccache.depends_on_output(["git", "-C", root, "ls-files", "-z", "--deleted"])
+    if deleted is None:
+        return None
+    return [os.fsdecode(fp) for fp in files - set(deleted.split(b"\0")) if fp != b""]
+
+
+# Lists the files with git ls-files instead of walking the filesystem. Directories that do not contain any
+# (tracked) file are missing.
+def walk_git(root, prune, include_untracked):
+    files = list_git_files(root, include_untracked)
+    if files is None:
+        return None
+    children = {"": ({}, [])}
+    for fp in files:
+        parts = fp.split("/")
+        cur = ""
+        for part in parts[:-1]:
+            child = os.path.join(cur, part)
+            if child not in children:
+                children[cur][0][part] = child
+                children[child] = ({}, [])
+            cur = child
+        children[cur][1].append(parts[-1])
+    dirs = {}
+    stack = [""]
+    while len(stack) != 0:
+        rel = stack.pop()
+        subdirs, files = children[rel]
+        dirs[rel] = (sorted(subdirs), sorted(files))
+        stack.extend(
+            reversed(
+                [
+                    subdirs[name]
+                    for name in sorted(subdirs)
+                    if not is_pruned(subdirs[name], prune)
+                ]
+            )
+        )
+    return dirs
+
+
+# backend is one of BACKENDS. If a git backend is requested, but root is not a git repository, we walk the
+# filesystem instead and the backend of the returned index is "filesystem".
+# The result is stored in the disccache. With the filesystem backend, it is valid as long as the mtimes of all
+# directories stay the same. With a git backend, it is valid as long as the git index and the output of
+# git ls-files --deleted (and --others for git-untracked) stay the same, see list_git_files.
+@disccache.cached()
+def build_fs_index(root, prune, backend):
+    if backend in ["git", "git-untracked"]:
+        dirs = walk_git(root, prune, backend == "git-untracked")
+        if dirs is not None:
+            return FsIndex(root, dirs, backend)
+    return FsIndex(root, walk_filesystem(root, prune), "filesystem")
+
+#------------------------------------------------------------------------------
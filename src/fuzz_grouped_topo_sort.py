@@ -0,0 +1,352 @@
+#!/usr/bin/env python3
+#--------------------------------*- python -*----------------------------------
+#
+# Copyright (C) 2023 Volker Weissmann
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+# Description
+#   Runs grouped_topo_sort on random dependency graphs with random directory
+#   trees and ideal paths, and checks that the result is grouped-toposortable
+#   (see internal_docs/why_we_need_grouped_topo_sort.md): Every directory
+#   of the outpaths has to be sortable by BuildDesc.topological_sort, the
+#   same way writeToFileSystem sorts it, and every outpath has to be a prefix
+#   of the ideal path.
+#
+#   The pressure of a graph is the fraction of targets whose ideal path is a
+#   random directory. The other targets are put into the directories in the
+#   order of the graph, which never requires moving a target. So the higher
+#   the pressure, the more targets have to be moved.
+#
+#   fuzz: Checks many small graphs. A failing case is reproduced with
+#         fuzz --seed S --cases 1, where S is the seed that is printed. The
+#         cases are also run again with different values of PYTHONHASHSEED,
+#         because the outpaths must not depend on the iteration order of sets.
+#   scale: Records the runtime and the number of hoists for growing graphs and
+#          pressures and writes the results as JSON. Larger graphs are skipped
+#          for a pressure once a graph of this pressure took longer than
+#          --time-limit seconds.
+#
+#   Usage: fuzz_grouped_topo_sort.py fuzz [--cases N] [--max-targets N] [--jobs N] [--hash-seeds 0 1]
+#          fuzz_grouped_topo_sort.py scale [--sizes 100 1000] [--pressures 0 0.1] [--output FILE]
+#
+#------------------------------------------------------------------------------
+
+import io
+import os
+import sys
+import json
+import hashlib
+import subprocess
+import time
+import random
+import platform
+import traceback
+import argparse
+import contextlib
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# meson_codegen has to be imported before grouped_topo_sort
+from src import meson_codegen
+from src import profiling
+from src.meson_codegen import BuildDesc, Node, Template, BugDetected, starts_with
+from src.grouped_topo_sort import grouped_topo_sort, PlacementTimeout
+
+
+class Case:
+    def __init__(self, seed, num_targets, num_dirs, max_depth, degree, pressure):
+        self.seed = seed
+        self.num_targets = num_targets
+        self.num_dirs = num_dirs
+        self.max_depth = max_depth
+        self.degree = degree
+        self.pressure = pressure
+
+    def params(self):
+        return {
+            "seed": self.seed,
+            "targets": self.num_targets,
+            "directories": self.num_dirs,
+            "max_depth": self.max_depth,
+            "degree": self.degree,
+            "pressure": self.pressure,
+        }
+
+
+# Returns num_dirs directories as tuples, including the root (). Every directory comes before its subdirectories and
+# every directory is followed by all of its subdirectories, as if they were listed by a depth first search.
+def random_directory_tree(rng, num_dirs, max_depth):
+    children = {(): []}
+    dirs = [()]
+    while len(dirs) < num_dirs:
+        parent = rng.choice([d for d in dirs if len(d) < max_depth] or [()])
+        child = parent + (f"d{len(dirs)}",)
+        children[parent].append(child)
+        children[child] = []
+        dirs.append(child)
+    ret = []
+    stack = [()]
+    while len(stack) != 0:
+        d = stack.pop()
+        ret.append(d)
+        stack += reversed(children[d])
+    return ret
+
+
+# Returns a BuildDesc with the random graph of case. Target t{i} only depends on targets t{j} with j < i.
+def random_build_desc(case):
+    rng = random.Random(case.seed)
+    dirs = random_directory_tree(rng, case.num_dirs, case.max_depth)
+    nodes = []
+    for i in range(case.num_targets):
+        ddeps = {f"t{j}" for j in rng.sample(range(i), min(i, rng.randint(0, 2 * case.degree)))}
+        if rng.random() < case.pressure:
+            ideal_path = rng.choice(dirs)
+        else:
+            ideal_path = dirs[i * len(dirs) // case.num_targets]
+        nodes.append(Node(f"t{i}", Template(""), ddeps, ideal_path, f"random target {i}"))
+    # The order of the elements should not matter, so we do not give grouped_topo_sort the easy one
+    rng.shuffle(nodes)
+    desc = BuildDesc(Path("/nonexistent"))
+    for node in nodes:
+        desc.add_node(node)
+    return desc
+
+
+# Returns None if the outpaths of desc are correct, and an error message otherwise
+def check_outpaths(desc):
+    for key, el in desc.elements.items():
+        if not starts_with(el.outpath, el.ideal_path):
+            return f"The outpath {el.outpath} of {key} is not a prefix of its ideal path {el.ideal_path}"
+    desc.build_outpath_trie()
+    stack = [([], desc.outpath_trie)]
+    while len(stack) != 0:
+        subgroup, node = stack.pop()
+        try:
+            desc.directory_order(subgroup, node)
+        except BugDetected:
+            return f"The directory {'/'.join(subgroup) or '.'} is not toposortable"
+        for direct, child in node.children.items():
+            stack.append((subgroup + [direct], child))
+    return None
+
+
+# Runs grouped_topo_sort on the graph of case and returns a dict with the results. "error" is None if grouped_topo_sort
+# finished and its result is correct. "outpaths" is only there if grouped_topo_sort finished.
+def run_case(case, jobs=1):
+    desc = random_build_desc(case)
+    profiling.enable()
+    output = io.StringIO()
+    start = time.perf_counter()
+    result = {
+        **case.params(),
+        "edges": sum(len(el.ddeps) for el in desc.elements.values()),
+        "timed_out": False,
+    }
+    try:
+        with contextlib.redirect_stdout(output):
+            grouped_topo_sort(desc.elements, jobs)
+    except PlacementTimeout:
+        return {**result, "seconds": time.perf_counter() - start, "timed_out": True, "error": "PlacementTimeout"}
+    # Finding these is the point of this script, so they must not end the run
+    except Exception:
+        return {**result, "seconds": time.perf_counter() - start, "error": traceback.format_exc()}
+    finally:
+        hoists_chosen = profiling.current.counters["hoists_chosen"]
+        profiling.current = None
+    seconds = time.perf_counter() - start
+    return {
+        **result,
+        "seconds": seconds,
+        "hoists_chosen": hoists_chosen,
+        "moved_targets": sum(el.outpath != el.ideal_path for el in desc.elements.values()),
+        "proven_optimal": "not proven" not in output.getvalue(),
+        "error": check_outpaths(desc),
+        "outpaths": {key: el.outpath for key, el in desc.elements.items()},
+    }
+
+
+def fuzz_case(case_seed, max_targets):
+    rng = random.Random(case_seed)
+    num_targets = rng.randint(1, max_targets)
+    return Case(
+        case_seed,
+        num_targets,
+        rng.randint(1, max(1, num_targets // 2)),
+        rng.randint(1, 4),
+        rng.randint(1, 3),
+        rng.random(),
+    )
+
+
+# Returns a dict that maps the seed of every case for which grouped_topo_sort finished to a hash of its outpaths
+def outpath_digests(cases, seed, max_targets):
+    ret = {}
+    for case_seed in range(seed, seed + cases):
+        result = run_case(fuzz_case(case_seed, max_targets))
+        if "outpaths" in result:
+            ret[case_seed] = hashlib.sha256(json.dumps(result["outpaths"], sort_keys=True).encode()).hexdigest()
+    return ret
+
+
+# Runs outpath_digests in a new process for every hash seed and returns the seeds of the cases whose outpaths depend
+# on PYTHONHASHSEED, e.g. because the iteration order of a set decided which targets are hoisted.
+def hash_seed_dependent_cases(cases, seed, max_targets, hash_seeds):
+    digests = []
+    for hash_seed in hash_seeds:
+        output = subprocess.run(
+            [sys.executable, __file__, "digests", "--cases", str(cases), "--seed", str(seed), "--max-targets", str(max_targets)],
+            env={**os.environ, "PYTHONHASHSEED": str(hash_seed)},
+            check=True,
+            stdout=subprocess.PIPE,
+            universal_newlines=True,
+        ).stdout
+        digests.append(json.loads(output))
+    return sorted(
+        int(case_seed)
+        for case_seed in digests[0]
+        if any(d.get(case_seed, digests[0][case_seed]) != digests[0][case_seed] for d in digests[1:])
+    )
+
+
+def fuzz(cases, seed, max_targets, jobs, hash_seeds):
+    failures = 0
+    for case_seed in range(seed, seed + cases):
+        case = fuzz_case(case_seed, max_targets)
+        result = run_case(case)
+        if result["error"] is None and jobs > 1:
+            parallel = run_case(case, jobs)
+            if parallel["error"] is not None:
+                result["error"] = f"With --jobs {jobs}: {parallel['error']}"
+            elif parallel["outpaths"] != result["outpaths"]:
+                result["error"] = f"The outpaths with --jobs {jobs} differ from the outpaths without it"
+        if result["error"] is not None:
+            failures += 1
+            print(f"seed {case_seed}: {result['error']}, {case.params()}")
+    print(f"{cases - failures} of {cases} cases passed")
+    if len(hash_seeds) > 1:
+        dependent = hash_seed_dependent_cases(cases, seed, max_targets, hash_seeds)
+        for case_seed in dependent:
+            print(f"seed {case_seed}: The outpaths differ between PYTHONHASHSEED={' and '.join(map(str, hash_seeds))}")
+        if len(dependent) != 0:
+            return False
+    return failures == 0
+
+
+def scale(sizes, pressures, seed, targets_per_dir, degree, time_limit):
+    results = []
+    for pressure in pressures:
+        for size in sizes:
+            case = Case(seed, size, max(1, size // targets_per_dir), 6, degree, pressure)
+            result = run_case(case)
+            result.pop("outpaths", None)
+            results.append(result)
+            if result["timed_out"]:
+                summary = "timed out"
+            elif "hoists_chosen" not in result:
+                summary = "failed"
+            else:
+                summary = f"{result['hoists_chosen']} hoists"
+            print(
+                f"pressure {pressure}, {size} targets: {summary}, {result['seconds']:.2f} seconds",
+                file=sys.stderr,
+            )
+            if not result["timed_out"] and result["error"] is not None:
+                print(f"ERROR: {result['error']}", file=sys.stderr)
+            if result["timed_out"] or result["seconds"] > time_limit:
+                break
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Checks grouped_topo_sort on random graphs and measures how it scales."
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    fuzz_parser = subparsers.add_parser("fuzz", help="Check grouped_topo_sort on many small random graphs.")
+    fuzz_parser.add_argument("--seed", type=int, default=0, help="The seed of the first case. Default: %(default)s")
+    fuzz_parser.add_argument("--cases", type=int, default=1000, help="Default: %(default)s")
+    fuzz_parser.add_argument("--max-targets", type=int, default=40, help="Default: %(default)s")
+    fuzz_parser.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help="If this is larger than 1, also check that grouped_topo_sort returns the same outpaths with this many jobs.",
+    )
+    fuzz_parser.add_argument(
+        "--hash-seeds",
+        type=int,
+        nargs="*",
+        default=[0, 1],
+        help="Also check that the outpaths are the same with each of these values of PYTHONHASHSEED. Default: %(default)s",
+    )
+    # Used by the --hash-seeds check of fuzz
+    digests_parser = subparsers.add_parser("digests", help="Print a hash of the outpaths of every fuzz case as JSON.")
+    digests_parser.add_argument("--seed", type=int, default=0)
+    digests_parser.add_argument("--cases", type=int, default=1000)
+    digests_parser.add_argument("--max-targets", type=int, default=40)
+    scale_parser = subparsers.add_parser("scale", help="Measure grouped_topo_sort on growing random graphs.")
+    scale_parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[100, 300, 1000, 3000, 10000],
+        help="Numbers of targets. Default: %(default)s",
+    )
+    scale_parser.add_argument(
+        "--pressures",
+        type=float,
+        nargs="+",
+        default=[0, 0.01, 0.03, 0.1, 0.3],
+        help="Fractions of targets with a random ideal path. Default: %(default)s",
+    )
+    scale_parser.add_argument("--seed", type=int, default=0)
+    scale_parser.add_argument("--targets-per-dir", type=int, default=5, help="Default: %(default)s")
+    scale_parser.add_argument(
+        "--degree",
+        type=int,
+        default=3,
+        help="The average number of dependencies of a target. Default: %(default)s",
+    )
+    scale_parser.add_argument(
+        "--time-limit",
+        type=float,
+        default=60,
+        help="Skip the larger sizes of a pressure once a graph took longer than this many seconds. Default: %(default)s",
+    )
+    scale_parser.add_argument(
+        "--output",
+        type=Path,
+        default=Path("grouped_topo_sort_scaling.json"),
+        help="Default: %(default)s",
+    )
+    args = parser.parse_args()
+    if args.command == "fuzz":
+        sys.exit(0 if fuzz(args.cases, args.seed, args.max_targets, args.jobs, args.hash_seeds) else 1)
+    if args.command == "digests":
+        print(json.dumps(outpath_digests(args.cases, args.seed, args.max_targets)))
+        return
+    results = scale(
+        args.sizes,
+        args.pressures,
+        args.seed,
+        args.targets_per_dir,
+        args.degree,
+        args.time_limit,
+    )
+    report = {
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "seed": args.seed,
+        "results": results,
+    }
+    args.output.write_text(json.dumps(report, indent=2) + "\n")
+    if any(not r["timed_out"] and r["error"] is not None for r in results):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
+
+#------------------------------------------------------------------------------
@@ -8,9 +8,20 @@
 #
 #------------------------------------------------------------------------------
 
+import io
+import time
+import random
+import contextlib
+import collections
+from array import array
+import concurrent.futures
 from collections import defaultdict
 import typing as T
 from . import meson_codegen
+from . import disccache
+from . import profiling
+from .reachability import Reachability, strongly_connected_components, naive_descendants
+from .compact_graph import CompactGraph, PathTable
 
 
 # "grouped_topo_sort" sets el.outpath for all elements. Nearly always,
@@ -18,110 +29,282 @@ from . import meson_codegen
 # meson_codegen.starts_with(el.outpath, el.ideal_path) will hold true.
 # This outpath modification is tricky graph theory with heuristics, so do not
 # attempt to understand it on your own. Seriously, Don't try.
-def grouped_topo_sort(elements):
+# If jobs > 1, independent subtrees are placed by a pool of worker processes. The result does not depend on jobs.
+# Raises PlacementTimeout if finding the cycles takes longer than GROUP_CYCLES_TIME_BUDGET seconds in total.
+def grouped_topo_sort(elements, jobs=1):
     for el in elements.values():
         el.outpath = el.ideal_path
-    tree = build_tree(elements)
-    tree.fix_outpaths()
-
-
-def invert_graph(graph):
-    ret = {}
-    for k, ar in graph.items():
-        if k not in ret:
-            ret[k] = []
-        for v in ar:
-            if v in ret:
-                ret[v].append(k)
-            else:
-                ret[v] = [k]
-    return ret
+    tree = build_tree(elements, time.monotonic() + GROUP_CYCLES_TIME_BUDGET)
+    solved = set()
+    if jobs > 1:
+        solved = fix_subtrees_in_parallel(tree, jobs)
+    tree.fix_outpaths(solved)
+
+
+# The part of an element that fix_outpaths needs. This is sent to the worker processes instead of the whole element.
+class PlacementElement:
+    __slots__ = ("provides", "outpath", "ddeps")
+
+    def __init__(self, provides, outpath, ddeps):
+        self.provides = provides
+        self.outpath = outpath
+        self.ddeps = ddeps
+
+
+# Everything the Trees of one grouped_topo_sort call share. Elements are identified by their id in graph, and
+# outpaths by their id in paths.
+class Placement:
+    elements: dict
+    # The keys are the keys of elements, in the same order, so the id of an element is also its position
+    graph: CompactGraph
+    paths: PathTable
+    # dir_of[i] is the id of the outpath of the element i
+    dir_of: array
+    # The time.monotonic() at which we give up. Shared by all Trees, so that the budget covers the whole placement.
+    deadline: float
+
+    def __init__(self, elements, deadline):
+        self.elements = elements
+        self.deadline = deadline
+        self.graph = CompactGraph({k: el.ddeps for k, el in elements.items()})
+        self.paths = PathTable()
+        self.dir_of = array(
+            "l", (self.paths.intern(el.outpath) for el in elements.values())
+        )
+
+    def move(self, i, d):
+        self.dir_of[i] = d
+        self.elements[self.graph.names[i]].outpath = self.paths.path(d)
+
+
+# Returns subtrees of tree that do not contain each other. Starting with the children of tree, the subtree with the
+# most members is replaced by its children until there are at least count subtrees.
+def parallel_frontier(tree, count):
+    frontier = list(tree.subtrees.values())
+    while len(frontier) < count:
+        expandable = [t for t in frontier if len(t.subtrees) != 0]
+        if len(expandable) == 0:
+            break
+        largest = max(expandable, key=lambda t: len(t.members))
+        pos = frontier.index(largest)
+        frontier[pos : pos + 1] = largest.subtrees.values()
+    return frontier
+
+
+# Runs in a worker process. members is a list of (provides, outpath, ddeps) of the members of the subtree at path,
+# and ddeps only contains other members. deadline is the deadline of the main process, time.monotonic() uses the
+# same clock in every process.
+# Returns the new outpath of every member, everything that was printed and the profiling.Profile of the worker.
+def fix_subtree_outpaths(path, members, deadline):
+    elements = {
+        provides: PlacementElement(provides, outpath, ddeps)
+        for provides, outpath, ddeps in members
+    }
+    head = build_tree(elements, deadline)
+    for x in path:
+        head = head.subtrees[x]
+    output = io.StringIO()
+    with contextlib.redirect_stdout(output):
+        head.fix_outpaths()
+    return [el.outpath for el in elements.values()], output.getvalue(), profiling.take()
+
+
+# The subtrees of different directories do not influence each other until the level of their common parent directory
+# is fixed, so the subtrees in parallel_frontier are fixed concurrently. Every worker only gets the elements of its
+# subtree and the dependencies between them. The results are merged in the order of the frontier.
+# Returns the path ids of the subtrees that were fixed.
+def fix_subtrees_in_parallel(tree, jobs):
+    placement = tree.placement
+    names = placement.graph.names
+    # A subtree with a single member has nothing to fix
+    frontier = [t for t in parallel_frontier(tree, jobs * 4) if len(t.members) > 1]
+    if len(frontier) < 2:
+        return set()
+    tasks = []
+    for t in frontier:
+        member_set = set(t.members)
+        tasks.append(
+            [
+                (
+                    names[i],
+                    placement.elements[names[i]].outpath,
+                    [names[x] for x in placement.graph.successors(i) if x in member_set],
+                )
+                for i in t.members
+            ]
+        )
+    # The workers must not inherit an open database connection
+    disccache.close()
+    with concurrent.futures.ProcessPoolExecutor(
+        max_workers=jobs,
+        initializer=profiling.init_worker,
+        initargs=profiling.worker_flags(),
+    ) as executor:
+        results = list(
+            executor.map(
+                fix_subtree_outpaths,
+                [t.path for t in frontier],
+                tasks,
+                [placement.deadline] * len(frontier),
+            )
+        )
+    for t, (outpaths, output, profile) in zip(frontier, results):
+        print(output, end="")
+        profiling.merge(profile)
+        for i, outpath in zip(t.members, outpaths):
+            placement.move(i, placement.paths.intern(outpath))
+    return {t.dir for t in frontier}
 
 
 # scc = Strongly connected component
+# Linear in the size of graph. The order of the result does not depend on the iteration order of the sets in graph:
+# The components are ordered by the position of their first member in graph, so the hoisting is reproducible.
 def calc_nontrivial_sccs(graph):
-    rd = meson_codegen.build_reachable_dict(graph)
-    rev_rd = invert_graph(rd)
-
-    sccs = []
-    indices = {}
-    curind = -1
-    for k in graph:
-        if k not in indices:
-            curind += 1
-            indices[k] = curind
-            scc = set(rd[k]).intersection(rev_rd[k])
-            if len(scc) > 1:  # hence "nontrivial" in the name of this function
-                sccs.append(scc)
-            for k2 in scc:
-                indices[k2] = curind
+    position = {k: i for i, k in enumerate(graph)}
+    sccs = [
+        set(component)
+        for component in strongly_connected_components(graph)
+        if len(component) > 1  # hence "nontrivial" in the name of this function
+    ]
+    sccs.sort(key=lambda scc: min(position[k] for k in scc))
     return sccs
 
 
-class SiblingJump:
-    def __init__(self, src, dest):
-        self.src = src
-        self.dest = dest
-
-    def __repr__(self):
-        return f"{self.src} is a sibling of {self.dest}"
-
+# If all calls of find_group_cycles of one grouped_topo_sort call take longer than this many seconds together, we give
+# up instead of hanging
+GROUP_CYCLES_TIME_BUDGET = 60
+# The deadline is checked after this many steps of the breadth-first search
+DEADLINE_CHECK_INTERVAL = 1024
 
-class GraphJump:
-    def __init__(self, src, dest):
-        self.src = src
-        self.dest = dest
-
-    def __repr__(self):
-        return f"There is a path from {self.src} to {self.dest}"
 
+class PlacementTimeout(Exception):
+    pass
 
-def find_group_cycles(subgraph, name_to_group, group_to_names):
-    rd = meson_codegen.build_reachable_dict(subgraph)
-    paths_matrix = {k2: {k1: [] for k1 in rd} for k2 in rd}
 
-    steps = defaultdict(set)
-    for k1, ar1 in rd.items():
-        if len(group_to_names[name_to_group[k1]]) == 1:
+# subgraph maps every name to the names it depends on, name_to_group maps every name to its group (see DirGraph) and
+# group_to_names is the inverse of name_to_group.
+# Returns a list of cycles. Every cycle is a list of names, and hoisting any of them breaks the cycle.
+#
+# A cycle alternates between two kinds of steps, starting and ending with the same name:
+# - A sibling step from a name to a different name in the same group. Such a step only exists because the two names
+#   are in the same meson.build file.
+# - A graph step from a name a to a name b in a group with more than one name, if there is a path from a to b that
+#   visits another group.
+# The names in the cycle are the sources of all steps. For every name, a breadth-first search on the graph whose nodes
+# are (name, next step is a sibling step) and (name, next step is a graph step) finds the length of the shortest
+# cycles through it, and all cycles of that length are then read off the distances of the search. The search is
+# polynomial in the number of names, only the number of shortest cycles can be large.
+# Like the enumeration this replaced, we return every cycle of the shortest length, once for every name in it as a
+# start. Longer cycles are found again in the next iteration of Tree.fix_outpaths if they survive the hoisting.
+# deadline is a time.monotonic() after which PlacementTimeout is raised. By default, we have GROUP_CYCLES_TIME_BUDGET
+# seconds.
+def find_group_cycles(subgraph, name_to_group, group_to_names, deadline=None):
+    if deadline is None:
+        deadline = time.monotonic() + GROUP_CYCLES_TIME_BUDGET
+
+    def check_deadline():
+        if time.monotonic() > deadline:
+            raise PlacementTimeout(
+                f"Unable to find out which targets need to be moved to another meson.build file in {GROUP_CYCLES_TIME_BUDGET} seconds. {len(subgraph)} targets are involved."
+            )
+
+    reach = Reachability(subgraph)
+    position = {name: i for i, name in enumerate(subgraph)}
+
+    def multi(name):
+        return len(group_to_names[name_to_group[name]]) != 1
+
+    multi_bits = reach.bits_of(name for name in subgraph if multi(name))
+    group_bits = defaultdict(int)
+    for name in subgraph:
+        group_bits[name_to_group[name]] |= reach.bits_of([name])
+    # steps[a] lists the targets of the graph steps from a, reverse_steps[b] the sources of the graph steps to b
+    steps = {}
+    reverse_steps = defaultdict(list)
+    for a in subgraph:
+        check_deadline()
+        if not multi(a):
             continue
-        for v1 in ar1:
-            if name_to_group[v1] == name_to_group[k1]:
-                continue
-            if len(group_to_names[name_to_group[v1]]) != 1:
-                steps[k1].add(v1)
-            for v2 in rd[v1]:
-                if len(group_to_names[name_to_group[v2]]) == 1:
+        outside = reach.descendants_bits(a) & ~group_bits[name_to_group[a]]
+        bits = outside
+        for v in reach.nodes_of_bits(outside):
+            bits |= reach.descendants_bits(v)
+        steps[a] = sorted(reach.nodes_of_bits(bits & multi_bits), key=position.get)
+        for b in steps[a]:
+            reverse_steps[b].append(a)
+
+    shortest = None
+    cycles = []
+    for start in subgraph:
+        check_deadline()
+        if not multi(start):
+            continue
+        # The nodes of the search are (name, sibling), where sibling tells whether the next step is a sibling step.
+        # dist maps every node that was reached to the length of the shortest path from (start, True) to it.
+        dist = {(start, True): 0}
+        queue = collections.deque([(start, True)])
+        # Groups from which all sibling steps have been taken already
+        groups_done = set()
+        groups_seen = defaultdict(int)
+        # The nodes with a graph step back to start, from which the shortest cycles through start are closed
+        last = []
+        steps_taken = 0
+        while len(queue) != 0:
+            steps_taken += 1
+            if steps_taken % DEADLINE_CHECK_INTERVAL == 0:
+                check_deadline()
+            node = queue.popleft()
+            if len(last) != 0 and dist[node] != dist[last[0]]:
+                # All nodes at the distance of the shortest cycles were checked
+                break
+            name, sibling = node
+            if sibling:
+                group = name_to_group[name]
+                if group in groups_done:
                     continue
-                steps[k1].add(v2)
+                # After sibling steps from two different names of the group, every name of the group was reached
+                groups_seen[group] += 1
+                if groups_seen[group] == 2:
+                    groups_done.add(group)
+                successors = [(x, False) for x in group_to_names[group] if x != name]
+            else:
+                if start in steps[name]:
+                    last.append(node)
+                successors = [(x, True) for x in steps[name]]
+            for succ in successors:
+                if succ not in dist:
+                    dist[succ] = dist[node] + 1
+                    queue.append(succ)
+        if len(last) == 0:
+            continue
+        length = dist[last[0]] + 1
+        if shortest is not None and length > shortest:
+            continue
+        if shortest is None or length < shortest:
+            shortest = length
+            cycles = []
+
+        # The nodes from which a shortest path from (start, True) reaches node
+        def predecessors(node):
+            name, sibling = node
+            if sibling:
+                preds = [(x, False) for x in reverse_steps[name]]
+            else:
+                preds = [(x, True) for x in group_to_names[name_to_group[name]] if x != name]
+            return [p for p in preds if dist.get(p) == dist[node] - 1]
+
+        # Every path is built backwards, from one of last to (start, True)
+        stack = [[node] for node in last]
+        while len(stack) != 0:
+            check_deadline()
+            path = stack.pop()
+            if path[-1] == (start, True):
+                cycles.append([name for name, sibling in reversed(path)])
+                continue
+            for pred in reversed(predecessors(path[-1])):
+                stack.append(path + [pred])
+    return cycles
 
-    while True:
-        for names in group_to_names.values():
-            for name1 in names:
-                for name2 in names:
-                    if name1 == name2:
-                        continue
-                    paths_matrix[name1][name2].append([SiblingJump(name1, name2)])
-                    for a in paths_matrix:
-                        for path in paths_matrix[a][name1]:
-                            if not isinstance(path[-1], SiblingJump):
-                                paths_matrix[a][name2].append(
-                                    path.copy() + [SiblingJump(name1, name2)]
-                                )
-        for a in paths_matrix:
-            for b in paths_matrix[a]:
-                for c in steps[b]:
-                    for path in paths_matrix[a][b]:
-                        if isinstance(path[-1], SiblingJump):
-                            paths_matrix[a][c].append(path.copy() + [GraphJump(b, c)])
-
-        cycles = []
-        for a in paths_matrix:
-            for b in paths_matrix[a]:
-                for path in paths_matrix[a][b]:
-                    if len(path) > 1 and path[0].src == path[-1].dest:
-                        cycles.append([x.src for x in path])
-        if len(cycles) > 0:
-            return cycles
 
 def testhelper(subgraph, group_to_names, expected_hoists_needed, ar_expected_hoists_chosen):
     name_to_group = {}
@@ -130,7 +313,8 @@ def testhelper(subgraph, group_to_names, expected_hoists_needed, ar_expected_hoi
             name_to_group[el] = d
 
     hoists_needed = find_group_cycles(subgraph, name_to_group, group_to_names)
-    hoists_chosen = minimum_hoists_needed_approx(hoists_needed)
+    hoists_chosen, proven_optimal, seconds = minimum_hoists_needed(hoists_needed)
+    assert proven_optimal
 
     hoists_needed = {frozenset(x) for x in hoists_needed} # order is irrelevant, duplicates are kinda irrelevant
     expected_hoists_needed = {frozenset(x) for x in expected_hoists_needed} # order is irrelevant
@@ -156,70 +340,187 @@ def unittests_graph_stuff():
     )
 
 
+# calc_nontrivial_sccs as it was before it used Tarjan's algorithm: The component of k is everything that k reaches
+# and that reaches k.
+def reference_nontrivial_sccs(graph):
+    descendants = {k: naive_descendants(graph, k) for k in graph}
+    sccs = []
+    done = set()
+    for k in graph:
+        if k in done:
+            continue
+        scc = {x for x in descendants[k] if k in descendants[x]} | {k}
+        if len(scc) > 1:
+            sccs.append(scc)
+        done |= scc
+    return sccs
+
+
+def unittests_calc_nontrivial_sccs(num_graphs=500, seed=0):
+    rng = random.Random(seed)
+    for _ in range(num_graphs):
+        num_nodes = rng.randint(1, 15)
+        edge_probability = rng.choice([0.05, 0.1, 0.2, 0.4])
+        keys = list(range(num_nodes))
+        rng.shuffle(keys)
+        graph = {
+            k: {x for x in range(num_nodes) if x != k and rng.random() < edge_probability}
+            for k in keys
+        }
+        assert calc_nontrivial_sccs(graph) == reference_nontrivial_sccs(graph)
+
+
 class Tree:
     subtrees: T.Dict["str", "Tree"]
-
-    def __init__(self, path, elements):
+    path: T.List[str]
+    # The id of path in placement.paths
+    dir: int
+    placement: Placement
+    # The ids of all elements whose outpath starts with path, in the order of elements
+    members: array
+
+    def __init__(self, path, dir, placement):
         self.subtrees = {}
         self.path = path
-        self.elements = elements
+        self.dir = dir
+        self.placement = placement
+        self.members = array("l")
 
-    def is_in_tree(self, el):
-        return meson_codegen.starts_with(self.path, el.outpath)
-
-    def generate_dirgraph(self):
-        dirgraph = {}
-        for el in self.elements.values():
-            if meson_codegen.starts_with(self.path, el.outpath):
-                if len(el.outpath) == len(self.path):
-                    src = SingleTarget(el.provides)
-                else:
-                    src = Directory(el.outpath[len(self.path)])
-                if src not in dirgraph:
-                    dirgraph[src] = set()
-                for dep in el.ddeps:
-                    if meson_codegen.starts_with(self.path, self.elements[dep].outpath):
-                        if len(self.elements[dep].outpath) == len(self.path):
-                            dest = SingleTarget(self.elements[dep].provides)
-                        else:
-                            dest = Directory(self.elements[dep].outpath[len(self.path)])
-                        dirgraph[src].add(dest)
-        return dirgraph
-
-    def fix_outpaths(self):
+    # solved contains the path ids of the subtrees that were already fixed by fix_subtrees_in_parallel
+    def fix_outpaths(self, solved=frozenset()):
         for st in self.subtrees.values():
-            st.fix_outpaths()
+            if st.dir not in solved:
+                st.fix_outpaths(solved)
+        with profiling.span("fix_outpaths", directory="/".join(self.path)):
+            self.fix_level()
+
+    # Fixes the cycles between the subdirectories and targets directly in this directory. The subtrees have to be
+    # fixed already.
+    def fix_level(self):
+        graph = self.placement.graph
+        names = graph.names
+        dirgraph = DirGraph(self)
+        # Hoisting targets out of a strongly connected component only splits its groups, so new cycles can only
+        # appear between the groups that came out of a component we just handled.
+        pending = set(dirgraph.group_members)
+        # For the summary at the end
+        num_hoisted = 0
+        num_cycles = 0
+        seconds_total = 0.0
+        all_proven_optimal = True
         while True:
-            dirgraph = self.generate_dirgraph()
-            sccs = calc_nontrivial_sccs(dirgraph)
+            sccs = calc_nontrivial_sccs(dirgraph.graph(pending))
             if len(sccs) == 0:
                 break
+            pending = set()
             for scc in sccs:
-                interesting = [
-                    el
-                    for el in self.elements.values()
-                    if any(self.subtrees[d.name].is_in_tree(el) for d in scc)
-                ]
+                interesting = sorted(
+                    i for group in scc for i in dirgraph.group_members[group]
+                )
+                interesting_set = set(interesting)
                 subgraph = {}
                 name_to_group = {}
                 group_to_names = defaultdict(list)
-                for el in interesting:
-                    subgraph[el.provides] = {
-                        x for x in el.ddeps if self.elements[x] in interesting
+                for i in interesting:
+                    subgraph[names[i]] = {
+                        names[x] for x in graph.successors(i) if x in interesting_set
                     }
-                    if len(el.outpath) == len(self.path):
-                        group = SingleTarget(el.provides)
-                    else:
-                        group = Directory(el.outpath[len(self.path)])
-
-                    name_to_group[el.provides] = group
-                    group_to_names[group].append(el.provides)
+                    group = dirgraph.group_of[i]
+                    name_to_group[names[i]] = group
+                    group_to_names[group].append(names[i])
                 hoists_needed = find_group_cycles(
-                    subgraph, name_to_group, group_to_names
+                    subgraph, name_to_group, group_to_names, self.placement.deadline
                 )
-                hoists_chosen = minimum_hoists_needed_approx(hoists_needed)
+                hoists_chosen, proven_optimal, seconds = minimum_hoists_needed(
+                    hoists_needed
+                )
+                profiling.count("hoists_chosen", len(hoists_chosen))
+                num_hoisted += len(hoists_chosen)
+                num_cycles += len(hoists_needed)
+                seconds_total += seconds
+                all_proven_optimal = all_proven_optimal and proven_optimal
                 for name in hoists_chosen:
-                    self.elements[name].outpath = tuple(self.path)
+                    i = graph.ids[name]
+                    self.placement.move(i, self.dir)
+                    dirgraph.hoist(i)
+                pending.update(dirgraph.group_of[i] for i in interesting)
+        if num_hoisted != 0:
+            print(
+                f"Moving {num_hoisted} target(s) into '{'/'.join(self.path) or '.'}' to break {num_cycles} cycle(s) between directories, found in {seconds_total:.3f} seconds"
+                + ("" if all_proven_optimal else f", not proven to be the minimum within {HOISTS_TIME_BUDGET} seconds")
+            )
+
+
+# The graph between the subdirectories and the targets directly in the directory of a Tree. A subdirectory is
+# represented by its path id, which is >= 0, and a target i directly in the directory by -1 - i.
+# Instead of being rebuilt after every hoist, it is updated for the edges of the hoisted target.
+class DirGraph:
+    # The dependency graph of the targets
+    targets: CompactGraph
+    # Maps the id of every member of the tree to its group
+    group_of: dict
+    # Maps every group to the ids of its members, in increasing order
+    group_members: dict
+    # edges[a][b] is the number of dependencies from a member of a to a member of b
+    edges: dict
+
+    def __init__(self, tree):
+        placement = tree.placement
+        paths = placement.paths
+        depth = paths.depth[tree.dir]
+        self.targets = placement.graph
+        self.group_of = {}
+        self.group_members = {}
+        for i in tree.members:
+            d = placement.dir_of[i]
+            if paths.depth[d] == depth:
+                group = -1 - i
+            else:
+                group = paths.ancestor(d, depth + 1)
+            self.group_of[i] = group
+            self.group_members.setdefault(group, []).append(i)
+        self.edges = {group: defaultdict(int) for group in self.group_members}
+        for i in tree.members:
+            src = self.edges[self.group_of[i]]
+            for dep in self.targets.successors(i):
+                if dep in self.group_of:
+                    src[self.group_of[dep]] += 1
+
+    # Returns the dirgraph restricted to groups. The groups are ordered by their first member, so that
+    # calc_nontrivial_sccs returns them in the same order as if the graph was rebuilt from scratch.
+    def graph(self, groups):
+        ret = {}
+        for group in sorted(groups, key=lambda g: self.group_members[g][0]):
+            ret[group] = {
+                dest
+                for dest, count in self.edges[group].items()
+                if count != 0 and dest in groups
+            }
+        return ret
+
+    # Moves the member i into its own group
+    def hoist(self, i):
+        old = self.group_of[i]
+        new = -1 - i
+        if old == new:
+            return
+        deps = [dep for dep in self.targets.successors(i) if dep in self.group_of]
+        for dep in deps:
+            self.edges[old][self.group_of[dep]] -= 1
+        self.group_members[old].remove(i)
+        if len(self.group_members[old]) == 0:
+            del self.group_members[old]
+            del self.edges[old]
+        self.group_of[i] = new
+        self.group_members[new] = [i]
+        self.edges[new] = defaultdict(int)
+        for dep in deps:
+            self.edges[new][self.group_of[dep]] += 1
+        for rdep in self.targets.predecessors(i):
+            if rdep in self.group_of:
+                src = self.edges[self.group_of[rdep]]
+                src[old] -= 1
+                src[new] += 1
 
 
 # Example:
@@ -234,33 +535,144 @@ class Tree:
 # Why? Because every list in hoists_needed contains either "c" or "k" and len(["c", "k"]) is as small as possible.
 # It is not guaranteed that the returned list actually as small as possible, as this is only a heuristic
 def minimum_hoists_needed_approx(hoists_needed: T.List[T.List[str]]):
-    names = {item for sublist in hoists_needed for item in sublist}
+    # In the order of their first occurrence, so that ties are broken the same way in every run
+    names = list(dict.fromkeys(item for sublist in hoists_needed for item in sublist))
+    # Maps every name to the indices of the lists that contain it
+    containing = defaultdict(list)
+    for i, x in enumerate(hoists_needed):
+        for name in x:
+            containing[name].append(i)
+    # The occurrence counts are updated whenever a list is removed instead of being recounted from scratch
+    num_occurences = {name: len(containing[name]) for name in names}
+    remaining = [True] * len(hoists_needed)
+    num_remaining = len(hoists_needed)
     chosen = []
     while True:
-        num_occurences = {
-            name: sum(x.count(name) for x in hoists_needed) for name in names
-        }
         most_common_node = max(num_occurences, key=num_occurences.get)
-        hoists_needed = [x for x in hoists_needed if most_common_node not in x]
+        for i in containing[most_common_node]:
+            if remaining[i]:
+                remaining[i] = False
+                num_remaining -= 1
+                for name in hoists_needed[i]:
+                    num_occurences[name] -= 1
         chosen.append(most_common_node)
-        if len(hoists_needed) == 0:
+        if num_remaining == 0:
             return chosen
 
 
-class SingleTarget:
-    def __init__(self, name):
-        self.name = name
-
-    def __eq__(self, other):
-        if isinstance(other, self.__class__):
-            return self.name == other.name
-        else:
-            return False
-
-    def __hash__(self):
-        return hash((self.__class__.__name__, self.name))
-
-
+# If minimum_hoists_needed takes longer than this many seconds, it returns the best solution found so far
+HOISTS_TIME_BUDGET = 10
+
+
+class HittingSetSolver:
+    # names[i] is the name with the number i
+    names: list
+    # cover[i] is a bitset of the lists that contain names[i]
+    cover: list
+    # members[j] is the list of the names (as numbers) in the list j
+    members: list
+    # The smallest solution found so far, as a list of numbers, or None if we did not find anything smaller than
+    # the upper bound that was passed to __init__
+    best: T.Optional[list]
+    # The size of the smallest solution known so far
+    best_size: int
+    # Maps a bitset of the lists that are not hit yet to the smallest number of names used to get there
+    memo: dict
+    deadline: float
+    timed_out: bool
+
+    def __init__(self, hoists_needed, upper_bound, time_budget):
+        # Sets of the same size are sorted by their names, so that the result does not depend on PYTHONHASHSEED
+        sets = sorted({frozenset(x) for x in hoists_needed}, key=lambda s: (len(s), sorted(s)))
+        # If a list contains all names of another list, every name that hits the smaller list also hits the larger one
+        minimal = []
+        for s in sets:
+            if not any(m <= s for m in minimal):
+                minimal.append(s)
+        self.names = sorted({name for s in minimal for name in s})
+        number = {name: i for i, name in enumerate(self.names)}
+        self.members = [sorted(number[name] for name in s) for s in minimal]
+        self.cover = [0] * len(self.names)
+        for j, m in enumerate(self.members):
+            for i in m:
+                self.cover[i] |= 1 << j
+        self.best = None
+        self.best_size = len(upper_bound)
+        self.memo = {}
+        self.deadline = time.monotonic() + time_budget
+        self.timed_out = False
+
+    # The size of a set of pairwise disjoint lists. Every one of them needs its own name, so this is a lower bound.
+    def lower_bound(self, unhit):
+        used = 0
+        ret = 0
+        while unhit != 0:
+            low = unhit & -unhit
+            unhit ^= low
+            if used & low == 0:
+                ret += 1
+                for i in self.members[low.bit_length() - 1]:
+                    used |= self.cover[i]
+        return ret
+
+    def search(self, unhit, chosen):
+        if unhit == 0:
+            if len(chosen) < self.best_size:
+                self.best = list(chosen)
+                self.best_size = len(chosen)
+            return
+        if len(chosen) + self.lower_bound(unhit) >= self.best_size:
+            return
+        if self.memo.get(unhit, self.best_size) <= len(chosen):
+            return
+        self.memo[unhit] = len(chosen)
+        if time.monotonic() > self.deadline:
+            self.timed_out = True
+            return
+        # Every solution contains a name of the list with the fewest names, so we only branch over those
+        j = min(
+            (j for j in range(len(self.members)) if unhit >> j & 1),
+            key=lambda j: len(self.members[j]),
+        )
+        # The number of lists that are not hit yet and contain the name
+        # bin().count instead of int.bit_count, which needs Python 3.10
+        occurences = {i: bin(self.cover[i] & unhit).count("1") for i in self.members[j]}
+        candidates = []
+        for i in sorted(self.members[j], key=lambda i: -occurences[i]):
+            # A name that only hits lists that are also hit by another candidate is never better than that candidate
+            if any(self.cover[i] & unhit & ~self.cover[k] == 0 for k in candidates):
+                continue
+            candidates.append(i)
+        for i in candidates:
+            chosen.append(i)
+            self.search(unhit & ~self.cover[i], chosen)
+            chosen.pop()
+            if self.timed_out:
+                return
+
+    def solve(self):
+        self.search((1 << len(self.members)) - 1, [])
+        if self.best is None:
+            return None
+        return [self.names[i] for i in self.best]
+
+
+# Like minimum_hoists_needed_approx, but the result is guaranteed to be as small as possible, unless finding it takes
+# longer than time_budget seconds. Then we return the best solution found so far, which is never worse than the
+# result of minimum_hoists_needed_approx.
+# Returns (chosen, proven_optimal, seconds)
+def minimum_hoists_needed(hoists_needed: T.List[T.List[str]], time_budget=HOISTS_TIME_BUDGET):
+    start = time.monotonic()
+    # If the heuristic already found an optimal solution, we keep it, so that the result does not change needlessly.
+    chosen = minimum_hoists_needed_approx(hoists_needed)
+    solver = HittingSetSolver(hoists_needed, chosen, time_budget)
+    exact = solver.solve()
+    if exact is not None:
+        chosen = exact
+    return chosen, not solver.timed_out, time.monotonic() - start
+
+
+# Only used by the unittests, the placement itself uses path ids as groups
 class Directory:
     def __init__(self, name):
         self.name = name
@@ -278,19 +690,23 @@ class Directory:
         return f"Directory('{self.name}')"
 
 
-def build_tree(elements):
-    tree = Tree([], elements)
-    for key, value in elements.items():
+def build_tree(elements, deadline):
+    placement = Placement(elements, deadline)
+    paths = placement.paths
+    tree = Tree([], 0, placement)
+    for i, (key, value) in enumerate(elements.items()):
         assert key == value.provides
         head = tree
+        head.members.append(i)
         path = []
         for x in value.outpath:
             path.append(x)
-            if x in head.subtrees:
-                head = head.subtrees[x]
-            else:
-                head.subtrees[x] = Tree(path.copy(), elements)
-                head = head.subtrees[x]
+            if x not in head.subtrees:
+                head.subtrees[x] = Tree(
+                    path.copy(), paths.children[(head.dir, x)], placement
+                )
+            head = head.subtrees[x]
+            head.members.append(i)
     return tree
 
 #------------------------------------------------------------------------------
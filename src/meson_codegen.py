@@ -16,10 +16,17 @@
 import os
 import sys
 import re
+import math
+import json
+import random
+import hashlib
 from pathlib import Path
 import typing as T
-import math
+import collections
 from .grouped_topo_sort import grouped_topo_sort
+from .reachability import strongly_connected_components, naive_descendants
+from .compact_graph import CompactGraph
+from . import profiling
 
 DRYRUN = False
 
@@ -39,38 +46,53 @@ def remove_suffix(line, search):
     return line.rstrip()
 
 
-# `a in build_reachable_dict(graph)[b]` is true exactly if there is a path form `a` to `b`.
-def build_reachable_dict(graph):
-    ret = {}
-    for k1, v1 in graph.items():
-        ret[k1] = set()
-        for x in v1:
-            ret[k1].add(x)
-            if x in ret:
-                ret[k1].update(ret[x])
-        for v2 in ret.values():
-            if k1 in v2:
-                v2.update(ret[k1])
-    return ret
-
-
-# https://en.wikipedia.org/wiki/Floyd%E2%80%93Warshall_algorithm
+# Returns one of the shortest cycles in graph as [a, b, ..., a], or None if there is none.
+# A cycle never leaves its strongly connected component, so we do one breadth-first search per node, restricted to
+# the component of that node. That is O(V * E), instead of the O(V^3) of Floyd-Warshall.
 def find_shortest_cycle(graph):
-    dist = {k2: {k1: math.inf for k1 in graph} for k2 in graph}
-    for u in graph:
-        # dist[u][u] = 0
-        for v in graph[u]:
-            dist[u][v] = 1
-    for k in graph:
-        for i in graph:
-            for j in graph:
-                if dist[i][j] > dist[i][k] + dist[k][j]:
-                    dist[i][j] = dist[i][k] + dist[k][j]
-
-    cycle = [min((dist[k][k], k) for k in graph)[1]]
-    while cycle[0] != cycle[-1] or len(cycle) == 1:
-        cycle.append(min((dist[k][cycle[0]], k) for k in graph[cycle[-1]])[1])
-    return cycle
+    position = {k: i for i, k in enumerate(graph)}
+    best = None
+    for component in strongly_connected_components(graph):
+        members = set(component)
+        if len(component) == 1 and component[0] not in graph.get(component[0], ()):
+            continue
+        # The search below follows the edges backwards
+        predecessors = {k: [] for k in component}
+        for k in component:
+            for v in graph[k]:
+                if v in members:
+                    predecessors[v].append(k)
+        for start in sorted(component, key=position.get):
+            # dist[k] is the length of the shortest path from k to start
+            dist = {start: 0}
+            queue = collections.deque([start])
+            length = None
+            while len(queue) != 0:
+                cur = queue.popleft()
+                if best is not None and dist[cur] + 1 >= len(best) - 1:
+                    # Cannot be shorter than the cycle we already have
+                    break
+                for pred in predecessors[cur]:
+                    if pred == start:
+                        length = dist[cur] + 1
+                        break
+                    if pred not in dist:
+                        dist[pred] = dist[cur] + 1
+                        queue.append(pred)
+                if length is not None:
+                    break
+            if length is None:
+                continue
+            cycle = [start]
+            while len(cycle) == 1 or cycle[-1] != start:
+                cycle.append(
+                    min(
+                        (v for v in graph[cycle[-1]] if v in dist),
+                        key=lambda v: (dist[v], position.get(v, len(position))),
+                    )
+                )
+            best = cycle
+    return best
 
 
 def starts_with(a, b):
@@ -103,12 +125,12 @@ class Template:
     def __init__(self, temp):
         self.temp = temp
 
-    def make_absolute(self, direct):
+    def make_absolute(self, direct, exists=os.path.exists):
         def file_matcher(mobj):
             path = mobj.group(1)
             if not os.path.isabs(path):
                 abspath = direct / path
-                assert os.path.exists(abspath), abspath
+                assert exists(abspath), abspath
                 path = str(abspath)
             assert os.path.isabs(path)
             return "<PATH>" + path + "</PATH>"
@@ -133,7 +155,8 @@ class Node:
     # The opposite of ddeps
     provides: str
     # template.temp is the the recipe as a string, but with '<PATH>/some/path</PATH>' instead of '/some/path'
-    template: Template
+    # None until it is rendered, which only happens for the nodes that will be written.
+    template: T.Optional[Template]
     # Direkt Dependencies of this recipe
     ddeps: T.List[str]
     # Ideal path of the meson.build file to put this recipe in. E.g.
@@ -141,13 +164,111 @@ class Node:
     ideal_path: T.Tuple[str]
     # Will be printed in some warnings/error messages
     debuginfo: str
+    # Whatever the caller needs to render the template later. Opaque to this file.
+    recipe: T.Any
+    # Set by grouped_topo_sort or BuildDesc.set_outpaths. The path of the meson.build file this recipe is put in.
+    outpath: T.Tuple[str]
 
-    def __init__(self, provides, template, ddeps, ideal_path, debuginfo):
+    # There are a lot of nodes for large trees
+    __slots__ = ("provides", "template", "ddeps", "ideal_path", "debuginfo", "recipe", "outpath")
+
+    def __init__(self, provides, template, ddeps, ideal_path, debuginfo, recipe=None):
         self.provides = provides
         self.template = template
         self.ddeps = ddeps
         self.ideal_path = ideal_path
         self.debuginfo = debuginfo
+        self.recipe = recipe
+
+
+def stamp(path):
+    profiling.count("files_stated")
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [st.st_mtime_ns, st.st_size]
+
+
+# Remembers the sha256 and the (mtime, size) of every file we generated in the previous run, so that we do not
+# rewrite unchanged files. Rewriting them would bump their mtime and meson would reconfigure the whole project.
+class OutputManifest:
+    def __init__(self, root):
+        self.root = root
+        self.path = root / "etc" / "meson_helpers" / "manifest.json"
+        try:
+            self.old = json.loads(self.path.read_text())
+        except (OSError, ValueError):
+            self.old = None
+        self.new = {}
+        self.num_written = 0
+        self.num_unchanged = 0
+        self.num_deleted = 0
+
+    def write(self, path, data: bytes):
+        rel = str(path.relative_to(self.root))
+        digest = hashlib.sha256(data).hexdigest()
+        old = self.old.get(rel) if self.old is not None else None
+        st = stamp(path)
+        if old is not None and old["sha256"] == digest and old["stamp"] == st:
+            self.num_unchanged += 1
+        else:
+            path.write_bytes(data)
+            st = stamp(path)
+            self.num_written += 1
+        self.new[rel] = {"sha256": digest, "stamp": st}
+
+    # Returns the meson.build files that were generated in the previous run but not in this run, or None if we do not
+    # know that. The helper scripts and the other files we copy are in the manifest too, but they are never stale.
+    def stale_files(self):
+        if self.old is None:
+            return None
+        return [
+            self.root / rel
+            for rel in self.old
+            if rel not in self.new and os.path.basename(rel) == "meson.build"
+        ]
+
+    def delete(self, path):
+        path.unlink()
+        self.num_deleted += 1
+
+    # Files that are stale but were not deleted stay in the manifest, so that we warn about them again in the next run.
+    def save(self):
+        for path in self.stale_files() or []:
+            if path.exists():
+                rel = str(path.relative_to(self.root))
+                self.new[rel] = self.old[rel]
+        self.path.write_text(json.dumps(self.new, indent=0, sort_keys=True))
+
+
+# One node for every directory that contains a meson.build file that we write, i.e. every prefix of an outpath.
+class OutpathTrie:
+    # The keys of the elements whose outpath ends here, in the order of BuildDesc.elements
+    targets: T.List[str]
+    children: T.Dict[str, "OutpathTrie"]
+    # The edges of the graph that BuildDesc.writer_recursion sorts for this directory: Every item is (src, dest),
+    # where src and dest are either the key of a target in this directory or the Path of a subdirectory.
+    edges: T.List[T.Tuple[T.Union[str, Path], T.Union[str, Path]]]
+
+    def __init__(self):
+        self.targets = []
+        self.children = {}
+        self.edges = []
+
+    def lookup(self, outpath):
+        node = self
+        for x in outpath:
+            node = node.children[x]
+        return node
+
+    def insert(self, outpath):
+        node = self
+        for x in outpath:
+            if x not in node.children:
+                node.children[x] = OutpathTrie()
+            node = node.children[x]
+        return node
 
 
 class BuildDesc:
@@ -156,6 +277,7 @@ class BuildDesc:
         self.elements = {}
         self.rdeps = {}
         self.custom_prefixes = {}
+        self.manifest = OutputManifest(root)
 
     # This method will write some meson.build files to disk. They are broken and
     # will not build, but reading them and this function will make understanding the rest of this
@@ -173,9 +295,21 @@ class BuildDesc:
             with open(outpath, "a", encoding="utf-8") as ofile:
                 ofile.write(recipe)
 
+    # Everything grouped_topo_sort looks at. If this did not change, the outpaths will not change either.
+    def placement_input(self):
+        return [
+            (el.provides, tuple(el.ddeps), tuple(el.ideal_path))
+            for el in self.elements.values()
+        ]
+
     # todo: documentation
-    def set_outpaths(self):
-        grouped_topo_sort(self.elements)
+    # known_outpaths maps every provides to its outpath, if they are already known from a previous run.
+    def set_outpaths(self, known_outpaths=None, jobs=1):
+        if known_outpaths is None:
+            grouped_topo_sort(self.elements, jobs)
+        else:
+            for key, el in self.elements.items():
+                el.outpath = known_outpaths[key]
         count = 0
         for target in self.elements.values():
             if target.ideal_path != target.outpath:
@@ -186,6 +320,7 @@ class BuildDesc:
                     f"We would like to put the target '{target.provides}' into '{ideal}', but due to some graph theory stuff this is impossible/hard so we put it into '{op}' instead."
                 )
         print(f"{count} target(s) will not be in their preferred directory.")
+        profiling.count("targets_moved", count)
 
     def set_custom_prefix(self, path, custom):
         assert path.parts[-1] == "meson.build"
@@ -202,46 +337,50 @@ class BuildDesc:
     def remove_what_depends_on(self, broken_provides: T.List[str]):
         for el in broken_provides:
             assert el not in self.elements
-        broken_provides = set(broken_provides)
-        while True:
-            oldlen = len(broken_provides)
-            broken_provides.update(
-                [
-                    k
-                    for k, v in self.elements.items()
-                    if not set(v.ddeps).isdisjoint(broken_provides)
-                ]
-            )
-            if len(broken_provides) == oldlen:
-                break
+        graph = self.compact_graph()
+        broken = graph.ancestors(
+            graph.ids[name] for name in broken_provides if name in graph.ids
+        )
         self.elements = {
-            k: v for k, v in self.elements.items() if k not in broken_provides
+            k: v for i, (k, v) in enumerate(self.elements.items()) if broken[i] == 0
         }
 
-    def generalised_deps(self, subgroup, el):
-        depth = len(subgroup)
-        ret = set()
-        for dep in el.ddeps:
-            if dep not in self.elements:
-                print(
-                    f"ERROR: The following recipe depends on {dep} but there is no recipe that provides it:\n"
-                    + "-" * 50
-                    + "\n"
-                    + el.template.temp
-                    + "-" * 50
-                    + "\n"
-                    + el.debuginfo
-                )
-                sys.exit(1)
-            if not starts_with(subgroup, self.elements[dep].outpath):
-                continue
-            if len(self.elements[dep].outpath) == depth:
-                ret.add(dep)
-            else:
-                ndir = self.elements[dep].outpath[depth]
-                if depth >= len(el.outpath) or ndir != el.outpath[depth]:
-                    ret.add(Path(ndir))
-        return ret
+    # The ids of the elements are their positions in self.elements
+    def compact_graph(self):
+        return CompactGraph({k: v.ddeps for k, v in self.elements.items()})
+
+    # Builds self.outpath_trie. An edge between two elements only matters in the directory where their outpaths diverge:
+    # There, it becomes an edge between the two targets or the two subdirectories that contain them. So every edge
+    # is generalised once here, instead of once for every directory level in writer_recursion.
+    def build_outpath_trie(self):
+        trie = OutpathTrie()
+        for key, el in self.elements.items():
+            trie.insert(el.outpath).targets.append(key)
+        for key, el in self.elements.items():
+            for dep in el.ddeps:
+                if dep not in self.elements:
+                    print(
+                        f"ERROR: The following recipe depends on {dep} but there is no recipe that provides it:\n"
+                        + "-" * 50
+                        + "\n"
+                        + el.template.temp
+                        + "-" * 50
+                        + "\n"
+                        + el.debuginfo
+                    )
+                    sys.exit(1)
+                dep_outpath = self.elements[dep].outpath
+                depth = 0
+                while (
+                    depth < len(el.outpath)
+                    and depth < len(dep_outpath)
+                    and el.outpath[depth] == dep_outpath[depth]
+                ):
+                    depth += 1
+                src = key if depth == len(el.outpath) else Path(el.outpath[depth])
+                dest = dep if depth == len(dep_outpath) else Path(dep_outpath[depth])
+                trie.lookup(el.outpath[:depth]).edges.append((src, dest))
+        self.outpath_trie = trie
 
     # Finds the reason why a directory depends directly on a file
     def get_dep_reason_dir_file(self, subgroup, dir_source, file_target):
@@ -289,43 +428,70 @@ class BuildDesc:
         raise ValueError
 
     def error_out_due_to_cycle(self, graph, subgroup):
-        raise BugDetected("grouped_topo_sort is wrong")
+        cycle = find_shortest_cycle(graph)
+        raise BugDetected(
+            f"grouped_topo_sort is wrong: The meson.build file in '{'/'.join(subgroup) or '.'}' would need this cycle: {' -> '.join(map(str, cycle))}"
+        )
 
     # This topological_sort algorithm is deterministic and is biased to group subdirs (i.e. values of type Path) together, to group targets (i.e. values of type str) together, to put subdirs before targets, and to make the result somewhat alphasorted.
+    # It works in rounds: Every round places all subdirs whose dependencies are placed, in alphabetical order, and then all targets whose dependencies are placed, in alphabetical order. It is Kahn's algorithm, so every edge is only looked at once.
     def topological_sort(self, graph, subgroup):
-        iddeps = build_reachable_dict(graph)
-        not_placed_yet = set(graph.keys())
+        # The number of dependencies of every node that are not placed yet
+        remaining = {k: len(v) for k, v in graph.items()}
+        dependents = {k: [] for k in graph}
+        for k, v in graph.items():
+            for dep in v:
+                if dep in dependents:
+                    dependents[dep].append(k)
+        ready = {Path: [], str: []}
+
+        def make_ready(x):
+            for eltype in ready:
+                if isinstance(x, eltype):
+                    ready[eltype].append(x)
+
+        for k in graph:
+            if remaining[k] == 0:
+                make_ready(k)
         ret = []
-        while len(not_placed_yet) != 0:
+        while len(ret) != len(graph):
             sumlen = 0
             for eltype in [Path, str]:
-                next_batch = filter(lambda x: isinstance(x, eltype), not_placed_yet)
-                next_batch = list(next_batch)
-                next_batch = filter(lambda x: iddeps[x].issubset(ret), next_batch)
-                next_batch = list(sorted(next_batch))
+                next_batch = sorted(ready[eltype])
+                ready[eltype] = []
                 ret += next_batch
-                not_placed_yet -= set(next_batch)
+                for x in next_batch:
+                    for dependent in dependents[x]:
+                        remaining[dependent] -= 1
+                        if remaining[dependent] == 0:
+                            make_ready(dependent)
                 sumlen += len(next_batch)
             if sumlen == 0:
                 self.error_out_due_to_cycle(graph, subgroup)
 
         return ret
 
-    def writer_recursion(self, files_written, subgroup):
-        depth = len(subgroup)
-        mixed_deps = {}
-        for key, el in self.elements.items():
-            if not starts_with(subgroup, el.outpath):
-                continue
-            if len(el.outpath) == depth:
-                mixed_deps[key] = self.generalised_deps(subgroup, el)
-            else:
-                pkey = Path(el.outpath[depth])
-                if pkey not in mixed_deps:
-                    mixed_deps[pkey] = set()
-                mixed_deps[pkey].update(self.generalised_deps(subgroup, el))
+    def writer_recursion(self, files_written, subgroup, node):
+        with profiling.span("writer_recursion", directory="/".join(subgroup)):
+            self.write_directory(files_written, subgroup, node)
+        for direct, child in node.children.items():
+            self.writer_recursion(files_written, subgroup + [direct], child)
 
-        order = self.topological_sort(mixed_deps, subgroup)
+    # The targets and subdirectories of a single directory in the order in which they are written to its meson.build
+    # file. Raises BugDetected if there is no such order.
+    def directory_order(self, subgroup, node):
+        mixed_deps = {}
+        for key in node.targets:
+            mixed_deps[key] = set()
+        for direct in node.children:
+            mixed_deps[Path(direct)] = set()
+        for src, dest in node.edges:
+            mixed_deps[src].add(dest)
+        return self.topological_sort(mixed_deps, subgroup)
+
+    # Writes the meson.build file of a single directory
+    def write_directory(self, files_written, subgroup, node):
+        order = self.directory_order(subgroup, node)
 
         outpath = Path(self.root, *subgroup, "meson.build")
         total = ""
@@ -349,17 +515,9 @@ class BuildDesc:
 
         self.writef(files_written, outpath, total)
 
-        entries = set()
-        for key, el in self.elements.items():
-            if starts_with(subgroup, el.outpath):
-                if len(subgroup) != len(el.outpath):
-                    entries.add(el.outpath[len(subgroup)])
-
-        for direct in entries:
-            self.writer_recursion(files_written, subgroup + [direct])
-
     def writeToFileSystem(self, files_written):
-        self.writer_recursion(files_written, [])
+        self.build_outpath_trie()
+        self.writer_recursion(files_written, [], self.outpath_trie)
 
     def writef(self, files_written, path, data):
         assert path not in files_written
@@ -367,9 +525,12 @@ class BuildDesc:
         if DRYRUN:
             return
         assert os.path.normpath(path).startswith(str(self.root) + "/")
-        path.write_text(
-            "# This file was generated by https://codeberg.org/Volker_Weissmann/foam_meson\n\n"
-            + data
+        self.manifest.write(
+            path,
+            (
+                "# This file was generated by https://codeberg.org/Volker_Weissmann/foam_meson\n\n"
+                + data
+            ).encode(),
         )
 
 
@@ -381,4 +542,100 @@ def largest_commons_prefix(paths):
         com = os.path.dirname(com)
     return com
 
+
+# BuildDesc.topological_sort as it was before it used Kahn's algorithm. Quadratic, but obviously correct.
+def reference_topological_sort(graph):
+    descendants = {k: naive_descendants(graph, k) for k in graph}
+    not_placed_yet = set(graph)
+    ret = []
+    while len(not_placed_yet) != 0:
+        sumlen = 0
+        for eltype in [Path, str]:
+            next_batch = [x for x in not_placed_yet if isinstance(x, eltype)]
+            next_batch = sorted(x for x in next_batch if descendants[x].issubset(ret))
+            ret += next_batch
+            not_placed_yet -= set(next_batch)
+            sumlen += len(next_batch)
+        if sumlen == 0:
+            raise BugDetected("grouped_topo_sort is wrong")
+    return ret
+
+
+def unittests_topological_sort(num_graphs=500, seed=0):
+    rng = random.Random(seed)
+    desc = BuildDesc(Path("/nonexistent"))
+    for _ in range(num_graphs):
+        num_nodes = rng.randint(1, 15)
+        nodes = [Path(f"d{i}") if rng.random() < 0.4 else f"t{i}" for i in range(num_nodes)]
+        edge_probability = rng.choice([0.05, 0.1, 0.3, 0.6])
+        # Only edges from later to earlier nodes, so that there is no cycle
+        graph = {
+            nodes[i]: {nodes[j] for j in range(i) if rng.random() < edge_probability}
+            for i in range(num_nodes)
+        }
+        keys = list(graph)
+        rng.shuffle(keys)
+        graph = {k: graph[k] for k in keys}
+        assert desc.topological_sort(graph, []) == reference_topological_sort(graph)
+        if num_nodes >= 2:
+            a, b = rng.sample(nodes, 2)
+            graph[a] = graph[a] | {b}
+            graph[b] = graph[b] | {a}
+            for sort in [lambda g: desc.topological_sort(g, []), reference_topological_sort]:
+                try:
+                    sort(graph)
+                except BugDetected:
+                    pass
+                else:
+                    raise AssertionError("A cycle was not detected")
+
+
+# find_shortest_cycle as it was before it searched every strongly connected component: Floyd-Warshall on the whole
+# graph. Returns the length of the shortest cycle, or None if there is none.
+def reference_shortest_cycle_length(graph):
+    dist = {k2: {k1: math.inf for k1 in graph} for k2 in graph}
+    for u in graph:
+        for v in graph[u]:
+            dist[u][v] = 1
+    for k in graph:
+        for i in graph:
+            for j in graph:
+                if dist[i][j] > dist[i][k] + dist[k][j]:
+                    dist[i][j] = dist[i][k] + dist[k][j]
+    length = min(dist[k][k] for k in graph)
+    return None if length == math.inf else length
+
+
+def unittests_find_shortest_cycle(num_graphs=500, seed=0):
+    rng = random.Random(seed)
+    for _ in range(num_graphs):
+        num_nodes = rng.randint(1, 12)
+        edge_probability = rng.choice([0.05, 0.1, 0.2, 0.4])
+        acyclic = rng.random() < 0.3
+        graph = {
+            i: {
+                j
+                for j in range(num_nodes)
+                if (not acyclic or j < i) and rng.random() < edge_probability
+            }
+            for i in range(num_nodes)
+        }
+        if not acyclic and rng.random() < 0.2:
+            k = rng.randrange(num_nodes)
+            graph[k].add(k)
+        keys = list(graph)
+        rng.shuffle(keys)
+        graph = {k: graph[k] for k in keys}
+        cycle = find_shortest_cycle(graph)
+        length = reference_shortest_cycle_length(graph)
+        if acyclic:
+            assert length is None
+        if length is None:
+            assert cycle is None, (graph, cycle)
+            continue
+        assert cycle is not None and cycle[0] == cycle[-1], (graph, cycle)
+        assert len(cycle) - 1 == length, (graph, cycle, length)
+        for a, b in zip(cycle, cycle[1:]):
+            assert b in graph[a], (graph, cycle)
+
 #------------------------------------------------------------------------------
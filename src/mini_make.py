@@ -0,0 +1,294 @@
+#!/bin/false
+#--------------------------------*- python -*----------------------------------
+#
+# Copyright (C) 2023 Volker Weissmann
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+# Description
+#   A tiny subset of GNU make, just large enough to evaluate most Make/options
+#   files without spawning make. It understands 'VAR = value' (and ':=', '+=',
+#   '?='), $(VAR) and ${VAR} expansion, line continuations and '#' comments.
+#   Everything else raises UnsupportedMakeConstruct, and the caller is
+#   expected to fall back to the real make.
+#
+#------------------------------------------------------------------------------
+
+import os
+import re
+import subprocess
+import tempfile
+
+
+class UnsupportedMakeConstruct(Exception):
+    pass
+
+
+# Variables that make defines itself. We do not know their values, so referencing them is unsupported.
+MAKE_DEFAULT_VARIABLES = {
+    "AR",
+    "ARFLAGS",
+    "AS",
+    "CC",
+    "CO",
+    "COFLAGS",
+    "CPP",
+    "CTANGLE",
+    "CURDIR",
+    "CWEAVE",
+    "CXX",
+    "F77",
+    "F77FLAGS",
+    "FC",
+    "GET",
+    "LD",
+    "LEX",
+    "LINT",
+    "M2C",
+    "MAKE",
+    "MAKEFILES",
+    "MAKEFILE_LIST",
+    "MAKEFLAGS",
+    "MAKEINFO",
+    "MAKELEVEL",
+    "MAKE_COMMAND",
+    "MAKE_HOST",
+    "MAKE_VERSION",
+    "OBJC",
+    "OUTPUT_OPTION",
+    "PC",
+    "RM",
+    "SHELL",
+    "SUFFIXES",
+    "TANGLE",
+    "TEX",
+    "TEXI2DVI",
+    "WEAVE",
+    "YACC",
+}
+
+DIRECTIVES = {
+    "include",
+    "-include",
+    "sinclude",
+    "override",
+    "export",
+    "unexport",
+    "private",
+    "define",
+    "endef",
+    "undefine",
+    "ifeq",
+    "ifneq",
+    "ifdef",
+    "ifndef",
+    "else",
+    "endif",
+    "vpath",
+    "load",
+    "-load",
+}
+
+# Characters that /bin/sh would treat specially in 'echo $(VAR)'
+SHELL_SPECIAL_CHARS = set("'\"\\$`;&|<>(){}*?[]~#")
+
+name_regex = re.compile(r"[A-Za-z0-9_][A-Za-z0-9_+-]*")
+assignment_regex = re.compile(
+    r"([A-Za-z0-9_][A-Za-z0-9_-]*)[ \t]*(:::=|::=|:=|\+=|\?=|!=|=)[ \t]*(.*)"
+)
+echo_option_regex = re.compile(r"-[neE]+")
+
+
+# Joins lines ending with a backslash with the next line and removes '#' comments
+def logical_lines(source):
+    ret = []
+    cur = None
+    for line in source.split("\n"):
+        if cur is not None:
+            line = cur + " " + line.lstrip(" \t")
+        backslashes = len(line) - len(line.rstrip("\\"))
+        if backslashes % 2 == 1:
+            cur = line[:-1].rstrip(" \t")
+            continue
+        cur = None
+        hashpos = line.find("#")
+        if hashpos != -1:
+            if hashpos > 0 and line[hashpos - 1] == "\\":
+                raise UnsupportedMakeConstruct("escaped '#'")
+            line = line[:hashpos]
+        ret.append(line)
+    if cur is not None:
+        ret.append(cur)
+    return ret
+
+
+class Evaluator:
+    # variables maps a name to (flavor, value), where flavor is "recursive" or "simple"
+    variables: dict
+
+    def __init__(self, predefined):
+        self.variables = {k: ("recursive", v) for k, v in predefined.items()}
+
+    def lookup(self, name, active):
+        if name in self.variables:
+            flavor, value = self.variables[name]
+            if flavor == "simple":
+                return value
+            if name in active:
+                raise UnsupportedMakeConstruct(f"'{name}' references itself")
+            return self.expand(value, active | {name})
+        if name in MAKE_DEFAULT_VARIABLES:
+            raise UnsupportedMakeConstruct(f"'{name}' is defined by make itself")
+        value = os.environ.get(name, "")
+        if "$" in value:
+            raise UnsupportedMakeConstruct(f"the environment variable '{name}'")
+        return value
+
+    def expand(self, text, active=frozenset()):
+        ret = []
+        pos = 0
+        while True:
+            dollar = text.find("$", pos)
+            if dollar == -1:
+                ret.append(text[pos:])
+                return "".join(ret)
+            ret.append(text[pos:dollar])
+            if dollar + 1 == len(text):
+                raise UnsupportedMakeConstruct("'$' at the end of a line")
+            char = text[dollar + 1]
+            if char == "$":
+                ret.append("$")
+                pos = dollar + 2
+                continue
+            if char in "({":
+                close = text.find(")" if char == "(" else "}", dollar + 2)
+                if close == -1:
+                    raise UnsupportedMakeConstruct("unterminated variable reference")
+                name = text[dollar + 2 : close]
+                pos = close + 1
+            else:
+                name = char
+                pos = dollar + 2
+            # Rejects function calls like $(shell ...), substitution references like $(VAR:.c=.o), nested references and automatic variables like $@
+            if not name_regex.fullmatch(name):
+                raise UnsupportedMakeConstruct(f"'$({name})'")
+            ret.append(self.lookup(name, active))
+
+    def assign(self, name, operator, value):
+        if operator == "=":
+            self.variables[name] = ("recursive", value)
+        elif operator in [":=", "::="]:
+            self.variables[name] = ("simple", self.expand(value))
+        elif operator in ["?=", "+="]:
+            if name not in self.variables and (
+                name in os.environ or name in MAKE_DEFAULT_VARIABLES
+            ):
+                # Raises if we do not know the old value
+                self.variables[name] = ("recursive", self.lookup(name, frozenset()))
+            if name not in self.variables:
+                self.variables[name] = ("recursive", value)
+            elif operator == "+=":
+                flavor, old = self.variables[name]
+                if flavor == "simple":
+                    value = self.expand(value)
+                self.variables[name] = (flavor, old + " " + value if old else value)
+        else:
+            raise UnsupportedMakeConstruct(f"the assignment operator '{operator}'")
+
+    def run(self, source):
+        for line in logical_lines(source):
+            if line.strip(" \t") == "":
+                continue
+            if line.startswith("\t"):
+                raise UnsupportedMakeConstruct("recipe")
+            line = line.strip(" \t")
+            if line.split()[0] in DIRECTIVES:
+                raise UnsupportedMakeConstruct(f"directive in '{line}'")
+            match = assignment_regex.fullmatch(line)
+            if match is None:
+                raise UnsupportedMakeConstruct(f"'{line}'")
+            self.assign(*match.groups())
+
+
+# Returns what the shell would print for 'echo VALUE'
+def shell_echo(value):
+    for char in value:
+        if char in SHELL_SPECIAL_CHARS or (ord(char) < 32 and char != "\t"):
+            raise UnsupportedMakeConstruct(f"'{char}' would be interpreted by the shell")
+    words = [word for word in re.split("[ \t]+", value) if word != ""]
+    if len(words) != 0 and echo_option_regex.fullmatch(words[0]):
+        raise UnsupportedMakeConstruct(f"'{words[0]}' would be interpreted by echo")
+    return " ".join(words)
+
+
+# Returns what 'echo $(NAME)' would print for every NAME in names, if make would run it in a makefile that
+# consists of 'KEY=VALUE' for every item in predefined, followed by source.
+def evaluate(source, predefined, names):
+    evaluator = Evaluator(predefined)
+    evaluator.run(source)
+    return [shell_echo(evaluator.lookup(name, frozenset())) for name in names]
+
+
+# Returns what 'echo $(NAME)' prints for every NAME in names, using the real make like scan_wmake.parse_options_file
+def make_evaluate(source, predefined, names):
+    with tempfile.NamedTemporaryFile("w") as makeout:
+        for k, v in predefined.items():
+            makeout.write(k + "=" + v + "\n")
+        makeout.write(source)
+        makeout.write("\nprint_stuff:\n" + "".join(f"\techo $({name})\n" for name in names))
+        makeout.flush()
+        output = subprocess.check_output(["make", "-s", "print_stuff", "--file", makeout.name])
+    return output.decode().split("\n")[: len(names)]
+
+
+def testhelper(source, names, expected, predefined={}):
+    assert make_evaluate(source, predefined, names) == expected
+    assert evaluate(source, predefined, names) == expected
+
+
+# source has to be something make understands, but mini_make does not
+def testhelper_unsupported(source, names, expected):
+    assert make_evaluate(source, {}, names) == expected
+    try:
+        evaluate(source, {}, names)
+    except UnsupportedMakeConstruct:
+        return
+    raise AssertionError(f"No UnsupportedMakeConstruct for {source!r}")
+
+
+def unittests_mini_make():
+    testhelper("A = x\nB = $(A) y\nA += z\n", ["A", "B"], ["x z", "x z y"])
+    testhelper(
+        "A := x\nB := $(A)\nA += y\nC = $(D)\nD = late\n",
+        ["A", "B", "C"],
+        ["x y", "x", "late"],
+    )
+    testhelper("A ?= x\nA ?= y\nB = 1\nB ?= 2\nC =\nC += c\n", ["A", "B", "C"], ["x", "1", "c"])
+    testhelper("A = x\nB = ${A}/$(A)/$A\n", ["B"], ["x/x/x"])
+    testhelper(
+        "EXE_INC = \\\n    -I$(LIB_SRC)/finiteVolume/lnInclude \\\n    -DFOO # comment\n\nEXE_LIBS = \\\n    -lfiniteVolume\n",
+        ["EXE_INC", "EXE_LIBS", "LIB_INC"],
+        ["-I../../src/finiteVolume/lnInclude -DFOO", "-lfiniteVolume", ""],
+        {"LIB_SRC": "../../src"},
+    )
+    os.environ["FOAM_MESON_TEST_VARIABLE"] = "env"
+    try:
+        testhelper(
+            "A = $(FOAM_MESON_TEST_VARIABLE)\nFOAM_MESON_TEST_VARIABLE += more\n",
+            ["A"],
+            ["env more"],
+        )
+    finally:
+        del os.environ["FOAM_MESON_TEST_VARIABLE"]
+
+    testhelper_unsupported("ifeq ($(A),)\nB = x\nelse\nB = y\nendif\n", ["B"], ["x"])
+    testhelper_unsupported("ifneq (1,2)\nB = x\nendif\n", ["B"], ["x"])
+    testhelper_unsupported("A = $(shell echo hi)\n", ["A"], ["hi"])
+    testhelper_unsupported("A = a.c\nB = $(A:.c=.o)\n", ["B"], ["a.o"])
+    testhelper_unsupported("A = $(patsubst %.c,%.o,a.c)\n", ["A"], ["a.o"])
+    testhelper_unsupported("A != echo hi\n", ["A"], ["hi"])
+    testhelper_unsupported("-include /nonexistent\nA = x\n", ["A"], ["x"])
+    testhelper_unsupported("define A\nx\nendef\n", ["A"], ["x"])
+    testhelper_unsupported("A = a$$b\n", ["A"], ["a"])
+    testhelper_unsupported("A = $(CURDIR)\n", ["A"], [os.getcwd()])
+
+#------------------------------------------------------------------------------
@@ -0,0 +1,306 @@
+#!/bin/false
+#--------------------------------*- python -*----------------------------------
+#
+# Copyright (C) 2023 Volker Weissmann
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+# Description
+#   Wall and CPU time of the phases of a run, counters (e.g. the number of
+#   spawned subprocesses) and the slowest wmake directories, for --profile.
+#   Everything here does nothing unless enable was called. Worker processes
+#   record into their own Profile, which is merged into the Profile of the
+#   main process, so the times of a phase that runs in several workers are
+#   summed up.
+#
+#   For --trace-out, spans are recorded as Chrome trace events, which can be
+#   viewed with chrome://tracing or https://ui.perfetto.dev. The same way,
+#   this does nothing unless enable_tracing was called.
+#
+#   For --memory-report, the phases also record the peak and the retained
+#   memory of the Python heap (with tracemalloc), the RSS of the process and
+#   the allocation sites that grew the most. This only covers the main
+#   process, and tracemalloc makes the run a lot slower.
+#
+#------------------------------------------------------------------------------
+
+import os
+import sys
+import json
+import time
+import resource
+import contextlib
+import collections
+import tracemalloc
+
+# The number of wmake directories listed in the report
+SLOWEST_WMAKE_DIRS = 20
+
+# Counters that are in the report even if they are 0
+COUNTERS = [
+    "subprocesses",
+    "files_stated",
+    "directories_listed",
+    "files_written",
+    "hoists_chosen",
+]
+
+# The number of allocation sites listed for every phase in the memory report
+MEMORY_TOP_SITES = 10
+
+# The Profile of this process, or None if profiling is disabled
+current = None
+# The trace events of this process, or None if tracing is disabled
+trace = None
+# One MemoryPhase for every phase that is running, innermost last, or None if the memory report is disabled
+memory_stack = None
+# Maps the name of every phase that ended to its entry in the memory report
+memory_phases = {}
+
+
+class Profile:
+    # Maps the name of every phase to [wall seconds, cpu seconds]
+    phases: dict
+    counters: collections.Counter
+    # Maps every wmake directory (as a str) to the seconds spent in wmake_to_meson
+    wmake_dirs: dict
+
+    def __init__(self):
+        self.phases = {}
+        self.counters = collections.Counter()
+        self.wmake_dirs = {}
+
+    def add_phase(self, name, wall, cpu):
+        times = self.phases.setdefault(name, [0.0, 0.0])
+        times[0] += wall
+        times[1] += cpu
+
+    def merge(self, other):
+        for name, (wall, cpu) in other.phases.items():
+            self.add_phase(name, wall, cpu)
+        self.counters.update(other.counters)
+        self.wmake_dirs.update(other.wmake_dirs)
+
+
+def enable():
+    global current
+    current = Profile()
+
+
+def enable_tracing():
+    global trace
+    trace = []
+
+
+# The arguments of init_worker for the worker processes of this process
+def worker_flags():
+    return current is not None, trace is not None
+
+
+# Passed as the initializer of a process pool, with the result of worker_flags of the main process
+def init_worker(profile, tracing):
+    global current, trace
+    current = Profile() if profile else None
+    trace = [] if tracing else None
+
+
+# A span named name in the trace. args are shown in the trace viewer.
+@contextlib.contextmanager
+def span(name, **args):
+    if trace is None:
+        yield
+        return
+    # perf_counter uses the same clock in every process, so the spans of the workers line up with the main process
+    start = time.perf_counter_ns()
+    try:
+        yield
+    finally:
+        trace.append(
+            {
+                "name": name,
+                "ph": "X",
+                "ts": start / 1000,
+                "dur": (time.perf_counter_ns() - start) / 1000,
+                "pid": os.getpid(),
+                "tid": os.getpid(),
+                "args": args,
+            }
+        )
+
+
+# Every phase is also a span
+@contextlib.contextmanager
+def phase(name):
+    if current is None and trace is None and memory_stack is None:
+        yield
+        return
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    try:
+        with span(name), memory_phase(name):
+            yield
+    finally:
+        if current is not None:
+            current.add_phase(
+                name, time.perf_counter() - wall, time.process_time() - cpu
+            )
+
+
+def enable_memory_report():
+    global memory_stack
+    memory_stack = []
+    tracemalloc.start()
+
+
+# In bytes. None if we do not know it.
+def current_rss():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def peak_rss():
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes on Linux
+    return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+def take_snapshot():
+    return tracemalloc.take_snapshot().filter_traces(
+        [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        ]
+    )
+
+
+class MemoryPhase:
+    def __init__(self):
+        # tracemalloc only has a single peak, which is reset at the start of every phase. The peak of an enclosing
+        # phase is the maximum of the peaks of all its parts.
+        self.peak = 0
+        self.start = tracemalloc.get_traced_memory()[0]
+        self.snapshot = take_snapshot()
+
+
+@contextlib.contextmanager
+def memory_phase(name):
+    if memory_stack is None:
+        yield
+        return
+    peak_so_far = tracemalloc.get_traced_memory()[1]
+    for outer in memory_stack:
+        outer.peak = max(outer.peak, peak_so_far)
+    entry = MemoryPhase()
+    memory_stack.append(entry)
+    tracemalloc.reset_peak()
+    try:
+        yield
+    finally:
+        memory_stack.pop()
+        traced, peak = tracemalloc.get_traced_memory()
+        peak = max(entry.peak, peak)
+        for outer in memory_stack:
+            outer.peak = max(outer.peak, peak)
+        growth = take_snapshot().compare_to(entry.snapshot, "lineno")
+        report = memory_phases.setdefault(name, {"peak": 0, "retained": 0})
+        report["peak"] = max(report["peak"], peak)
+        report["retained"] += traced - entry.start
+        report["rss"] = current_rss()
+        report["peak_rss_so_far"] = peak_rss()
+        report["top_allocation_sites"] = [
+            {
+                "site": str(stat.traceback),
+                "size_diff": stat.size_diff,
+                "count_diff": stat.count_diff,
+            }
+            for stat in growth[:MEMORY_TOP_SITES]
+        ]
+
+
+@contextlib.contextmanager
+def wmake_dir(name):
+    if current is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        current.wmake_dirs[str(name)] = time.perf_counter() - start
+
+
+def count(name, n=1):
+    if current is not None:
+        current.counters[name] += n
+
+
+# The Profile and the trace events of a worker process, to be returned to the main process and passed to merge.
+# Both are None if they are disabled.
+def take():
+    global current, trace
+    ret = (current, trace)
+    if current is not None:
+        current = Profile()
+    if trace is not None:
+        trace = []
+    return ret
+
+
+def merge(taken):
+    profile, events = taken
+    if current is not None and profile is not None:
+        current.merge(profile)
+    if trace is not None and events is not None:
+        trace.extend(events)
+
+
+def write_report(path, extra):
+    slowest = sorted(current.wmake_dirs.items(), key=lambda x: -x[1])
+    report = {
+        **extra,
+        "phases": {
+            name: {"wall": wall, "cpu": cpu}
+            for name, (wall, cpu) in current.phases.items()
+        },
+        "counters": dict(
+            sorted({**{name: 0 for name in COUNTERS}, **current.counters}.items())
+        ),
+        "slowest_wmake_dirs": [
+            {"wmake_dir": name, "seconds": seconds}
+            for name, seconds in slowest[:SLOWEST_WMAKE_DIRS]
+        ],
+    }
+    path.write_text(json.dumps(report, indent=2) + "\n")
+
+
+def write_memory_report(path, extra):
+    stats = take_snapshot().statistics("lineno")
+    report = {
+        **extra,
+        "peak_rss": peak_rss(),
+        "phases": memory_phases,
+        "top_allocation_sites": [
+            {"site": str(stat.traceback), "size": stat.size, "count": stat.count}
+            for stat in stats[:MEMORY_TOP_SITES]
+        ],
+    }
+    path.write_text(json.dumps(report, indent=2) + "\n")
+
+
+def write_trace(path):
+    names = [
+        {
+            "name": "process_name",
+            "ph": "M",
+            "pid": pid,
+            "args": {"name": "main" if pid == os.getpid() else f"worker {pid}"},
+        }
+        for pid in sorted({event["pid"] for event in trace})
+    ]
+    path.write_text(
+        json.dumps({"traceEvents": names + trace, "displayTimeUnit": "ms"}) + "\n"
+    )
+
+#------------------------------------------------------------------------------
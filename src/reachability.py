@@ -0,0 +1,180 @@
+#!/bin/false
+#--------------------------------*- python -*----------------------------------
+#
+# Copyright (C) 2023 Volker Weissmann
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+# Description
+#   Answers "is there a path from a to b" for a directed graph. The graph is
+#   condensed into its strongly connected components and the set of nodes
+#   reachable from every component is stored as a Python int that is used as
+#   a bitset, so that building it takes O(V + E) big integer operations and
+#   every query is a single bit test.
+#
+#------------------------------------------------------------------------------
+
+import random
+
+
+# Returns the strongly connected components of graph as lists, in reverse topological order: Every component comes
+# after all components it has an edge to. graph maps every node to an iterable of its successors. Successors that are
+# not a key of graph are treated as nodes without successors.
+# This is Tarjan's algorithm, but without recursion, because Python's recursion limit is too low for deep graphs.
+def strongly_connected_components(graph):
+    index = {}
+    lowlink = {}
+    on_stack = set()
+    stack = []
+    ret = []
+    for root in graph:
+        if root in index:
+            continue
+        index[root] = lowlink[root] = len(index)
+        stack.append(root)
+        on_stack.add(root)
+        # Every item is a node and an iterator over its successors that have not been looked at yet
+        work = [(root, iter(graph.get(root, ())))]
+        while len(work) != 0:
+            node, successors = work[-1]
+            descended = False
+            for succ in successors:
+                if succ not in index:
+                    index[succ] = lowlink[succ] = len(index)
+                    stack.append(succ)
+                    on_stack.add(succ)
+                    work.append((succ, iter(graph.get(succ, ()))))
+                    descended = True
+                    break
+                if succ in on_stack:
+                    lowlink[node] = min(lowlink[node], index[succ])
+            if descended:
+                continue
+            work.pop()
+            if len(work) != 0:
+                parent = work[-1][0]
+                lowlink[parent] = min(lowlink[parent], lowlink[node])
+            if lowlink[node] == index[node]:
+                component = []
+                while True:
+                    member = stack.pop()
+                    on_stack.discard(member)
+                    component.append(member)
+                    if member == node:
+                        break
+                ret.append(component)
+    return ret
+
+
+class Reachability:
+    # nodes[i] is the node that is represented by the bit 1 << i
+    nodes: list
+    # Maps every node to its bit number
+    bit: dict
+    # Maps every node to the number of its component in components
+    component_of: dict
+    components: list
+    # reach[c] has the bits of all nodes that can be reached from the component c with a path of length >= 1
+    reach: list
+
+    def __init__(self, graph):
+        self.components = strongly_connected_components(graph)
+        self.nodes = []
+        self.bit = {}
+        self.component_of = {}
+        for c, component in enumerate(self.components):
+            for node in component:
+                self.bit[node] = len(self.nodes)
+                self.nodes.append(node)
+                self.component_of[node] = c
+        self.reach = []
+        for c, component in enumerate(self.components):
+            bits = 0
+            members = 0
+            for node in component:
+                members |= 1 << self.bit[node]
+            cyclic = len(component) > 1
+            for node in component:
+                for succ in graph.get(node, ()):
+                    succ_c = self.component_of[succ]
+                    if succ_c == c:
+                        cyclic = True
+                    else:
+                        # Components are numbered in reverse topological order, so self.reach[succ_c] is already known
+                        bits |= (1 << self.bit[succ]) | self.reach[succ_c]
+            if cyclic:
+                bits |= members
+            self.reach.append(bits)
+
+    # Returns True if there is a path of length >= 1 from a to b
+    def reachable(self, a, b):
+        return (self.reach[self.component_of[a]] >> self.bit[b]) & 1 == 1
+
+    # Returns a bitset of all nodes that can be reached from node
+    def descendants_bits(self, node):
+        return self.reach[self.component_of[node]]
+
+    def nodes_of_bits(self, bits):
+        ret = []
+        while bits != 0:
+            low = bits & -bits
+            ret.append(self.nodes[low.bit_length() - 1])
+            bits ^= low
+        return ret
+
+    # Returns a set of all nodes that can be reached from node
+    def descendants(self, node):
+        return set(self.nodes_of_bits(self.descendants_bits(node)))
+
+    def bits_of(self, nodes):
+        ret = 0
+        for node in nodes:
+            ret |= 1 << self.bit[node]
+        return ret
+
+
+# The nodes that can be reached from node with a path of length >= 1, by a plain depth first search
+def naive_descendants(graph, node):
+    seen = set()
+    stack = list(graph.get(node, ()))
+    while len(stack) != 0:
+        x = stack.pop()
+        if x not in seen:
+            seen.add(x)
+            stack.extend(graph.get(x, ()))
+    return seen
+
+
+def random_graph(rng, num_nodes, edge_probability):
+    nodes = list(range(num_nodes))
+    rng.shuffle(nodes)
+    graph = {}
+    for a in nodes:
+        graph[a] = {b for b in range(num_nodes + 2) if rng.random() < edge_probability}
+    return graph
+
+
+def unittests_reachability(num_graphs=500, seed=0):
+    rng = random.Random(seed)
+    for _ in range(num_graphs):
+        graph = random_graph(rng, rng.randint(1, 15), rng.choice([0.05, 0.1, 0.2, 0.4]))
+        nodes = set(graph) | {b for succs in graph.values() for b in succs}
+        descendants = {a: naive_descendants(graph, a) for a in nodes}
+        components = strongly_connected_components(graph)
+        # Every node is in exactly one component, and the component of a is a and everything that a reaches and that
+        # reaches a
+        assert sorted(x for c in components for x in c) == sorted(nodes)
+        for c in components:
+            for a in c:
+                assert set(c) == {a} | {b for b in descendants[a] if a in descendants[b]}
+        # Reverse topological order
+        position = {x: i for i, c in enumerate(components) for x in c}
+        for a in nodes:
+            for b in graph.get(a, ()):
+                assert position[b] <= position[a]
+        reach = Reachability(graph)
+        for a in nodes:
+            assert reach.descendants(a) == descendants[a]
+            for b in nodes:
+                assert reach.reachable(a, b) == (b in descendants[a])
+
+#------------------------------------------------------------------------------
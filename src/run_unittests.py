@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+#--------------------------------*- python -*----------------------------------
+#
+# Copyright (C) 2023 Volker Weissmann
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+# Description
+#   Runs the unittests_* functions of the modules in this directory. Every one
+#   of them raises an AssertionError if something is wrong.
+#
+#   Usage: run_unittests.py
+#
+#------------------------------------------------------------------------------
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# meson_codegen has to be imported before grouped_topo_sort
+from src import meson_codegen
+from src import grouped_topo_sort
+from src import files_parser
+from src import scan_wmake
+from src import mini_make
+from src import reachability
+
+UNITTESTS = [
+    grouped_topo_sort.unittests_graph_stuff,
+    grouped_topo_sort.unittests_calc_nontrivial_sccs,
+    reachability.unittests_reachability,
+    meson_codegen.unittests_topological_sort,
+    meson_codegen.unittests_find_shortest_cycle,
+    files_parser.unittests_files_parser,
+    scan_wmake.unittests_parse_files_file,
+    scan_wmake.unittests_batch_parse_options_files,
+    mini_make.unittests_mini_make,
+]
+
+
+def main():
+    for test in UNITTESTS:
+        test()
+        print(f"{test.__module__}.{test.__name__}: OK")
+
+
+if __name__ == "__main__":
+    main()
+
+#------------------------------------------------------------------------------
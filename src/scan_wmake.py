@@ -12,14 +12,17 @@ import re
 import tempfile
 import subprocess
 from pathlib import Path
-import pickle
 import typing as T
 import os
+import functools
+from collections import Counter
 from enum import Enum
 from .meson_codegen import remove_prefix
 from . import heuristics
-
-ACTIVATE_CACHE = False
+from . import mini_make
+from . import files_parser
+from . import disccache
+from . import profiling
 
 optional_deps = {
     "mpfr": "lib",
@@ -50,35 +53,17 @@ def mangle_name(name):
     return name.replace(".", "_").replace("-", "_").replace("/", "_slash_")
 
 
-# Kind of broken since it does not hash the function arguments
-def disccache(original_func):
-    def new_func(*args, **kwargs):
-        if not ACTIVATE_CACHE:
-            return original_func(*args, **kwargs)
-        fp = Path("disccache") / (original_func.__name__ + ".pickle")
-        if fp.exists():
-            print(f"Loading cache from {fp}")
-            with open(fp, "rb") as pfile:
-                return pickle.load(pfile)
-        else:
-            ret = original_func(*args, **kwargs)
-            with open(fp, "wb") as pfile:
-                pickle.dump(ret, pfile)
-            return ret
-
-    return new_func
+# How many Make/options files were evaluated by mini_make ("python"), how many needed the real make ("make") and how many were found in the disccache ("cache")
+options_evaluations: T.Counter[str] = Counter()
 
 
 # Find all directories that have a subdirectory called Make and are not marked as broken or ignored.
-@disccache
-def find_all_wmake_dirs(PROJECT_ROOT):
+# index is a fs_index.FsIndex of PROJECT_ROOT
+def find_all_wmake_dirs(PROJECT_ROOT, index):
     scanning_disabled = [Path(p) for p in heuristics.scanning_disabled()]
     ret = []
-    for el in PROJECT_ROOT.rglob("Make"):
-        if not os.path.isdir(el):
-            continue
+    for el in index.dirs_with_subdir("Make"):
         el = el.relative_to(PROJECT_ROOT)
-        el = el.parent
         if "codeTemplates" in el.parts:
             continue
         if el in scanning_disabled:
@@ -103,7 +88,51 @@ def commentRemover(text):
     return re.sub(pattern, replacer, text)
 
 
-def parse_options_file(PROJECT_ROOT, wmake_dir):
+# The variables of Make/options that we are interested in. Their values are stored in vardict.
+OPTIONS_VARS = ["$(LIB_INC)", "$(EXE_INC)", "$(LIB_LIBS)", "$(EXE_LIBS)"]
+
+# Maximum number of Make/options files that batch_parse_options_files evaluates with a single make invocation.
+OPTIONS_BATCH_SIZE = 200
+
+
+variable_reference_regex = re.compile(r"\$[({]([^$(){}\s:,]+)[)}]")
+include_regex = re.compile(r"^\s*-?s?include\s", re.MULTILINE)
+
+
+# Returns every file in wmake/rules and the names of the variables referenced in them
+@functools.lru_cache(maxsize=None)
+def rules_files_and_variables(PROJECT_ROOT):
+    files = []
+    names = set()
+    for fp in sorted((PROJECT_ROOT / "wmake" / "rules").rglob("*")):
+        if fp.is_file():
+            files.append(fp)
+            names.update(
+                variable_reference_regex.findall(fp.read_text(errors="replace"))
+            )
+    return files, sorted(names)
+
+
+# Tells disccache which inputs other than Make/options itself influence the value of parse_options_file
+def record_options_file_dependencies(PROJECT_ROOT, wmake_dir):
+    text = (PROJECT_ROOT / wmake_dir / "Make" / "options").read_text()
+    # Undefined variables are taken from the environment
+    for name in variable_reference_regex.findall(text):
+        disccache.depends_on_env(name)
+    if include_regex.search(text):
+        files, names = rules_files_and_variables(PROJECT_ROOT)
+        for fp in files:
+            disccache.depends_on_path(fp)
+        for name in names:
+            disccache.depends_on_env(name)
+
+
+def options_file_path(PROJECT_ROOT, wmake_dir):
+    return [PROJECT_ROOT / wmake_dir / "Make" / "options"]
+
+
+# Returns the contents of Make/options that should be passed to make and the variables that need to be defined before
+def prepare_options_file(PROJECT_ROOT, wmake_dir):
     makefilesource = (PROJECT_ROOT / wmake_dir / "Make" / "options").read_text()
     makefilesource = commentRemover(makefilesource)
 
@@ -123,6 +152,27 @@ def parse_options_file(PROJECT_ROOT, wmake_dir):
         "$(PLIBS)": "-lmpi",
         "$(PFLAGS)": "-DMPICH_SKIP_MPICXX -DOMPI_SKIP_MPICXX",
     }
+    return makefilesource, vardict
+
+
+# varlist contains the evaluated values of OPTIONS_VARS
+def set_options_vars(PROJECT_ROOT, wmake_dir, vardict, varlist):
+    options_path = PROJECT_ROOT / wmake_dir / "Make" / "options"
+    for key, value in zip(OPTIONS_VARS, varlist):
+        vardict[key] = value
+    assert (
+        varlist[0] == "" or varlist[1] == ""
+    ), f"'{options_path}' sets both LIB_INC and EXE_INC"
+    assert (
+        varlist[2] == "" or varlist[3] == ""
+    ), f"'{options_path}' sets both LIB_LIBS and EXE_LIBS"
+    return vardict
+
+
+@disccache.cached(static_inputs=options_file_path)
+def parse_options_file(PROJECT_ROOT, wmake_dir):
+    record_options_file_dependencies(PROJECT_ROOT, wmake_dir)
+    makefilesource, vardict = prepare_options_file(PROJECT_ROOT, wmake_dir)
 
     with tempfile.NamedTemporaryFile("w") as makeout:
         for k, v in vardict.items():
@@ -136,30 +186,155 @@ def parse_options_file(PROJECT_ROOT, wmake_dir):
         # import time
 
         # time.sleep(10000)
-        varlist = (
-            subprocess.check_output(
-                "make -s print_stuff --file " + makeout.name,
-                shell=True,
-                # env={"PATH": os.environ["PATH"]},
+        profiling.count("subprocesses")
+        with profiling.span("make", wmake_dir=str(wmake_dir)):
+            varlist = (
+                subprocess.check_output(
+                    "make -s print_stuff --file " + makeout.name,
+                    shell=True,
+                    # env={"PATH": os.environ["PATH"]},
+                )
+                .decode()
+                .split("\n")
             )
-            .decode()
-            .split("\n")
+    return set_options_vars(PROJECT_ROOT, wmake_dir, vardict, varlist)
+
+
+# Does the same as calling parse_options_file for every wmake_dir, but with only one make and one sh process.
+# All Make/options files are concatenated into one makefile. After each of them, make prints a shell script line for every
+# variable in OPTIONS_VARS and then undefines every variable that was defined in this Make/options file, so
+# that it does not leak into the next one. The shell then does the same word splitting and quote removal that
+# 'echo $(LIB_INC)' in parse_options_file would do.
+# A variable that make already knew before the first Make/options file (e.g. one from the environment) cannot be reset
+# that way. If a Make/options file assigns to one, the origin of the variable changes, and the files after it are
+# evaluated again in a new batch.
+# If something goes wrong, we fall back to parse_options_file for the affected directories.
+def batch_parse_options_files(PROJECT_ROOT, wmake_dirs):
+    ret = {}
+    while len(wmake_dirs) != 0:
+        evaluated, wmake_dirs = evaluate_options_batch(PROJECT_ROOT, wmake_dirs)
+        ret.update(evaluated)
+    return ret
+
+
+# Returns the results of the first directories of wmake_dirs and the directories that still need to be evaluated,
+# because a Make/options file before them changed a variable that make knew before the first one
+def evaluate_options_batch(PROJECT_ROOT, wmake_dirs):
+    marker = "__foam_meson_dir"
+    with tempfile.NamedTemporaryFile("w") as makeout:
+        makeout.write(f"{marker}_inherited := $(.VARIABLES)\n")
+        # "$() " is a space. The spaces in origins like "command line" are replaced, so that every variable is one word.
+        makeout.write(
+            f"{marker}_origins := $(foreach v,$({marker}_inherited),$(v)=$(subst $() ,_,$(origin $(v))))\n"
         )
-    vardict["$(LIB_INC)"] = varlist[0]
-    vardict["$(EXE_INC)"] = varlist[1]
-    vardict["$(LIB_LIBS)"] = varlist[2]
-    vardict["$(EXE_LIBS)"] = varlist[3]
-    assert varlist[0] == "" or varlist[1] == ""
-    assert varlist[2] == "" or varlist[3] == ""
-    return vardict
+        makeout.write(
+            f"{marker}_base_vars := $({marker}_inherited) {marker}_inherited {marker}_origins {marker}_base_vars\n"
+        )
+        vardicts = []
+        for i, wmake_dir in enumerate(wmake_dirs):
+            makefilesource, vardict = prepare_options_file(PROJECT_ROOT, wmake_dir)
+            vardicts.append(vardict)
+            for k, v in vardict.items():
+                makeout.write(k[2:-1] + "=" + v + "\n")
+            makeout.write(makefilesource)
+            makeout.write(f"\n$(info p {marker} {i})\n")
+            # The variables of vardict are assigned again before every Make/options file
+            assigned = " ".join(f"{k[2:-1]}=%" for k in vardict)
+            makeout.write(
+                f"$(info p {marker}_changed $(filter-out $({marker}_origins) {assigned},$(foreach v,$({marker}_inherited),$(v)=$(subst $() ,_,$(origin $(v))))))\n"
+            )
+            for key in OPTIONS_VARS:
+                makeout.write(f"$(info p {key})\n")
+            makeout.write(
+                f"$(foreach v,$(filter-out $({marker}_base_vars),$(.VARIABLES)),$(eval override undefine $(v)))\n"
+            )
+        makeout.write("\nprint_stuff: ;\n")
+        makeout.flush()
+        try:
+            profiling.count("subprocesses", 2)
+            with profiling.span("make", wmake_dirs=len(wmake_dirs)):
+                script = subprocess.check_output(
+                    ["make", "-s", "print_stuff", "--file", makeout.name]
+                ).decode()
+            with profiling.span("sh", wmake_dirs=len(wmake_dirs)):
+                output = subprocess.run(
+                    ["sh"],
+                    input="p() { printf '%s\\n' \"$*\"; }\n" + script,
+                    capture_output=True,
+                    check=True,
+                    text=True,
+                ).stdout
+        except subprocess.CalledProcessError:
+            return {
+                wmake_dir: parse_options_file.func(PROJECT_ROOT, wmake_dir)
+                for wmake_dir in wmake_dirs
+            }, []
+
+    lines = output.split("\n")
+    if lines[-1] == "":
+        lines.pop()
+    starts = {}
+    for pos, line in enumerate(lines):
+        if line.startswith(marker + " "):
+            starts[remove_prefix(line, marker)] = pos
+    ret = {}
+    for i, wmake_dir in enumerate(wmake_dirs):
+        start = starts.get(str(i))
+        end = starts.get(str(i + 1), len(lines))
+        if start is None or end - start != len(OPTIONS_VARS) + 2:
+            # E.g. a variable that contains a newline
+            ret[wmake_dir] = parse_options_file.func(PROJECT_ROOT, wmake_dir)
+            changed = start is None or lines[start + 1] != f"{marker}_changed"
+        else:
+            ret[wmake_dir] = set_options_vars(
+                PROJECT_ROOT, wmake_dir, vardicts[i], lines[start + 2 : end]
+            )
+            changed = lines[start + 1] != f"{marker}_changed"
+        if changed:
+            return ret, wmake_dirs[i + 1 :]
+    return ret, []
+
+
+# Like parse_options_file, but without spawning make. Raises mini_make.UnsupportedMakeConstruct if Make/options is too complicated for mini_make.
+def python_parse_options_file(PROJECT_ROOT, wmake_dir):
+    makefilesource, vardict = prepare_options_file(PROJECT_ROOT, wmake_dir)
+    varlist = mini_make.evaluate(
+        makefilesource,
+        {k[2:-1]: v for k, v in vardict.items()},
+        [k[2:-1] for k in OPTIONS_VARS],
+    )
+    return set_options_vars(PROJECT_ROOT, wmake_dir, vardict, varlist)
 
 
-@disccache
+# Does the same as calling parse_options_file for every wmake_dir, but it uses mini_make where possible and
+# evaluates the rest in batches.
 def all_parse_options_file(PROJECT_ROOT, wmake_dirs):
-    return {
-        wmake_dir: parse_options_file(PROJECT_ROOT, wmake_dir)
-        for wmake_dir in wmake_dirs
-    }
+    ret = {}
+    misses = {}
+    fallback = []
+    for wmake_dir in wmake_dirs:
+        key, found, value = parse_options_file.lookup(PROJECT_ROOT, wmake_dir)
+        if found:
+            ret[wmake_dir] = value
+            options_evaluations["cache"] += 1
+            continue
+        misses[wmake_dir] = key
+        try:
+            ret[wmake_dir] = python_parse_options_file(PROJECT_ROOT, wmake_dir)
+            options_evaluations["python"] += 1
+        except mini_make.UnsupportedMakeConstruct:
+            fallback.append(wmake_dir)
+            options_evaluations["make"] += 1
+    for i in range(0, len(fallback), OPTIONS_BATCH_SIZE):
+        ret.update(
+            batch_parse_options_files(PROJECT_ROOT, fallback[i : i + OPTIONS_BATCH_SIZE])
+        )
+    for wmake_dir, key in misses.items():
+        if key is not None:
+            with disccache.recording() as deps:
+                record_options_file_dependencies(PROJECT_ROOT, wmake_dir)
+            parse_options_file.store(key, ret[wmake_dir], deps)
+    return {wmake_dir: ret[wmake_dir] for wmake_dir in wmake_dirs}
 
 
 class Include:
@@ -219,102 +394,88 @@ class CverSourcefile(GeneralizedSourcefile):
 
 class Intermediate:
     srcs: T.List[GeneralizedSourcefile]
+    # (meson condition, paths) for source files that are only used if the condition is true when meson configures
+    conditional_srcs: T.List[T.Tuple[str, T.List[Path]]]
     varname: str
     typ: TargetType
 
-    def __init__(self, srcs, varname, typ):
+    def __init__(self, srcs, conditional_srcs, varname, typ):
         self.srcs = srcs
+        self.conditional_srcs = conditional_srcs
         self.varname = varname
         self.typ = typ
 
+    # The source files inside of #if blocks that depend on meson options, as meson if blocks
+    def conditional_blocks(self):
+        blocks = []
+        for condition, paths in self.conditional_srcs:
+            paths_quoted = ", ".join(f"'<PATH>{x}</PATH>'" for x in paths)
+            blocks.append(f"if {condition}\n    srcfiles += files({paths_quoted})\nendif")
+        return "\n".join(blocks)
 
-def substitute(vardict, cur):
-    while True:
-        old = cur
-        for el in vardict:
-            cur = cur.replace(el, vardict[el])
-        if cur == old:
-            return cur
 
+def files_file_path(PROJECT_ROOT, api_version, wmake_dir):
+    return [PROJECT_ROOT / wmake_dir / "Make" / "files"]
 
-# find -name files -type f -not -path ./wmake/makefiles/files | xargs rg "#" --
-hardcoded_specials = {
-    "precision": """
-#if !defined(WM_DP)
-primitives/Vector/doubleVector/doubleVector.C
-primitives/Tensor/doubleTensor/doubleTensor.C
-#endif
-#if !defined(WM_SP) && !defined(WM_SPDP)
-primitives/Vector/floatVector/floatVector.C
-primitives/Tensor/floatTensor/floatTensor.C
-#endif
-""",
-    "sunstack1": """
-#ifdef SunOS64
-dummyPrintStack.C
-#else
-printStack.C
-#endif
-""",
-    "sunstack2": """
-#ifdef __sun__
-printStack/dummyPrintStack.C
-#else
-printStack/printStack.C
-#endif
-""",
-}
 
-special_oldnewstub = """
-#if OPENFOAM > 1812
-newStub.C
-#else
-oldStub.C
-#endif
-"""
+target_regex = re.compile(r"(EXE|LIB)\s*=(.*)")
+files_assignment_regex = re.compile(r"([A-Za-z0-9_]+)\s*:?=(.*)")
 
 
+@disccache.cached(static_inputs=files_file_path)
 def parse_files_file(PROJECT_ROOT, api_version, wmake_dir):
-    specials = []
     path = PROJECT_ROOT / wmake_dir / "Make" / "files"
-    src = path.read_text()
-    src = commentRemover(src)
-
-    for special, hardcoded in hardcoded_specials.items():
-        if hardcoded in src:
-            specials.append(special)
-            src = src.replace(hardcoded, "\n")
-
-    if special_oldnewstub in src:
-        if int(api_version) > 1812:
-            src = src.replace(special_oldnewstub, "\nnewStub.C\n")
-        else:
-            src = src.replace(special_oldnewstub, "\noldStub.C\n")
+    try:
+        lines = files_parser.preprocess(
+            path.read_text(), files_parser.known_macros(api_version)
+        )
+    except files_parser.UnsupportedPreprocessorConstruct as e:
+        raise EncountedComplexConfig(
+            f"Unable to preprocess '{path}' because of {e}"
+        ) from e
+
+    def unknown_line(line):
+        return EncountedComplexConfig(
+            f"The file '{path}' contains the following line, but I do not know how to handle that:\n{line}"
+        )
 
-    lines = src.split("\n")
-    lines = [line.strip() for line in lines if line.strip() != ""]
+    def expand(line):
+        try:
+            line = variables.expand(line)
+        except files_parser.UnsupportedPreprocessorConstruct as e:
+            raise EncountedComplexConfig(f"Unable to parse '{path}' because of {e}")
+        if "$" in line:
+            raise EncountedComplexConfig(
+                f"The file '{path}' contains the following line, but I do not know the value of the variable in it:\n{line}"
+            )
+        return line
 
     srcs = []
+    conditional_srcs = []
     varname = None
     typ = None
-    vardict = {}
-    for line in lines:
-        if line.startswith("EXE"):
-            line = remove_prefix(line, "EXE")
-            line = remove_prefix(line, "=")
+    variables = files_parser.Variables()
+    for condition, line in lines:
+        target = target_regex.fullmatch(line)
+        assignment = files_assignment_regex.fullmatch(line)
+        if condition is not None and (target is not None or assignment is not None):
+            raise EncountedComplexConfig(
+                f"The file '{path}' contains the following line inside of a block that depends on a meson option, but I do not know how to handle that:\n{line}"
+            )
+        if target is not None and target.group(1) == "EXE":
+            line = target.group(2).strip()
             if line.startswith("$(FOAM_APPBIN)"):
                 line = remove_prefix(line, "$(FOAM_APPBIN)/")
             elif line.startswith("$(FOAM_USER_APPBIN)"):
                 line = remove_prefix(line, "$(FOAM_USER_APPBIN)/")
             else:
                 line = remove_prefix(line, "$(PWD)/")
-            assert "$" not in line
+            line = expand(line)
             assert varname is None
             varname = "exe_" + mangle_name(line)
             typ = TargetType.exe
-        elif line.startswith("LIB"):
-            line = remove_prefix(line, "LIB")
-            line = remove_prefix(line, "=")
+        elif target is not None:
+            line = target.group(2).strip()
             if line.startswith("$(FOAM_LIBBIN)/"):
                 line = remove_prefix(line, "$(FOAM_LIBBIN)/")
             elif line.startswith("$(FOAM_MPI_LIBBIN)/"):
@@ -323,28 +484,23 @@ def parse_files_file(PROJECT_ROOT, api_version, wmake_dir):
                 line = remove_prefix(line, "$(FOAM_USER_LIBBIN)/")
             if line == "":
                 continue
+            line = expand(line)
             line = "/".join(
                 line.split("/")[:-1] + [remove_prefix(line.split("/")[-1], "lib")]
             )
-            assert "$" not in line
             assert varname is None
             varname = "lib_" + mangle_name(line)
             typ = TargetType.lib
-        elif "=" in line:
-            ar = line.split("=")
-            assert len(ar) == 2, line
-            vardict["$(" + ar[0].rstrip() + ")"] = ar[1].strip()
-        elif " " not in line:
+        elif assignment is not None:
+            variables.define(assignment.group(1), assignment.group(2).strip())
+        elif " " not in line and "\t" not in line:
+            line = expand(line)
             if line.endswith(".lyy-m4"):
-                line = substitute(vardict, line)
-                assert "$" not in line
-                srcs.append(LyyM4Sourcefile(PROJECT_ROOT / wmake_dir / line))
+                src = LyyM4Sourcefile(PROJECT_ROOT / wmake_dir / line)
             elif line.endswith(".L"):
-                assert "$" not in line
-                srcs.append(FlexgenSourcefile(PROJECT_ROOT / wmake_dir / line))
+                src = FlexgenSourcefile(PROJECT_ROOT / wmake_dir / line)
             elif line.endswith(".Cver"):
-                assert "$" not in line
-                srcs.append(CverSourcefile(PROJECT_ROOT / wmake_dir / line))
+                src = CverSourcefile(PROJECT_ROOT / wmake_dir / line)
             elif (
                 line.endswith(".hpp")
                 or line.endswith(".H")
@@ -353,24 +509,26 @@ def parse_files_file(PROJECT_ROOT, api_version, wmake_dir):
                 or line.endswith(".cc")
                 or line.endswith(".cxx")
             ):
-                line = substitute(vardict, line)
-                assert "$" not in line
-                srcs.append(SimpleSourcefile(PROJECT_ROOT / wmake_dir / line))
+                src = SimpleSourcefile(PROJECT_ROOT / wmake_dir / line)
             else:
+                raise unknown_line(line)
+            if condition is None:
+                srcs.append(src)
+            elif not isinstance(src, SimpleSourcefile):
                 raise EncountedComplexConfig(
-                    f"The file '{path}' contains the following line, but I do not know how to handle that:\n{line}"
+                    f"The file '{path}' contains the following line inside of a block that depends on a meson option, but only plain source files are supported there:\n{line}"
                 )
+            elif len(conditional_srcs) != 0 and conditional_srcs[-1][0] == condition:
+                conditional_srcs[-1][1].append(src.path)
+            else:
+                conditional_srcs.append((condition, [src.path]))
         else:
-            raise EncountedComplexConfig(
-                f"The file '{path}' contains the following line, but I do not know how to handle that:\n{line}"
-            )
-    return (
-        Intermediate(
-            srcs=srcs,
-            varname=varname,
-            typ=typ,
-        ),
-        specials,
+            raise unknown_line(line)
+    return Intermediate(
+        srcs=srcs,
+        conditional_srcs=conditional_srcs,
+        varname=varname,
+        typ=typ,
     )
 
 
@@ -473,4 +631,77 @@ def calc_libs(optionsdict, typ: TargetType):
                 order_depends.append("lib_" + mangle_name(el))
     return order_depends, dependencies
 
+
+def unittests_parse_files_file():
+    with tempfile.TemporaryDirectory() as tmp:
+        root = Path(tmp)
+        make_dir = root / "src" / "OpenFOAM" / "Make"
+        make_dir.mkdir(parents=True)
+        (make_dir / "files").write_text(
+            """
+prims = primitives
+global/global.C
+#if !defined(WM_DP)
+$(prims)/doubleVector.C
+$(prims)/doubleTensor.C
+#endif
+#ifdef __sun__
+printStack/dummyPrintStack.C
+#else
+printStack/printStack.C
+#endif
+#if OPENFOAM > 1812
+newStub.C
+#else
+oldStub.C
+#endif
+
+LIB = $(FOAM_LIBBIN)/libOpenFOAM
+"""
+        )
+        inter = parse_files_file(root, "2006", Path("src/OpenFOAM"))
+        d = root / "src" / "OpenFOAM"
+        assert inter.varname == "lib_OpenFOAM"
+        assert [src.path for src in inter.srcs] == [d / "global/global.C", d / "newStub.C"]
+        assert inter.conditional_blocks() == (
+            "if get_option('WM_PRECISION_OPTION') != 'DP'\n"
+            f"    srcfiles += files('<PATH>{d}/primitives/doubleVector.C</PATH>', '<PATH>{d}/primitives/doubleTensor.C</PATH>')\n"
+            "endif\n"
+            "if host_machine.system() == 'sunos'\n"
+            f"    srcfiles += files('<PATH>{d}/printStack/dummyPrintStack.C</PATH>')\n"
+            "endif\n"
+            "if host_machine.system() != 'sunos'\n"
+            f"    srcfiles += files('<PATH>{d}/printStack/printStack.C</PATH>')\n"
+            "endif"
+        ), inter.conditional_blocks()
+
+
+# Make/options files that assign to variables make knew before, one from the environment and one of its defaults
+BATCH_OPTIONS_FILES = {
+    "a": "FOAM_MESON_TEST_INC += -Ia\nEXE_INC = $(FOAM_MESON_TEST_INC)\n",
+    "b": "EXE_INC = $(FOAM_MESON_TEST_INC)\n",
+    "c": "CXX = mycxx\nEXE_INC = -D$(CXX)\n",
+    "d": "EXE_INC = -D$(CXX) $(FOAM_MESON_TEST_INC)\n",
+    "e": "LIB_INC = -Ie\n",
+}
+
+
+def unittests_batch_parse_options_files():
+    old_environ = dict(os.environ)
+    os.environ["FOAM_MESON_TEST_INC"] = "-Ibase"
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp)
+            for name, text in BATCH_OPTIONS_FILES.items():
+                (root / name / "Make").mkdir(parents=True)
+                (root / name / "Make" / "options").write_text(text)
+            wmake_dirs = [Path(name) for name in BATCH_OPTIONS_FILES]
+            batch = batch_parse_options_files(root, wmake_dirs)
+            for wmake_dir in wmake_dirs:
+                expected = parse_options_file.func(root, wmake_dir)
+                assert batch[wmake_dir] == expected, (wmake_dir, batch[wmake_dir], expected)
+    finally:
+        os.environ.clear()
+        os.environ.update(old_environ)
+
 #------------------------------------------------------------------------------
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+#--------------------------------*- python -*----------------------------------
+#
+# Copyright (C) 2023 Volker Weissmann
+# SPDX-License-Identifier: GPL-3.0-or-later
+#
+# Description
+#   Creates a synthetic tree that looks like an OpenFOAM repository to
+#   generate_meson_build.py: libraries under src/ (some of them nested in the
+#   directory of another library), solvers, utilities and tests under
+#   applications/, Make/files with variables and #if blocks, and Make/options
+#   with -I/-l fan-out. Some directories depend on each other in a way that
+#   forces grouped_topo_sort to move targets. The source files are empty.
+#
+#   Usage: synthetic_foam.py DIR [--scale S] [--seed N]
+#   --scale 1 creates about as many wmake directories as OpenFOAM has.
+#
+#------------------------------------------------------------------------------
+
+import os
+import random
+import argparse
+from pathlib import Path
+
+# The number of libraries and applications at scale 1
+NUM_LIBS = 300
+NUM_EXES = 600
+# The number of pairs of directories that depend on each other at scale 1
+NUM_HOIST_CYCLES = 5
+
+# Libraries only depend on libraries of the same or an earlier layer
+LIB_LAYERS = [
+    ["OpenFOAM"],
+    ["fileFormats", "surfMesh", "meshTools"],
+    ["finiteVolume", "dynamicMesh", "parallel"],
+    ["thermophysicalModels", "TurbulenceModels", "transportModels"],
+    ["lagrangian", "regionModels", "combustionModels", "functionObjects"],
+]
+EXE_CATEGORIES = [
+    "applications/solvers/basic",
+    "applications/solvers/incompressible",
+    "applications/solvers/compressible",
+    "applications/solvers/multiphase",
+    "applications/utilities/mesh/generation",
+    "applications/utilities/mesh/manipulation",
+    "applications/utilities/preProcessing",
+    "applications/utilities/postProcessing",
+    "applications/utilities/parallelProcessing",
+    "applications/test",
+]
+SOURCE_SUBDIRS = ["fields", "derived", "models", "interpolation", "schemes", "tools"]
+
+
+class Library:
+    def __init__(self, name, directory, layer):
+        self.name = name
+        self.directory = directory
+        self.layer = layer
+
+
+def write(path, text):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text)
+
+
+def continued(items):
+    return " \\\n    ".join(items)
+
+
+def include_flag(lib):
+    return f"-I$(LIB_SRC)/{os.path.relpath(lib.directory, 'src')}/lnInclude"
+
+
+# Returns the contents of Make/files and the source files it mentions
+def files_file(rng, target_line):
+    sources = []
+    lines = []
+    variables = rng.sample(SOURCE_SUBDIRS, rng.randint(0, 3))
+    for var in variables:
+        lines.append(f"{var} = {var}Dir")
+    lines.append("")
+    for i in range(rng.randint(1, 25)):
+        if len(variables) != 0 and rng.random() < 0.6:
+            var = rng.choice(variables)
+            lines.append(f"$({var})/s{i}.C")
+            sources.append(f"{var}Dir/s{i}.C")
+        else:
+            lines.append(f"s{i}.C")
+            sources.append(f"s{i}.C")
+    if rng.random() < 0.1:
+        lines += ["", "#if !defined(WM_DP)", "single.C", "#endif"]
+        sources.append("single.C")
+    if rng.random() < 0.1:
+        lines += ["", "/* Not compiled", "old.C", "*/"]
+    lines += ["", target_line, ""]
+    return "\n".join(lines), sources
+
+
+def options_file(rng, inc_var, libs_var, includes, libs):
+    parts = []
+    if rng.random() < 0.1:
+        parts.append("sinclude $(GENERAL_RULES)/mplib$(WM_MPLIB)\n")
+    flags = ["-DNoUnused"] if rng.random() < 0.2 else []
+    if rng.random() < 0.05:
+        flags.append("$(PFLAGS)")
+    parts.append(f"{inc_var} = \\\n    {continued(flags + includes)}\n")
+    parts.append(f"{libs_var} = \\\n    {continued(libs)}\n")
+    # Not understood by mini_make, so make is spawned for these
+    if rng.random() < 0.03:
+        parts.append(f"ifeq ($(WM_LABEL_SIZE),64)\n{inc_var} += -DLABEL64\nendif\n")
+    return "\n".join(parts)
+
+
+def make_wmake_dir(root, directory, files_text, sources, options_text):
+    write(root / directory / "Make" / "files", files_text)
+    write(root / directory / "Make" / "options", options_text)
+    for src in sources:
+        write(root / directory / src, "")
+
+
+def make_library(rng, root, lib, deps, header_only):
+    files_text, sources = files_file(rng, f"LIB = $(FOAM_LIBBIN)/lib{lib.name}")
+    options_text = options_file(
+        rng,
+        "EXE_INC",
+        "LIB_LIBS",
+        [include_flag(d) for d in deps + header_only],
+        [f"-l{d.name}" for d in deps],
+    )
+    make_wmake_dir(root, lib.directory, files_text, sources, options_text)
+
+
+def make_synthetic_tree(root, scale=1.0, seed=0):
+    rng = random.Random(seed)
+    root = Path(root)
+    write(root / "bin" / "foamEtcFile", "")
+    write(root / "META-INFO" / "api-info", "api=2006\npatch=0\n")
+    write(root / "wmake" / "rules" / "General" / "mpi-rules", "")
+    (root / "etc").mkdir(parents=True, exist_ok=True)
+    (root / "src" / "OSspecific" / "POSIX" / "signals").mkdir(parents=True, exist_ok=True)
+
+    libs = []
+    posix = Library("OSspecific", "src/OSspecific/POSIX", -1)
+    make_wmake_dir(
+        root,
+        posix.directory,
+        "POSIX.C\n\nLIB = $(FOAM_LIBBIN)/libOSspecific\n",
+        ["POSIX.C"],
+        "",
+    )
+    openfoam = Library("OpenFOAM", "src/OpenFOAM", 0)
+    make_wmake_dir(
+        root,
+        openfoam.directory,
+        "global/global.C\nprims = primitives\n$(prims)/a.C\n\nLIB = $(FOAM_LIBBIN)/libOpenFOAM\n",
+        ["global/global.C", "primitives/a.C"],
+        f"EXE_INC = {include_flag(posix)}\nLIB_LIBS = -lOSspecific -lz\n",
+    )
+    libs.append(openfoam)
+
+    for i in range(round(NUM_LIBS * scale)):
+        layer = rng.randrange(1, len(LIB_LAYERS))
+        group = rng.choice(LIB_LAYERS[layer])
+        nested = [lib for lib in libs if lib.layer == layer and lib.directory.startswith(f"src/{group}/")]
+        if len(nested) != 0 and rng.random() < 0.1:
+            # A library inside of the directory of another library, e.g. src/TurbulenceModels/turbulenceModels/...
+            parent = rng.choice(nested).directory
+        else:
+            parent = f"src/{group}" + "".join(
+                f"/{rng.choice(SOURCE_SUBDIRS)}{rng.randint(0, 3)}"
+                for _ in range(rng.randint(0, 2))
+            )
+        lib = Library(f"{group}{i}", f"{parent}/lib{i}", layer)
+        candidates = [d for d in libs if d.layer < layer]
+        deps = [openfoam] + rng.sample(candidates, min(len(candidates), rng.randint(0, 7)))
+        deps = list(dict.fromkeys(deps))
+        header_only = rng.sample(candidates, min(len(candidates), rng.randint(0, 3)))
+        make_library(rng, root, lib, deps, header_only)
+        libs.append(lib)
+
+    # x and z are in one directory, y in another one, and z -> y -> x
+    for i in range(max(1, round(NUM_HOIST_CYCLES * scale))):
+        x = Library(f"cycleX{i}", f"src/cycle{i}/groupA/x", 1)
+        y = Library(f"cycleY{i}", f"src/cycle{i}/groupB/y", 1)
+        z = Library(f"cycleZ{i}", f"src/cycle{i}/groupA/z", 1)
+        make_library(rng, root, x, [openfoam], [])
+        make_library(rng, root, y, [x], [])
+        make_library(rng, root, z, [y], [])
+        libs.append(z)
+
+    for i in range(round(NUM_EXES * scale)):
+        category = rng.choice(EXE_CATEGORIES)
+        directory = f"{category}/app{i}"
+        files_text, sources = files_file(rng, f"EXE = $(FOAM_APPBIN)/app{i}")
+        # Applications mostly use the lower layers
+        deps = rng.sample(libs, min(len(libs), rng.randint(1, 12)))
+        deps = list(dict.fromkeys([openfoam] + sorted(deps, key=lambda lib: lib.layer)))
+        options_text = options_file(
+            rng,
+            "EXE_INC",
+            "EXE_LIBS",
+            [include_flag(d) for d in deps],
+            [f"-l{d.name}" for d in deps if d is not openfoam],
+        )
+        make_wmake_dir(root, directory, files_text, sources, options_text)
+    return root
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Creates a synthetic OpenFOAM-like tree for benchmarking generate_meson_build.py."
+    )
+    parser.add_argument("directory", type=Path)
+    parser.add_argument(
+        "--scale",
+        type=float,
+        default=1.0,
+        help="1 is about the size of OpenFOAM. Default: %(default)s",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    make_synthetic_tree(args.directory, args.scale, args.seed)
+
+
+if __name__ == "__main__":
+    main()
+
+#------------------------------------------------------------------------------